@@ -0,0 +1,414 @@
+# End-to-end throughput benchmark on synthetic, Reddit-shaped data.
+# test.csv and co_occurrence_table.csv are a few thousand rows, too small to show how a stage scales. This script generates
+# corpora of any size with the real schemas and times every stage on them:
+#  - a comment table with the columns of test.csv (plus vader.title/vader.comment, as in the processed tables), written as
+#    CSV chunk by chunk, with authors, threads and words drawn from Zipf-like distributions so that vocabularies, reply
+#    graphs and duplicate titles grow with the corpus as in a real dump,
+#  - a Pushshift-style .zst NDJSON dump of comment objects (the fields tocsv.py extracts: author, body, created_utc, ...).
+# Every stage runs in a fresh Python process (python benchmark.py stage ...), so imports, caches and memory of one stage
+# do not leak into the next, and its peak RSS (VmHWM of the process, and ru_maxrss of its own children such as worker
+# pools) is the stage's alone. Results (seconds, rows/sec, peak RSS per stage and size, plus the machine and the git commit)
+# are saved as JSON; `compare` prints the speedup of every stage between two result files. With several sizes the
+# report also gives the scaling exponent of every stage (slope of log(seconds) over log(rows); 1.0 = linear).
+# Stages whose dependencies are missing (e.g. spaCy models for noun phrases) are recorded as skipped with the reason.
+
+# call this like:
+# python benchmark.py run --sizes 1e4,1e5,1e6 --output benchmark.json
+# python benchmark.py run --sizes 1e5 --stages vader,ngrams,centrality --output after.json
+# python benchmark.py compare before.json after.json
+# python benchmark.py generate comments.csv 1e6 --dump RC_synthetic.zst
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+COMMENT_COLUMNS = ['id', 'structure', 'post_date', 'post_date_unix', 'comm_id', 'comm_date', 'comm_date_unix', 'num_comments',
+                   'subreddit', 'upvote_prop', 'post_score', 'author', 'user', 'comment_score', 'controversiality', 'comment',
+                   'title', 'post_text', 'link', 'domain', 'url', 'thread_id', 'vader.title', 'vader.comment']
+DUMP_FIELDS = 'author,body,created_utc,subreddit,score,id,link_id,parent_id,controversiality'
+SUBREDDITS = ['climatechange', 'climateskeptics', 'environment', 'science', 'energy', 'climate', 'collapse', 'politics']
+# The most frequent words, in rank order; the rest of the vocabulary is made up of syllables
+COMMON_WORDS = ['the', 'to', 'and', 'of', 'a', 'is', 'in', 'that', 'it', 'for', 'you', 'this', 'not', 'are', 'on', 'be',
+                'climate', 'change', 'with', 'as', 'have', 'they', 'but', 'we', 'was', 'warming', 'carbon', 'co2', 'people',
+                'global', 'science', 'energy', 'temperature', 'data', 'models', 'emissions', 'hoax', 'solar', 'ice', 'sea',
+                'level', 'years', 'scientists', 'evidence', 'fossil', 'fuels', 'crisis', 'weather', 'record', 'heat']
+SYLLABLES = ['ba', 'ce', 'di', 'fo', 'gu', 'ha', 'ke', 'li', 'mo', 'nu', 'pa', 're', 'si', 'to', 'vu', 'wa', 'xe', 'yi', 'zo', 'qua']
+START_DATE = pd.Timestamp('2023-11-01')
+STAGES = ['zst_to_table', 'vader', 'noun_phrases', 'ngrams', 'cooccurrence', 'centrality', 'rollup', 'sqlite_load']
+
+
+def vocabulary(size=50000):
+    """COMMON_WORDS followed by made-up words of two to four syllables, size words in all."""
+    rng = np.random.default_rng(12345)
+    syllables = np.array(SYLLABLES, dtype=object)
+    made_up = pd.Index([], dtype=object)
+    while len(COMMON_WORDS) + len(made_up) < size:
+        draws = 2 * size
+        words = syllables[rng.integers(0, len(SYLLABLES), draws)] + syllables[rng.integers(0, len(SYLLABLES), draws)]
+        for extra in (rng.random(draws) < 0.6, rng.random(draws) < 0.3):
+            words = np.where(extra, words + syllables[rng.integers(0, len(SYLLABLES), draws)], words)
+        made_up = made_up.append(pd.Index(words, dtype=object)).unique()
+    made_up = made_up[~made_up.isin(COMMON_WORDS)]
+    return np.concatenate([np.array(COMMON_WORDS, dtype=object), made_up.to_numpy(dtype=object)[:size - len(COMMON_WORDS)]])
+
+
+# Probabilities of ranks 1..n under Zipf's law with exponent s
+def zipf_weights(n, s=1.07):
+    weights = 1.0 / np.arange(1, n + 1) ** s
+    return weights / weights.sum()
+
+
+class CorpusGenerator:
+    """
+    Draws synthetic comments: Zipf-distributed words, authors, threads and subreddits, dates spread over `days` days.
+    The same seed and sizes always give the same corpus.
+    """
+
+    def __init__(self, seed=0, vocabulary_size=50000, n_authors=None, n_threads=None, days=30):
+        self.rng = np.random.default_rng(seed)
+        self.words = vocabulary(vocabulary_size)
+        self.word_weights = zipf_weights(len(self.words))
+        self.n_authors = n_authors
+        self.n_threads = n_threads
+        self.days = days
+        self.rows = 0
+
+    # Texts whose lengths are drawn around mean_words (at least one word each)
+    def texts(self, n, mean_words=30):
+        lengths = np.maximum(1, self.rng.lognormal(np.log(mean_words), 0.8, n).astype(np.int64))
+        words = self.words[self.rng.choice(len(self.words), lengths.sum(), p=self.word_weights)]
+        ends = np.cumsum(lengths)
+        return [' '.join(words[end - length:end]) + '.' for end, length in zip(ends.tolist(), lengths.tolist())]
+
+    # Zipf-distributed ids in [0, n): a few very active authors or busy threads and a long tail
+    def ranks(self, size, n):
+        return np.minimum(self.rng.zipf(1.5, size) - 1, n - 1)
+
+    def comments(self, n):
+        """A DataFrame of n comments with the columns of test.csv plus vader.title and vader.comment."""
+        rng = self.rng
+        n_authors = self.n_authors or max(10, n // 20)
+        n_threads = self.n_threads or max(5, n // 15)
+        start = self.rows
+        self.rows += n
+        thread = self.ranks(n, n_threads)
+        subreddit = np.array(SUBREDDITS, dtype=object)[thread % len(SUBREDDITS)]
+        thread_id = np.char.add('t', thread.astype(str)).astype(object)
+        post_time = START_DATE.value // 10**9 + (thread * 7919 % (self.days * 86400))
+        comm_time = post_time + rng.integers(60, 3 * 86400, n)
+        author = np.char.add('user_', self.ranks(n, n_authors).astype(str)).astype(object)
+        parent = np.char.add('user_', self.ranks(n, n_authors).astype(str)).astype(object)
+        # Thread titles are drawn from their own generator seeded by the thread, so every row of a thread repeats its title
+        titles = pd.Series(thread).map(pd.Series(CorpusGenerator(seed=17, vocabulary_size=2000).texts(n_threads, 8)))
+        link = ['https://www.reddit.com/r/' + s + '/comments/' + t + '/synthetic/' for s, t in zip(subreddit, thread_id)]
+        post_text = np.full(n, '', dtype=object)
+        has_text = np.flatnonzero(rng.random(n) < 0.2)
+        post_text[has_text] = self.texts(len(has_text), 40)
+        return pd.DataFrame({
+            'id': np.arange(start + 1, start + n + 1),
+            'structure': (rng.integers(1, 50, n)).astype(str),
+            'post_date': pd.to_datetime(post_time, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+            'post_date_unix': post_time,
+            'comm_id': np.char.add('c', np.arange(start, start + n).astype(str)),
+            'comm_date': pd.to_datetime(comm_time, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+            'comm_date_unix': comm_time,
+            'num_comments': rng.integers(1, 500, n),
+            'subreddit': subreddit,
+            'upvote_prop': rng.random(n).round(2),
+            'post_score': rng.integers(0, 1000, n),
+            'author': author,
+            'user': parent,
+            'comment_score': rng.integers(-10, 100, n),
+            'controversiality': (rng.random(n) < 0.05).astype(int),
+            'comment': self.texts(n),
+            'title': titles.to_numpy(dtype=object),
+            'post_text': post_text,
+            'link': link,
+            'domain': np.char.add('self.', subreddit.astype(str)),
+            'url': link,
+            'thread_id': thread_id,
+            'vader.title': rng.uniform(-1, 1, n).round(4),
+            'vader.comment': rng.uniform(-1, 1, n).round(4),
+        }, columns=COMMENT_COLUMNS)
+
+    def dump_records(self, n):
+        """n Pushshift comment objects (dicts) with the fields of the monthly RC_ dumps."""
+        df = self.comments(n)
+        records = df[['author', 'comment', 'comm_date_unix', 'subreddit', 'comment_score', 'comm_id', 'thread_id', 'controversiality']]
+        for author, body, created, subreddit, score, comm_id, thread_id, controversiality in records.itertuples(index=False):
+            yield {'id': comm_id, 'author': author, 'body': body, 'created_utc': int(created), 'subreddit': subreddit,
+                   'subreddit_id': 't5_' + subreddit, 'score': int(score), 'link_id': 't3_' + thread_id,
+                   'parent_id': 't3_' + thread_id, 'controversiality': int(controversiality), 'gilded': 0,
+                   'stickied': False, 'distinguished': None, 'retrieved_on': int(created) + 86400}
+
+
+# A generator whose numbers of authors and threads follow the size of the whole corpus rather than of one chunk
+def corpus_generator(n, seed=0):
+    return CorpusGenerator(seed, n_authors=max(10, n // 20), n_threads=max(5, n // 15))
+
+
+def write_comments(path, n, seed=0, chunksize=100000):
+    """Write n synthetic comments to a CSV file, chunk by chunk."""
+    generator = corpus_generator(n, seed)
+    for i, start in enumerate(range(0, n, chunksize)):
+        generator.comments(min(chunksize, n - start)).to_csv(path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+    return path
+
+
+def write_dump(path, n, seed=0, chunksize=100000):
+    """Write n synthetic comment objects as a zstd-compressed NDJSON dump, as tocsv.py expects."""
+    import zstandard
+    try:
+        import orjson
+        dumps = orjson.dumps
+    except ImportError:
+        dumps = lambda obj: json.dumps(obj).encode()
+    generator = corpus_generator(n, seed)
+    with open(path, 'wb') as f, zstandard.ZstdCompressor(level=3).stream_writer(f) as writer:
+        for start in range(0, n, chunksize):
+            writer.write(b'\n'.join(dumps(record) for record in generator.dump_records(min(chunksize, n - start))) + b'\n')
+    return path
+
+
+# Stages. Each takes the benchmark inputs and a scratch directory and returns the number of rows it processed.
+
+def stage_zst_to_table(inputs, workdir):
+    output = os.path.join(workdir, 'dump.csv')
+    subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, 'tocsv.py'), inputs['dump'], output, DUMP_FIELDS],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with open(output, 'rb') as f:
+        return sum(1 for _ in f) - 1
+
+
+def stage_vader(inputs, workdir):
+    from sentiment import score_csv
+    return score_csv(inputs['comments'], os.path.join(workdir, 'vader.csv'), columns=('comment',))
+
+
+def stage_noun_phrases(inputs, workdir):
+    from nlp_pipeline import FAST_MODEL, load_nlp, extract_noun_phrases
+    from table_io import iter_table
+    nlp = load_nlp(FAST_MODEL)
+    rows = 0
+    for chunk in iter_table(inputs['comments'], columns=['comment']):
+        rows += len(extract_noun_phrases(chunk['comment'].fillna(''), nlp=nlp, batch_size=256, report=False))
+    return rows
+
+
+def stage_ngrams(inputs, workdir):
+    from ngrams import NgramExtractor, save_ngrams, stack_rows
+    from table_io import iter_table
+    extractor = NgramExtractor((2,), COMMON_WORDS[:25])
+    parts = [extractor.transform_all(chunk['comment']) for chunk in iter_table(inputs['comments'], columns=['comment'])]
+    matrix = stack_rows(parts, extractor.n_features)
+    save_ngrams(os.path.join(workdir, 'ngrams.comment'), matrix, extractor.frequency_table(matrix))
+    return matrix.shape[0]
+
+
+def stage_cooccurrence(inputs, workdir):
+    from cooccurrence import cooccurrence_from_csv
+    counter = cooccurrence_from_csv(inputs['comments'], window=5, stop_words=COMMON_WORDS[:25])
+    counter.top_neighbours(k=10).to_csv(os.path.join(workdir, 'cooccurrence.csv'), index=False)
+    return counter.n_docs
+
+
+def stage_centrality(inputs, workdir):
+    from network import InteractionGraph
+    from table_io import read_table
+    df = read_table(inputs['comments'], columns=['user', 'author'])
+    InteractionGraph.from_frame(df).centrality(seed=0).to_csv(os.path.join(workdir, 'centrality.csv'), index=False)
+    return len(df)
+
+
+def stage_rollup(inputs, workdir):
+    from rollup import rollup_file
+    return rollup_file(inputs['comments'], os.path.join(workdir, 'rollup.sqlite'), replace=True)
+
+
+def stage_sqlite_load(inputs, workdir):
+    from storage import Store, store_comments
+    from table_io import iter_table
+    path = os.path.join(workdir, 'comments.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    rows = 0
+    with Store(path) as store:
+        for chunk in iter_table(inputs['comments']):
+            rows += store_comments(store, chunk)
+    return rows
+
+
+STAGE_FUNCTIONS = {name: globals()[f'stage_{name}'] for name in STAGES}
+
+
+def peak_rss_mb(who):
+    import resource
+    if who == resource.RUSAGE_SELF and os.path.exists('/proc/self/status'):
+        # On Linux ru_maxrss survives exec, so a fresh process would report the peak of the benchmark process that
+        # spawned it; VmHWM is the peak of this process image only
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(who).ru_maxrss * scale / 2**20
+
+
+def run_stage(name, inputs, workdir):
+    """Run one stage in this process and return its measurements (called in the child process)."""
+    import resource
+    start = time.perf_counter()
+    rows = STAGE_FUNCTIONS[name](inputs, workdir)
+    seconds = time.perf_counter() - start
+    return {'rows': int(rows), 'seconds': seconds, 'rows_per_sec': rows / max(seconds, 1e-9),
+            'peak_rss_mb': peak_rss_mb(resource.RUSAGE_SELF), 'children_peak_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN)}
+
+
+def measure(name, inputs, workdir):
+    """Run one stage in a fresh Python process; returns its measurements, or the reason it was skipped or failed."""
+    command = [sys.executable, os.path.abspath(__file__), 'stage', name, json.dumps(inputs), workdir]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=SCRIPT_DIR)
+    lines = result.stdout.strip().splitlines()
+    if result.returncode == 0 and lines:
+        return json.loads(lines[-1])
+    error = (result.stderr.strip().splitlines() or ['exit code %d' % result.returncode])[-1]
+    status = 'skipped' if 'ModuleNotFoundError' in error or "Can't find model" in error else 'failed'
+    return {'status': status, 'error': error}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=SCRIPT_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def scaling(results):
+    """Slope of log(seconds) over log(rows) for every stage measured at two or more sizes."""
+    exponents = {}
+    frame = pd.DataFrame([r for r in results if r.get('seconds')])
+    if frame.empty:
+        return exponents
+    for stage, group in frame.groupby('stage'):
+        if group['size'].nunique() > 1:
+            exponents[stage] = float(np.polyfit(np.log(group['size']), np.log(group['seconds']), 1)[0])
+    return exponents
+
+
+def run_benchmark(sizes, stages=STAGES, workdir=None, seed=0, repeat=1, keep=False):
+    """
+    Generate a corpus of every size and measure every stage on it. Returns the results as a JSON-serialisable dict.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix='gsi_benchmark_')
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+    try:
+        for size in sizes:
+            start = time.perf_counter()
+            inputs = {'comments': write_comments(os.path.join(workdir, f'comments_{size}.csv'), size, seed),
+                      'dump': write_dump(os.path.join(workdir, f'RC_{size}.zst'), size, seed) if 'zst_to_table' in stages else None}
+            print(f"Generated {size:,} rows in {time.perf_counter() - start:.1f}s")
+            for stage in stages:
+                for run in range(repeat):
+                    measurement = measure(stage, inputs, workdir)
+                    results.append({'stage': stage, 'size': size, 'run': run, **measurement})
+                    if 'seconds' in measurement:
+                        print(f"  {stage:<14} {size:>10,} rows  {measurement['seconds']:8.2f}s  {measurement['rows_per_sec']:>12,.0f} rows/sec  "
+                              f"peak RSS {measurement['peak_rss_mb']:,.0f} MB (children {measurement['children_peak_rss_mb']:,.0f} MB)")
+                    else:
+                        print(f"  {stage:<14} {size:>10,} rows  {measurement['status']}: {measurement['error']}")
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.processor(),
+                    'cpu_count': os.cpu_count(), 'numpy': np.__version__, 'pandas': pd.__version__},
+        'seed': seed,
+        'sizes': list(sizes),
+        'results': results,
+        'scaling': scaling(results),
+    }
+
+
+def compare(before, after):
+    """Table of the median seconds of every stage and size in two result files, with the speedup of `after`."""
+    def medians(results):
+        frame = pd.DataFrame([r for r in results['results'] if r.get('seconds')])
+        if frame.empty:
+            return pd.DataFrame(columns=['stage', 'size', 'seconds', 'peak_rss_mb'])
+        return frame.groupby(['stage', 'size'], as_index=False)[['seconds', 'peak_rss_mb']].median()
+    table = medians(before).merge(medians(after), on=['stage', 'size'], suffixes=('.before', '.after'))
+    table['speedup'] = table['seconds.before'] / table['seconds.after']
+    return table
+
+
+def parse_sizes(value):
+    return [int(float(size)) for size in value.split(',')]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput benchmark of the pipeline stages on synthetic Reddit-shaped data.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Generate corpora and time the stages")
+    run_parser.add_argument("--sizes", type=parse_sizes, default=[10**4, 10**5], help="Comma separated row counts, e.g. 1e4,1e5,1e6")
+    run_parser.add_argument("--stages", default=",".join(STAGES), help="Comma separated stages: " + ", ".join(STAGES))
+    run_parser.add_argument("--output", default="benchmark.json", help="Result JSON file")
+    run_parser.add_argument("--workdir", default=None, help="Directory for the generated data (default: a temporary directory)")
+    run_parser.add_argument("--keep", action="store_true", help="Keep the generated data and stage outputs")
+    run_parser.add_argument("--repeat", type=int, default=1, help="Runs of every stage per size")
+    run_parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic corpus")
+
+    generate_parser = commands.add_parser("generate", help="Only write a synthetic comment table (and dump)")
+    generate_parser.add_argument("output", help="Output CSV file")
+    generate_parser.add_argument("size", type=lambda value: int(float(value)), help="Number of comments")
+    generate_parser.add_argument("--dump", default=None, help="Also write a .zst NDJSON dump of the same comments")
+    generate_parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic corpus")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("before", help="Result JSON of the baseline run")
+    compare_parser.add_argument("after", help="Result JSON of the new run")
+
+    stage_parser = commands.add_parser("stage", help=argparse.SUPPRESS)
+    stage_parser.add_argument("name", choices=STAGES)
+    stage_parser.add_argument("inputs")
+    stage_parser.add_argument("workdir")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        stages = [stage for stage in args.stages.split(",") if stage]
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+        report = run_benchmark(args.sizes, stages, args.workdir, args.seed, args.repeat, args.keep)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        for stage, exponent in report['scaling'].items():
+            print(f"{stage:<14} time grows as rows^{exponent:.2f}")
+        print("Results saved to:", args.output)
+    elif args.command == "generate":
+        write_comments(args.output, args.size, args.seed)
+        if args.dump:
+            write_dump(args.dump, args.size, args.seed)
+        print(f"Wrote {args.size:,} synthetic comments to: {args.output}" + (f" and {args.dump}" if args.dump else ""))
+    elif args.command == "compare":
+        with open(args.before) as f_before, open(args.after) as f_after:
+            print(compare(json.load(f_before), json.load(f_after)).to_string(index=False))
+    elif args.command == "stage":
+        # Stages may print their own progress; the measurements are the last line of the output
+        print(json.dumps(run_stage(args.name, json.loads(args.inputs), args.workdir)))
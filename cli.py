@@ -0,0 +1,65 @@
+# One entry point for the command line tools of the repository.
+# Each subcommand runs the command line of one script (python cli.py graph ... is python network.py ...) in a fresh
+# interpreter, exec'd in place on POSIX, so a run only imports what that script needs: cli.py itself imports nothing but
+# the standard library, and the scripts import spaCy and NLTK only when a model is actually loaded (see models.py).
+# A sentiment-only or graph-only run therefore starts without paying for the NLP stack, and process pools behave exactly
+# as when the script is started directly (also with the spawn start method).
+
+# call this like:
+# python cli.py --help
+# python cli.py graph co_occurrence_table.csv user_centrality.csv --no-betweenness
+# python cli.py sentiment climatenews_subreddit.csv vader_climatenews_subreddit.csv --workers 8
+# python cli.py models vader stopwords:english
+
+import argparse
+import os
+import subprocess
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Subcommand: (script, description)
+COMMANDS = {
+    'convert': ('tocsv.py', "Convert a Pushshift .zst NDJSON dump to CSV, Parquet or Arrow"),
+    'pipeline': ('pipeline.py', "Run a text_analysis.py section over an input of any size, chunk by chunk"),
+    'sentiment': ('sentiment.py', "Score text columns with VADER across a process pool"),
+    'ngrams': ('ngrams.py', "Sparse document x n-gram counts (and per n-gram sentiment)"),
+    'cooccurrence': ('cooccurrence.py', "Word co-occurrence counts with PMI/NPMI neighbours"),
+    'graph': ('network.py', "PageRank, degree and betweenness of the user interaction graph"),
+    'rollup': ('rollup.py', "Add scored rows to the per-hour sentiment rollup"),
+    'dedup': ('dedup.py', "Cluster near-duplicate comments (copypasta) with MinHash + LSH"),
+    'clouds': ('clouds.py', "Word clouds from a saved n-gram matrix"),
+    'store': ('storage.py', "Load files into the SQLite store or search it"),
+    'fetch': ('newscatcher.py', "Fetch Newscatcher search results into the SQLite store"),
+    'fake-api': ('fake_newscatcher.py', "Serve a local fake Newscatcher API"),
+    'benchmark': ('benchmark.py', "Throughput benchmark on synthetic data"),
+    'metrics': ('instrument.py', "Summarise a metrics file"),
+    'models': ('models.py', "Load (and download if missing) models and NLTK resources"),
+}
+
+
+def main(argv=None):
+    """Run the script of a subcommand with the remaining arguments (in place of this process on POSIX, else returns its exit code)."""
+    parser = argparse.ArgumentParser(
+        prog="cli.py", description="Command line tools of the GSI Reddit analysis.",
+        epilog="Commands:\n" + "\n".join(f"  {name:<13} {description}" for name, (_, description) in COMMANDS.items())
+               + "\n\nRun 'cli.py <command> --help' for the options of a command.",
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=COMMANDS, metavar="command", help="One of the commands below")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Arguments of the command")
+    args = parser.parse_args(argv)
+
+    script = os.path.join(SCRIPT_DIR, COMMANDS[args.command][0])
+    command = [sys.executable, script] + args.args
+    if os.name == 'posix':
+        # Replace this process with the script, so there is no second interpreter waiting for it
+        sys.stdout.flush()
+        os.execv(sys.executable, command)
+    try:
+        return subprocess.call(command)
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# Word clouds from precomputed term counts.
+# viz.py and wordclouds.ipynb joined every comment (or every ngrams.comment string) into one huge string and let WordCloud
+# tokenize it again, so memory grew with the number of characters in the corpus. Here a cloud is drawn from a
+# {term: count} dict with WordCloud.generate_from_frequencies, and the counts come from a sparse document x term matrix
+# (ngrams.py; e.g. the saved ngrams.comment.npz/.csv, or unigrams counted in batches):
+#  - slice_counts sums the rows of every slice (author, subreddit, sentiment sign, ...) in one sparse product,
+#  - term_sentiment gives the mean sentiment of every term, weighted by how often it occurs, for the coloured clouds.
+# Only the max_words most frequent terms of a slice are turned into strings and passed to WordCloud.
+
+# call this like:
+# python clouds.py ngrams.comment enhanced_co_occurrence_table_with_ngrams.csv wordcloud.png --slice-by author --top-slices 10
+
+import argparse
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from ngrams import ngram_sentiment
+
+# Colours of the sentiment clouds, as in wordclouds.ipynb
+POSITIVE_COLOR = "hsl(120, 100%, 50%)"
+NEGATIVE_COLOR = "hsl(0, 100%, 50%)"
+NEUTRAL_COLOR = "hsl(60, 100%, 50%)"
+
+
+def slice_counts(matrix, keys):
+    """
+    Sum the rows of a document x term count matrix per slice. keys holds the slice of every row (missing = no slice).
+    Returns (slice labels, CSR matrix of shape (n_slices, n_terms)).
+    """
+    codes, labels = pd.factorize(pd.Series(keys).reset_index(drop=True), sort=True)
+    rows = np.flatnonzero(codes >= 0)
+    indicator = sp.csr_matrix((np.ones(len(rows), dtype=np.int64), (codes[rows], rows)), shape=(len(labels), matrix.shape[0]))
+    return labels, (indicator @ matrix).tocsr()
+
+
+def term_sentiment(matrix, scores):
+    """
+    Mean score of every term over its occurrences (rows with a missing score are left out); NaN for unseen terms.
+    """
+    stats = ngram_sentiment(matrix, scores)
+    mean = np.full(matrix.shape[1], np.nan)
+    mean[stats['column'].to_numpy()] = stats['mean'].to_numpy()
+    return mean
+
+
+def top_frequencies(counts, terms, max_words=250, stop_words=()):
+    """
+    {term: count} of the max_words most frequent terms of one row of counts (a 1 x n_terms matrix or an array).
+    """
+    counts = np.asarray(counts.todense() if sp.issparse(counts) else counts).ravel()
+    terms = np.asarray(terms, dtype=object)
+    if stop_words:
+        counts = np.where(pd.Series(terms).isin(set(stop_words)).to_numpy(), 0, counts)
+    nonzero = np.flatnonzero(counts > 0)
+    best = nonzero[np.argsort(-counts[nonzero], kind='stable')[:max_words]]
+    return dict(zip(terms[best], counts[best].tolist()))
+
+
+def sentiment_color_func(sentiment, threshold=0.0):
+    """
+    WordCloud color_func colouring a term green, red or yellow by its mean sentiment ({term: score}).
+    """
+    def color_func(word, **kwargs):
+        score = sentiment.get(word, 0)
+        if score > threshold:
+            return POSITIVE_COLOR
+        if score < -threshold:
+            return NEGATIVE_COLOR
+        return NEUTRAL_COLOR
+    return color_func
+
+
+def render(frequencies, file_path=None, color_func=None, show=False, **kwargs):
+    """
+    Draw a word cloud from {term: weight} with WordCloud.generate_from_frequencies, save it to file_path and/or show it.
+    kwargs go to WordCloud (width, height, background_color, colormap, ...).
+    """
+    from wordcloud import WordCloud
+    options = dict(width=800, height=800, background_color='white', min_font_size=10)
+    options.update(kwargs)
+    wordcloud = WordCloud(color_func=color_func, **options).generate_from_frequencies(frequencies)
+    if file_path:
+        wordcloud.to_file(file_path)
+    if show:
+        import matplotlib.pyplot as plt
+        plt.figure(figsize=(8, 8), facecolor=None)
+        plt.imshow(wordcloud, interpolation="bilinear")
+        plt.axis("off")
+        plt.tight_layout(pad=0)
+        plt.show()
+    return wordcloud
+
+
+def sentiment_cloud(matrix, terms, scores, file_path=None, max_words=250, threshold=0.0, **kwargs):
+    """
+    Word cloud of the most frequent terms of the matrix rows, coloured by each term's mean sentiment.
+    """
+    frequencies = top_frequencies(matrix.sum(axis=0), terms, max_words)
+    mean_score = term_sentiment(matrix, scores)
+    index = {term: i for i, term in enumerate(terms)}
+    colours = {term: mean_score[index[term]] for term in frequencies}
+    return render(frequencies, file_path, sentiment_color_func(colours, threshold), **kwargs)
+
+
+if __name__ == "__main__":
+    from ngrams import load_ngrams
+    from table_io import read_table
+
+    parser = argparse.ArgumentParser(description="Word clouds from a saved n-gram matrix (see ngrams.py), optionally per slice.")
+    parser.add_argument("ngrams", help="Prefix of the saved n-gram matrix, e.g. ngrams.comment")
+    parser.add_argument("table", help="Table whose rows match the matrix rows (for slices and sentiment)")
+    parser.add_argument("output", help="Output PNG (one per slice: <name>.<slice>.png)")
+    parser.add_argument("--slice-by", default=None, help="Column to slice by, e.g. author or subreddit")
+    parser.add_argument("--top-slices", type=int, default=10, help="Draw the largest this many slices")
+    parser.add_argument("--sentiment", default="vader.comment", help="Score column for the colours ('' for plain clouds)")
+    parser.add_argument("--max-words", type=int, default=250, help="Terms per cloud")
+    args = parser.parse_args()
+
+    matrix, features = load_ngrams(args.ngrams)
+    terms = features['ngram'].to_numpy(dtype=object)
+    columns = [column for column in (args.slice_by, args.sentiment) if column]
+    table = read_table(args.table, columns=columns) if columns else pd.DataFrame(index=range(matrix.shape[0]))
+    stem = args.output[:-4] if args.output.lower().endswith('.png') else args.output
+
+    if not args.slice_by:
+        slices = [(None, np.arange(matrix.shape[0]))]
+    else:
+        keys = table[args.slice_by]
+        largest = keys.value_counts().head(args.top_slices).index
+        slices = [(name, np.flatnonzero((keys == name).to_numpy())) for name in largest]
+    for name, rows in slices:
+        path = args.output if name is None else f"{stem}.{name}.png"
+        if args.sentiment:
+            sentiment_cloud(matrix[rows], terms, table[args.sentiment].to_numpy()[rows], path, args.max_words)
+        else:
+            render(top_frequencies(matrix[rows].sum(axis=0), terms, args.max_words), path)
+        print("Word cloud saved to:", path)
@@ -0,0 +1,267 @@
+# Sparse word co-occurrence engine behind SECTION 2 of text_analysis.py.
+# Counts how often two words appear together, either in the same document or within a window of a few tokens, as in
+# "how often does 'climate' appear near 'change', 'crisis' or 'hoax'".
+
+# Texts are tokenized like the n-grams of SECTION 4 (ngrams.TOKEN_PATTERN); words shorter than min_length characters
+# (default 2) are left out of the vocabulary. Words become integer ids from a fixed vocabulary:
+#  - Vocabulary keeps the max_features most frequent words (by document frequency) seen in a first pass over the data;
+#    that pass counts at most max_candidates words at a time (the rarest half is dropped when there are more), so it is
+#    bounded as well,
+#  - HashingVocabulary maps every word to one of n_features buckets with a stable hash, so no first pass is needed.
+# Each chunk of texts becomes a scipy.sparse document-term matrix X; document co-occurrence counts are X.T @ X and window
+# co-occurrence counts come from sparse matrices built from token id pairs at distance 1..window. The count matrix is
+# vocabulary x vocabulary, so memory is bounded by the vocabulary size however many comments are streamed through.
+# On top of that, max_pairs caps the number of stored pairs: when it is exceeded the rarest pairs are dropped
+# (pruned_below records the largest count dropped, so counts below it are lower bounds).
+# Pairs are scored with PMI and NPMI (normalised to [-1, 1]) and reported as the top-k neighbours of every term.
+
+# call this like:
+# python cooccurrence.py co_occurrence_table.csv word_cooccurrence.csv --column comment --window 5
+
+import argparse
+import zlib
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from ngrams import TOKEN_PATTERN, tokenize_batch
+
+# Shortest word that gets a vocabulary id
+MIN_WORD_LENGTH = 2
+
+
+# Lowercase a text and split it into words, as ngrams.tokenize_batch does (missing texts have none)
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower()) if isinstance(text, str) else []
+
+
+class Vocabulary:
+    """
+    Fixed vocabulary of the most frequent words, mapped to ids 0..len-1.
+    """
+
+    def __init__(self, terms, pruned_below=0):
+        self.terms = list(terms)
+        self.index = {term: i for i, term in enumerate(self.terms)}
+        self.pruned_below = pruned_below
+
+    @classmethod
+    def fit(cls, texts, max_features=50000, min_df=2, stop_words=(), min_length=MIN_WORD_LENGTH, max_candidates=None):
+        """
+        Build a vocabulary from the max_features words of at least min_length characters that appear in at least min_df documents.
+        At most max_candidates words (default 10 * max_features) are counted at a time: past that, only the
+        max_candidates // 2 most frequent are kept. pruned_below records the largest document frequency dropped; words
+        that were dropped and seen again are undercounted, so frequencies up to about that value are approximate.
+        """
+        stop_words = set(stop_words)
+        max_candidates = max(max_candidates or 10 * max_features, 2 * max_features)
+        document_frequency = Counter()
+        pruned_below = 0
+        for text in texts:
+            document_frequency.update(word for word in set(tokenize(text)) if word not in stop_words and len(word) >= min_length)
+            if len(document_frequency) > max_candidates:
+                kept = document_frequency.most_common(max_candidates // 2)
+                pruned_below = max(pruned_below, kept[-1][1])
+                document_frequency = Counter(dict(kept))
+        terms = [term for term, df in document_frequency.most_common(max_features) if df >= min_df]
+        return cls(terms, pruned_below)
+
+    def __len__(self):
+        return len(self.terms)
+
+    # Token ids of a tokenized text; words outside the vocabulary get -1
+    def ids(self, tokens):
+        index = self.index
+        return np.fromiter((index.get(token, -1) for token in tokens), dtype=np.int64, count=len(tokens))
+
+    def term(self, term_id):
+        return self.terms[term_id]
+
+
+class HashingVocabulary:
+    """
+    Maps words to n_features buckets with CRC32, so texts can be streamed in a single pass.
+    Keeps the first word seen for every bucket to label the results. Stopwords and words shorter than min_length get -1.
+    """
+
+    def __init__(self, n_features=2**18, stop_words=(), min_length=MIN_WORD_LENGTH):
+        self.n_features = n_features
+        self.stop_words = set(stop_words)
+        self.min_length = min_length
+        self.labels = {}
+
+    def __len__(self):
+        return self.n_features
+
+    def ids(self, tokens):
+        ids = np.empty(len(tokens), dtype=np.int64)
+        for i, token in enumerate(tokens):
+            if token in self.stop_words or len(token) < self.min_length:
+                ids[i] = -1
+                continue
+            term_id = zlib.crc32(token.encode("utf-8")) % self.n_features
+            self.labels.setdefault(term_id, token)
+            ids[i] = term_id
+        return ids
+
+    def term(self, term_id):
+        return self.labels.get(term_id, f"#{term_id}")
+
+
+class CooccurrenceCounter:
+    """
+    Accumulates word co-occurrence counts over chunks of texts.
+    window=None counts pairs of words that appear in the same document; window=k counts pairs at most k tokens apart.
+    """
+
+    def __init__(self, vocabulary, window=None, max_pairs=50000000):
+        self.vocabulary = vocabulary
+        self.window = window
+        self.max_pairs = max_pairs
+        self.pruned_below = 0
+        n = len(vocabulary)
+        self.counts = sp.csr_matrix((n, n), dtype=np.int64)
+        self.term_counts = np.zeros(n, dtype=np.int64)
+        self.n_docs = 0
+
+    # Token ids of a chunk, flattened, with the document number of every token
+    def _chunk_ids(self, texts):
+        tokens, lengths = tokenize_batch(texts)
+        ids = self.vocabulary.ids(tokens)
+        docs = np.repeat(np.arange(len(lengths)), lengths)
+        return ids, docs, len(lengths)
+
+    def update(self, texts):
+        """
+        Add the co-occurrences of a chunk of texts.
+        """
+        n = len(self.vocabulary)
+        ids, docs, n_docs = self._chunk_ids(texts)
+        if self.window is None:
+            known = ids >= 0
+            # Binary document-term matrix: duplicates are summed by the constructor, then clipped to presence
+            X = sp.csr_matrix((np.ones(known.sum(), dtype=np.int64), (docs[known], ids[known])), shape=(n_docs, n))
+            X.data[:] = 1
+            self.term_counts += np.asarray(X.sum(axis=0)).ravel()
+            pairs = (X.T @ X).tocsr()
+            pairs.setdiag(0)
+        else:
+            known = ids >= 0
+            self.term_counts += np.bincount(ids[known], minlength=n)
+            rows, cols = [], []
+            for distance in range(1, self.window + 1):
+                left, right = ids[:-distance], ids[distance:]
+                keep = (docs[:-distance] == docs[distance:]) & (left >= 0) & (right >= 0) & (left != right)
+                rows.append(left[keep])
+                cols.append(right[keep])
+            rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+            cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int64)
+            # Count both orders so the matrix is symmetric
+            pairs = sp.csr_matrix((np.ones(2 * len(rows), dtype=np.int64), (np.concatenate([rows, cols]), np.concatenate([cols, rows]))),
+                                  shape=(n, n))
+        pairs.eliminate_zeros()
+        self.counts = self.counts + pairs
+        self.n_docs += n_docs
+        if self.max_pairs and self.counts.nnz > self.max_pairs:
+            self._prune()
+        return self
+
+    # Keep the max_pairs // 2 most frequent pairs, so pruning runs rarely
+    def _prune(self):
+        data = self.counts.data
+        keep = self.max_pairs // 2
+        threshold = np.partition(data, len(data) - keep)[len(data) - keep]
+        self.pruned_below = max(self.pruned_below, int(threshold) - 1)
+        data[data < threshold] = 0
+        self.counts.eliminate_zeros()
+
+    def scores(self, min_count=5):
+        """
+        Return (counts, pmi, npmi) as sparse matrices over the pairs seen at least min_count times.
+        Document mode uses document frequencies for the marginals; window mode uses the pair totals of each word.
+        """
+        counts = self.counts.tocoo()
+        keep = counts.data >= min_count
+        rows, cols, joint = counts.row[keep], counts.col[keep], counts.data[keep].astype(np.float64)
+        if self.window is None:
+            total = float(max(self.n_docs, 1))
+            marginal = self.term_counts.astype(np.float64)
+        else:
+            total = float(max(self.counts.sum(), 1))
+            marginal = np.asarray(self.counts.sum(axis=1)).ravel().astype(np.float64)
+        p_joint = joint / total
+        pmi = np.log(p_joint) - np.log(marginal[rows] / total) - np.log(marginal[cols] / total)
+        # NPMI is 1 for words that only ever appear together; pairs with p_joint == 1 have no meaningful normalisation
+        denominator = -np.log(p_joint)
+        npmi = np.divide(pmi, denominator, out=np.ones_like(pmi), where=denominator > 0)
+        # Build the three matrices on one sparsity structure, so their data arrays line up entry for entry
+        positions = sp.csr_matrix((np.arange(1, len(rows) + 1), (rows, cols)), shape=self.counts.shape)
+        order = positions.data - 1
+        matrices = []
+        for values in (joint, pmi, npmi):
+            matrix = positions.astype(np.float64)
+            matrix.data = values[order]
+            matrices.append(matrix)
+        return tuple(matrices)
+
+    def top_neighbours(self, k=10, min_count=5, measure="npmi"):
+        """
+        Return a DataFrame with the k best neighbours of every term by measure ('npmi', 'pmi' or 'count').
+        """
+        counts, pmi, npmi = self.scores(min_count)
+        ranking = {"npmi": npmi, "pmi": pmi, "count": counts}[measure]
+        records = []
+        for term_id in np.flatnonzero(np.diff(ranking.indptr)):
+            start, end = ranking.indptr[term_id], ranking.indptr[term_id + 1]
+            best = start + np.argsort(-ranking.data[start:end], kind="stable")[:k]
+            for rank, position in enumerate(best, start=1):
+                records.append((self.vocabulary.term(term_id), self.vocabulary.term(ranking.indices[position]), rank,
+                                int(counts.data[position]), pmi.data[position], npmi.data[position]))
+        return pd.DataFrame(records, columns=["term", "neighbour", "rank", "count", "pmi", "npmi"])
+
+
+def cooccurrence_from_csv(path, column="comment", window=None, chunksize=100000, max_features=50000, min_df=2,
+                          hash_features=None, stop_words=(), max_pairs=50000000, min_length=MIN_WORD_LENGTH, max_candidates=None):
+    """
+    Stream a CSV column in chunks through a CooccurrenceCounter.
+    With a mapped vocabulary the file is read twice (vocabulary, then counts); with hash_features it is read once.
+    """
+    def texts():
+        for chunk in pd.read_csv(path, usecols=[column], chunksize=chunksize):
+            yield chunk[column].fillna("").astype(str)
+
+    if hash_features:
+        vocabulary = HashingVocabulary(hash_features, stop_words, min_length)
+    else:
+        vocabulary = Vocabulary.fit((text for chunk in texts() for text in chunk), max_features, min_df, stop_words, min_length,
+                                     max_candidates)
+    counter = CooccurrenceCounter(vocabulary, window, max_pairs)
+    for chunk in texts():
+        counter.update(chunk)
+    return counter
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Word co-occurrence counts with PMI/NPMI and top-k neighbours per term.")
+    parser.add_argument("input", help="Input CSV file")
+    parser.add_argument("output", help="Output CSV file of top neighbours")
+    parser.add_argument("--column", default="comment", help="Text column")
+    parser.add_argument("--window", type=int, default=None, help="Count pairs at most this many tokens apart (default: same document)")
+    parser.add_argument("--max-features", type=int, default=50000, help="Vocabulary size")
+    parser.add_argument("--min-df", type=int, default=2, help="Minimum document frequency of a vocabulary word")
+    parser.add_argument("--max-candidates", type=int, default=None, help="Words counted at once while building the vocabulary (default: 10 x --max-features)")
+    parser.add_argument("--hash-features", type=int, default=None, help="Hash words into this many buckets instead (single pass)")
+    parser.add_argument("--min-count", type=int, default=5, help="Minimum co-occurrence count of a reported pair")
+    parser.add_argument("--top-k", type=int, default=10, help="Neighbours reported per term")
+    parser.add_argument("--chunksize", type=int, default=100000, help="Rows read per chunk")
+    parser.add_argument("--max-pairs", type=int, default=50000000, help="Maximum number of stored pairs (memory budget)")
+    parser.add_argument("--min-length", type=int, default=MIN_WORD_LENGTH, help="Shortest word counted, in characters")
+    args = parser.parse_args()
+
+    counter = cooccurrence_from_csv(args.input, args.column, args.window, args.chunksize, args.max_features, args.min_df,
+                                    args.hash_features, max_pairs=args.max_pairs, min_length=args.min_length,
+                                    max_candidates=args.max_candidates)
+    counter.top_neighbours(args.top_k, args.min_count).to_csv(args.output, index=False)
+    print("Word co-occurrence neighbours saved to:", args.output)
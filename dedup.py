@@ -0,0 +1,306 @@
+# Deduplication helpers for per-row NLP.
+# In the Reddit tables every comment row carries a copy of its post's title and post_text, so applying an NLP function
+# to those columns row by row analyses the same post once per comment. PostIndex maps each row to its post
+# (by thread_id, falling back to url) with integer codes: features are computed once per post and broadcast back
+# to the rows by indexing with those codes, without a join.
+# NearDuplicateIndex does the same for comments that are not identical but nearly so (copypasta reposted with small
+# edits): every comment gets a MinHash signature of its word shingles, LSH banding finds candidate pairs in one pass per
+# band (comments whose signatures agree on a whole band land in the same bucket, and each is compared with the next
+# `neighbours` comments of its bucket, i.e. with all of them in buckets of up to neighbours + 1), candidates whose
+# estimated Jaccard similarity reaches the threshold are joined, and the connected components are the clusters. The work
+# is linear in the number of comments and shingles. NLP runs once per cluster representative (its first row) and the results are
+# broadcast to the cluster; the cluster ids are also a signal of coordinated posting (see NearDuplicateIndex.clusters).
+
+# call this like:
+# python dedup.py climatenews_subreddit.csv comment_clusters.csv --column comment --threshold 0.8 --summary copypasta.csv
+
+import argparse
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+# Columns that identify a post, in order of preference
+POST_KEYS = ('thread_id', 'url')
+
+
+# Return the first post key column present in df, or None
+def post_key(df):
+    for key in POST_KEYS:
+        if key in df.columns:
+            return key
+    return None
+
+
+# Factorize values into integer codes. Missing values each get a code of their own instead of sharing one.
+def factorize(values):
+    codes, uniques = pd.factorize(values)
+    missing = codes < 0
+    if missing.any():
+        codes[missing] = len(uniques) + np.arange(missing.sum())
+    return codes
+
+
+class PostIndex:
+    """
+    Maps the rows of a comment table to their unique posts.
+    """
+
+    def __init__(self, df, key=None):
+        self.df = df
+        self.key = key or post_key(df)
+        if self.key is None:
+            raise ValueError(f"No post key column found, expected one of: {', '.join(POST_KEYS)}")
+        self.codes = factorize(df[self.key])
+        # Codes are numbered in order of first appearance, so these are the first row of each post, in code order
+        _, self.first_rows = np.unique(self.codes, return_index=True)
+
+    @property
+    def n_rows(self):
+        return len(self.codes)
+
+    @property
+    def n_posts(self):
+        return len(self.first_rows)
+
+    @property
+    def ratio(self):
+        """Rows per unique post, i.e. how many times fewer texts the post-level features are computed for."""
+        return self.n_rows / self.n_posts if self.n_posts else 1.0
+
+    def posts(self, columns):
+        """
+        Return one row per unique post with the given columns, in code order.
+        """
+        return self.df.iloc[self.first_rows][list(columns)].reset_index(drop=True)
+
+    def broadcast(self, values):
+        """
+        Expand per-post values (in the order of posts()) back to one value per row of the original table.
+        """
+        return pd.Series(values).to_numpy()[self.codes]
+
+    def report(self):
+        print(f"Post dedup on '{self.key}': {self.n_rows:,} rows -> {self.n_posts:,} unique posts ({self.ratio:.1f}x)")
+
+
+# splitmix64 finalizer: mixes every bit of a uint64 array into every other (arithmetic wraps around)
+def _mix(values):
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xbf58476d1ce4e5b9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+
+def shingle_hashes(texts, size=3):
+    """
+    Hash the word shingles (runs of `size` consecutive words) of every text. Texts shorter than `size` words count as one
+    shingle. Returns (uint64 hashes, the text of every hash) with the hashes of each text contiguous and in text order.
+    """
+    from ngrams import tokenize_batch
+    tokens, lengths = tokenize_batch(texts)
+    words = pd.util.hash_array(np.asarray(tokens, dtype=object)) if tokens else np.empty(0, dtype=np.uint64)
+    docs = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+
+    end = max(len(words) - size + 1, 0)
+    valid = docs[:end] == docs[size - 1:len(docs)] if end else np.zeros(0, dtype=bool)
+    hashes = _mix(words[:end])
+    for offset in range(1, size):
+        hashes = _mix(hashes ^ words[offset:end + offset])
+    hashes, hash_docs = hashes[valid], docs[:end][valid]
+
+    # Texts with 1..size-1 words: one shingle of all their words
+    short = np.flatnonzero((lengths > 0) & (lengths < size))
+    short_hashes = _mix(words[starts[short]]) if len(short) else np.empty(0, dtype=np.uint64)
+    for offset in range(1, size - 1):
+        longer = lengths[short] > offset
+        short_hashes[longer] = _mix(short_hashes[longer] ^ words[starts[short[longer]] + offset])
+    hashes = np.concatenate([hashes, short_hashes])
+    hash_docs = np.concatenate([hash_docs, short])
+    order = np.argsort(hash_docs, kind='stable')
+    return hashes[order], hash_docs[order]
+
+
+class MinHasher:
+    """
+    MinHash signatures (num_perm uint32 values per text) of the word shingles of texts; equal seeds give equal signatures.
+    The fraction of equal values of two signatures estimates the Jaccard similarity of their shingle sets.
+    """
+
+    def __init__(self, num_perm=128, shingle_size=3, seed=1, block=32):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.block = block
+        # Permutation i maps a shingle hash x to the high half of a[i] * x + b[i] (multiply-shift universal hashing)
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(0, 2**64, num_perm, dtype=np.uint64, endpoint=False) | np.uint64(1)
+        self.b = rng.integers(0, 2**64, num_perm, dtype=np.uint64, endpoint=False)
+
+    def signatures(self, texts):
+        """
+        Return (signatures of shape (len(texts), num_perm), mask of the texts that have at least one shingle).
+        Texts without words get all-ones signatures and are masked out.
+        """
+        hashes, docs = shingle_hashes(texts, self.shingle_size)
+        n = len(texts)
+        signatures = np.full((n, self.num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+        present, starts = np.unique(docs, return_index=True)
+        if len(hashes):
+            permuted = np.empty((len(hashes), self.block), dtype=np.uint64)
+            for start in range(0, self.num_perm, self.block):
+                a, b = self.a[start:start + self.block], self.b[start:start + self.block]
+                block = permuted[:, :len(a)]
+                np.multiply(hashes[:, None], a[None, :], out=block)
+                np.add(block, b[None, :], out=block)
+                np.right_shift(block, np.uint64(32), out=block)
+                signatures[present, start:start + len(a)] = np.minimum.reduceat(block, starts, axis=0)
+        mask = np.zeros(n, dtype=bool)
+        mask[present] = True
+        return signatures, mask
+
+
+def lsh_bands(num_perm, threshold):
+    """
+    Number of bands for LSH: the divisor of num_perm whose similarity threshold (1/bands)^(1/rows) is closest to, but not
+    above, threshold, so that pairs at the threshold are candidates with high probability.
+    """
+    options = [(bands, (1 / bands) ** (bands / num_perm)) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    below = [(bands, t) for bands, t in options if t <= threshold]
+    return max(below, key=lambda option: option[1])[0] if below else num_perm
+
+
+class NearDuplicateIndex(PostIndex):
+    """
+    Maps the rows of a table to clusters of near-duplicate texts in one column, with the interface of PostIndex:
+    codes (cluster of every row, numbered in order of first appearance), posts(columns) (one row per cluster, its
+    representative) and broadcast(values). Rows without words are clusters of their own.
+    """
+
+    def __init__(self, df, column='comment', threshold=0.8, num_perm=128, bands=None, shingle_size=3, batch_size=10000, seed=1,
+                 neighbours=8):
+        self.df = df
+        self.key = column
+        self.threshold = threshold
+        self.neighbours = neighbours
+        self.hasher = MinHasher(num_perm, shingle_size, seed)
+        self.bands = bands or lsh_bands(num_perm, threshold)
+        if num_perm % self.bands:
+            raise ValueError(f"bands ({self.bands}) must divide num_perm ({num_perm})")
+        texts = df[column].tolist()
+        parts = [self.hasher.signatures(texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)]
+        self.signatures = np.concatenate([part[0] for part in parts]) if parts else np.empty((0, num_perm), dtype=np.uint32)
+        self.has_shingles = np.concatenate([part[1] for part in parts]) if parts else np.zeros(0, dtype=bool)
+        labels = self._components()
+        self.codes = factorize(labels)
+        _, self.first_rows = np.unique(self.codes, return_index=True)
+
+    # Candidate pairs from every band (each row to the next `neighbours` rows of its bucket), kept if they are similar enough
+    def _components(self):
+        n = len(self.signatures)
+        rows = np.flatnonzero(self.has_shingles)
+        width = self.hasher.num_perm // self.bands
+        sources, targets = [], []
+        for band in range(self.bands):
+            keys = np.zeros(len(rows), dtype=np.uint64)
+            for column in range(band * width, (band + 1) * width):
+                keys = _mix(keys ^ self.signatures[rows, column].astype(np.uint64))
+            buckets, _ = pd.factorize(keys)
+            order = np.argsort(buckets, kind='stable')
+            bucket_rows, buckets = rows[order], buckets[order]
+            for offset in range(1, self.neighbours + 1):
+                same = buckets[offset:] == buckets[:-offset]
+                sources.append(bucket_rows[:-offset][same])
+                targets.append(bucket_rows[offset:][same])
+        sources = np.concatenate(sources) if sources else np.empty(0, dtype=np.int64)
+        targets = np.concatenate(targets) if targets else np.empty(0, dtype=np.int64)
+        if len(sources):
+            pairs = np.unique(np.stack([sources, targets], axis=1), axis=0)
+            sources, targets = pairs[:, 0], pairs[:, 1]
+        similar = np.zeros(len(sources), dtype=bool)
+        for start in range(0, len(sources), 100000):
+            end = start + 100000
+            agree = (self.signatures[sources[start:end]] == self.signatures[targets[start:end]]).mean(axis=1)
+            similar[start:end] = agree >= self.threshold
+        self.n_candidates = len(sources)
+        graph = sp.coo_matrix((np.ones(similar.sum(), dtype=np.int8), (sources[similar], targets[similar])), shape=(n, n))
+        return connected_components(graph, directed=False)[1]
+
+    @property
+    def n_clusters(self):
+        return self.n_posts
+
+    def similarity(self, a, b):
+        """Estimated Jaccard similarity of the shingles of rows a and b."""
+        return float((self.signatures[a] == self.signatures[b]).mean())
+
+    def sizes(self):
+        """Size of the cluster of every row."""
+        return np.bincount(self.codes)[self.codes]
+
+    def clusters(self, author='author', time_column='comm_date', min_size=2):
+        """
+        One row per cluster of at least min_size rows, largest first: size, distinct authors, first and last time (when
+        the columns exist) and the representative text. Many authors posting one text in a short time suggests coordination.
+        """
+        frame = pd.DataFrame({'cluster': self.codes})
+        aggregations = {'size': ('cluster', 'size')}
+        if author in self.df.columns:
+            frame[author] = self.df[author].to_numpy()
+            aggregations['authors'] = (author, 'nunique')
+        if time_column in self.df.columns:
+            frame[time_column] = pd.to_datetime(self.df[time_column], errors='coerce').to_numpy()
+            aggregations['first'] = (time_column, 'min')
+            aggregations['last'] = (time_column, 'max')
+        table = frame.groupby('cluster').agg(**aggregations).reset_index()
+        table['text'] = self.df[self.key].to_numpy()[self.first_rows[table['cluster'].to_numpy()]]
+        table = table[table['size'] >= min_size]
+        return table.sort_values(['size', 'cluster'], ascending=[False, True], ignore_index=True)
+
+    def report(self):
+        print(f"Near-duplicate dedup on '{self.key}' (Jaccard >= {self.threshold}, {self.bands} bands, {self.n_candidates:,} candidate pairs): "
+              f"{self.n_rows:,} rows -> {self.n_clusters:,} clusters ({self.ratio:.1f}x)")
+
+
+def apply_unique(series, compute, label=None):
+    """
+    Apply compute (a function from a list of texts to a list of results) to each distinct value of series once,
+    and broadcast the results back to every row. Prints the dedup ratio when a label is given.
+    """
+    codes, uniques = pd.factorize(series.astype(str))
+    results = compute(list(uniques))
+    if label:
+        ratio = len(codes) / len(uniques) if len(uniques) else 1.0
+        print(f"{label}: {len(codes):,} rows -> {len(uniques):,} unique texts ({ratio:.1f}x)")
+    return pd.Series(pd.Series(results).to_numpy()[codes], index=series.index)
+
+
+if __name__ == "__main__":
+    from table_io import read_table
+
+    parser = argparse.ArgumentParser(description="Cluster near-duplicate texts (MinHash + LSH) and write the cluster of every row.")
+    parser.add_argument("input", help="Input CSV, Parquet or Arrow file")
+    parser.add_argument("output", help="Output CSV: the id column, cluster.<column> and cluster_size.<column> of every row")
+    parser.add_argument("--column", default="comment", help="Text column")
+    parser.add_argument("--id-column", default="comm_id", help="Id column copied to the output (row number when missing)")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Minimum estimated Jaccard similarity of word shingles")
+    parser.add_argument("--num-perm", type=int, default=128, help="MinHash values per text")
+    parser.add_argument("--bands", type=int, default=None, help="LSH bands (default: chosen from the threshold)")
+    parser.add_argument("--shingle-size", type=int, default=3, help="Words per shingle")
+    parser.add_argument("--neighbours", type=int, default=8, help="Rows of the same LSH bucket compared with each row")
+    parser.add_argument("--summary", default=None, help="Also write the clusters of two or more rows (size, authors, time span, text)")
+    args = parser.parse_args()
+
+    df = read_table(args.input)
+    index = NearDuplicateIndex(df, args.column, args.threshold, args.num_perm, args.bands, args.shingle_size,
+                              neighbours=args.neighbours)
+    index.report()
+    ids = df[args.id_column] if args.id_column in df.columns else pd.Series(np.arange(len(df)), name='row')
+    output = pd.DataFrame({ids.name: ids.to_numpy(), f'cluster.{args.column}': index.codes, f'cluster_size.{args.column}': index.sizes()})
+    output.to_csv(args.output, index=False)
+    print("Clusters saved to:", args.output)
+    if args.summary:
+        index.clusters().to_csv(args.summary, index=False)
+        print("Cluster summary saved to:", args.summary)
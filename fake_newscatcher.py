@@ -0,0 +1,160 @@
+# Local stand-in for the Newscatcher v2 /search endpoint, on the standard library's ThreadingHTTPServer.
+# Serves deterministic synthetic articles (the same query and page always give the same _ids), paginated like the real API
+# (page, page_size, total_hits, total_pages), so newscatcher.py can be run, tested and benchmarked offline.
+# It can also misbehave on purpose: --error-rate answers that share of requests with 429 or 503 (with Retry-After),
+# and --latency delays every response, to exercise the fetcher's retries and concurrency.
+
+# call this like:
+# python fake_newscatcher.py --port 8765 --hits 2000 --error-rate 0.1 --latency 0.05
+# or, in Python:
+#   with FakeNewscatcher(hits=500) as server:
+#       fetch_and_store('news.db', ['refugees'], 'test', url=server.url, rate=0)
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MAX_PAGE_SIZE = 100
+
+
+# The synthetic article number i of a query
+def fake_article(q, i):
+    article_id = hashlib.md5(f"{q}|{i}".encode()).hexdigest()
+    return {
+        '_id': article_id,
+        'title': f"{q.title()} report {i}",
+        'author': f"Author {i % 37}",
+        'authors': [f"Author {i % 37}"],
+        'published_date': f"2023-08-{15 + i % 14:02d} {i % 24:02d}:00:00",
+        'link': f"https://news.example.com/{q.replace(' ', '-')}/{i}",
+        'clean_url': 'news.example.com',
+        'excerpt': f"An article about {q}, number {i}.",
+        'summary': f"Synthetic summary of article {i} on {q}. " * 5,
+        'topic': 'news',
+        'country': 'US',
+        'language': 'en',
+        'rank': i % 1000,
+        'is_opinion': i % 5 == 0,
+        '_score': round(10.0 / (1 + i), 6),
+    }
+
+
+class FakeNewscatcherHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+        url = urlparse(self.path)
+        if url.path != '/v2/search':
+            return self.reply(404, {'status': 'Not found'})
+        if not self.headers.get('x-api-key'):
+            return self.reply(401, {'status': 'No API key'})
+        if server.error_rate and server.random.random() < server.error_rate:
+            with server.lock:
+                server.errors += 1
+            return self.reply(server.random.choice((429, 503)), {'status': 'Try again later'}, {'Retry-After': '0.05'})
+
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if 'q' not in query:
+            return self.reply(400, {'status': "The 'q' parameter is required"})
+        q = query['q']
+        page = max(int(query.get('page', 1)), 1)
+        page_size = min(max(int(query.get('page_size', 50)), 1), MAX_PAGE_SIZE)
+        total_pages = max(math.ceil(server.hits / page_size), 1)
+        first = (page - 1) * page_size
+        articles = [fake_article(q, i) for i in range(first, min(first + page_size, server.hits))]
+        self.reply(200, {
+            'status': 'ok' if server.hits else 'No matches for your search.',
+            'total_hits': server.hits,
+            'page': page,
+            'total_pages': total_pages,
+            'page_size': page_size,
+            'articles': articles,
+        })
+
+    def reply(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class FakeNewscatcher:
+    """
+    Runs the fake API in a background thread. Use as a context manager; url points at its /v2/search endpoint.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, hits=1000, error_rate=0.0, latency=0.0, seed=0, verbose=False):
+        self.server = ThreadingHTTPServer((host, port), FakeNewscatcherHandler)
+        self.server.daemon_threads = True
+        self.server.hits = hits
+        self.server.error_rate = error_rate
+        self.server.latency = latency
+        self.server.random = random.Random(seed)
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.errors = 0
+        self.server.verbose = verbose
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v2/search"
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def errors(self):
+        return self.server.errors
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake Newscatcher /v2/search endpoint for offline runs.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--hits", type=int, default=1000, help="Articles found for every query")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429 or 503")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of delay added to every response")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    server = FakeNewscatcher(args.host, args.port, args.hits, args.error_rate, args.latency, verbose=args.verbose)
+    print(f"Fake Newscatcher API listening on {server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,312 @@
+# Shared instrumentation for the pipeline scripts: per-stage timers, counters, memory sampling, optional profiling and a
+# machine-readable metrics file, so a slow batch window can be traced to the script and stage that is eating it.
+#  - metrics.stage(name) times a block of code. Stages nest: every stage records its total (inclusive) seconds and its
+#    own seconds without the stages nested in it, so the stages of one run add up to the wall time.
+#    metrics.start(name) ... metrics.stop(name) does the same for code that is not one block (scripts, notebook cells).
+#  - metrics.chunks(name, chunks) does the same for a generator stage of pipeline.py: the time spent producing each chunk
+#    (minus the upstream stages it pulls from) and the rows and chunks that come out.
+#  - metrics.count(name, value) adds to a counter of the innermost running stage (rows in/out, bad rows, cache hits,
+#    bytes read or decompressed, ...); metrics.progress(...) prints a rate-limited progress line with the rows/sec so far.
+#  - a background thread samples the resident set size every sample_interval seconds and keeps the peak of every stage.
+# Settings come from environment variables, so any script can be instrumented without changing its command line:
+#   GSI_METRICS=metrics.json       write the metrics of the run to this file at exit (one JSON object per run, appended
+#                                  as a line, so several scripts or runs can share one file)
+#   GSI_PROFILE=section1,ngrams    run these stages (or 'all') under cProfile and write <stage>.<pid>.prof files
+#   GSI_PROFILE_DIR=profiles       directory of the .prof files (default: the current directory)
+#   GSI_SAMPLE_INTERVAL=0.5        seconds between memory samples (0 = no sampling thread)
+# For py-spy, run `py-spy record --pid <pid>` against a long run: the metrics file records the pid and the start and end
+# time of every stage, so the samples can be lined up with the stages afterwards.
+
+# call this like:
+# GSI_METRICS=metrics.json python pipeline.py climatenews_subreddit.csv processed.csv --preset processed
+# GSI_METRICS=metrics.json GSI_PROFILE=vader python pipeline.py climatenews_subreddit.csv processed.csv
+# python instrument.py metrics.json
+
+import argparse
+import atexit
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+METRICS_ENV = "GSI_METRICS"
+PROFILE_ENV = "GSI_PROFILE"
+PROFILE_DIR_ENV = "GSI_PROFILE_DIR"
+SAMPLE_INTERVAL_ENV = "GSI_SAMPLE_INTERVAL"
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_mb():
+    """Resident set size of this process in MB (peak RSS where the current value cannot be read)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 2**20
+    except OSError:
+        import resource
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+class StageStats:
+    """Timings, counters and memory of one named stage, summed over all the times it ran."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.own_seconds = 0.0
+        self.counters = {}
+        self.rss_start_mb = None
+        self.rss_peak_mb = 0.0
+        self.started = None
+        self.ended = None
+
+    def as_dict(self):
+        result = {'calls': self.calls, 'seconds': round(self.seconds, 6), 'own_seconds': round(self.own_seconds, 6),
+                  'rss_start_mb': self.rss_start_mb, 'rss_peak_mb': round(self.rss_peak_mb, 1),
+                  'started': self.started, 'ended': self.ended, 'counters': dict(self.counters)}
+        rows = self.counters.get('rows_out', self.counters.get('rows_in'))
+        if rows and self.own_seconds > 0:
+            result['rows_per_sec'] = rows / self.own_seconds
+        return result
+
+
+class Metrics:
+    """
+    Collects the stage timings and counters of one process and writes them to a JSON metrics file.
+    """
+
+    def __init__(self, script=None, path=None, profile=None, profile_dir=None, sample_interval=None):
+        self.script = script or os.path.basename(sys.argv[0] or 'python')
+        self.path = path if path is not None else os.environ.get(METRICS_ENV)
+        profile = profile if profile is not None else os.environ.get(PROFILE_ENV, '')
+        self.profile = {name.strip() for name in profile.split(',') if name.strip()}
+        self.profile_dir = profile_dir or os.environ.get(PROFILE_DIR_ENV, '.')
+        self.sample_interval = float(sample_interval if sample_interval is not None else os.environ.get(SAMPLE_INTERVAL_ENV, 0.5))
+        self.stages = {}
+        self.counters = {}
+        self.started = time.time()
+        self.clock_start = time.perf_counter()
+        self.rss_peak_mb = rss_mb()
+        self._active = []
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._stop = threading.Event()
+        self._last_progress = {}
+
+    def _stats(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageStats(name)
+        return self.stages[name]
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            self.sample()
+
+    def sample(self):
+        """Read the current RSS and raise the peak of every running stage."""
+        rss = rss_mb()
+        with self._lock:
+            self.rss_peak_mb = max(self.rss_peak_mb, rss)
+            for frame in self._active:
+                frame['stats'].rss_peak_mb = max(frame['stats'].rss_peak_mb, rss)
+        return rss
+
+    def _start_sampler(self):
+        if self._sampler is None and self.sample_interval > 0:
+            self._sampler = threading.Thread(target=self._sample, name="metrics-sampler", daemon=True)
+            self._sampler.start()
+
+    def _enter(self, name):
+        stats = self._stats(name)
+        frame = {'stats': stats, 'start': time.perf_counter(), 'nested': 0.0}
+        with self._lock:
+            self._active.append(frame)
+        rss = self.sample()
+        if stats.rss_start_mb is None:
+            stats.rss_start_mb = round(rss, 1)
+            stats.started = time.time()
+        self._start_sampler()
+        return frame
+
+    def _exit(self, frame):
+        self.sample()
+        elapsed = time.perf_counter() - frame['start']
+        with self._lock:
+            self._active.remove(frame)
+            if self._active:
+                self._active[-1]['nested'] += elapsed
+        stats = frame['stats']
+        stats.calls += 1
+        stats.seconds += elapsed
+        stats.own_seconds += elapsed - frame['nested']
+        stats.ended = time.time()
+
+    def start(self, name):
+        """Start timing stage `name` without a with block (e.g. in a script or notebook cell); end it with stop(name)."""
+        frame = self._enter(name)
+        frame['profiler'] = self._profiler(name)
+        frame['profiling'] = _enable(frame['profiler'])
+        return frame
+
+    def stop(self, name):
+        """End the innermost running stage `name` started with start()."""
+        with self._lock:
+            frame = next(frame for frame in reversed(self._active) if frame['stats'].name == name)
+        if frame.get('profiling'):
+            frame['profiler'].disable()
+        if frame.get('profiler') is not None:
+            self._dump_profile(name, frame['profiler'])
+        self._exit(frame)
+        return frame['stats']
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as stage `name` (under cProfile when the stage is selected by GSI_PROFILE)."""
+        frame = self.start(name)
+        try:
+            yield frame['stats']
+        finally:
+            self.stop(name)
+
+    def chunks(self, name, chunks):
+        """
+        Wrap a generator stage: the time spent producing every chunk is recorded as stage `name`, without the time of
+        the stages upstream of it, and the rows and chunks it yields are counted (rows_out, chunks_out).
+        """
+        iterator = iter(chunks)
+        profiler = self._profiler(name)
+        try:
+            while True:
+                frame = self._enter(name)
+                profiling = _enable(profiler)
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    if profiling:
+                        profiler.disable()
+                    self._exit(frame)
+                self.count('rows_out', len(chunk), stage=name)
+                self.count('chunks_out', 1, stage=name)
+                yield chunk
+        finally:
+            if profiler is not None:
+                self._dump_profile(name, profiler)
+
+    def count(self, name, value=1, stage=None):
+        """Add value to a counter of the given stage (default: the innermost running stage, or the whole run)."""
+        with self._lock:
+            if stage is None and self._active:
+                stage = self._active[-1]['stats'].name
+            counters = self._stats(stage).counters if stage is not None else self.counters
+            counters[name] = counters.get(name, 0) + value
+
+    def progress(self, stage, rows, total=None, every=10.0, unit='rows'):
+        """Print `rows` done in a stage with the rate so far, at most once every `every` seconds."""
+        now = time.perf_counter()
+        if now - self._last_progress.get(stage, 0.0) < every:
+            return
+        self._last_progress[stage] = now
+        stats = self.stages.get(stage)
+        elapsed = now - self.clock_start
+        if stats is not None and stats.started is not None:
+            elapsed = max(time.time() - stats.started, 1e-9)
+        done = f"{rows:,}" + (f"/{total:,} ({rows / total * 100:.0f}%)" if total else "")
+        print(f"{stage}: {done} {unit} ({rows / max(elapsed, 1e-9):,.0f} {unit}/sec, RSS {self.sample():,.0f} MB)")
+
+    def _profiler(self, name):
+        if not self.profile or ('all' not in self.profile and name not in self.profile):
+            return None
+        return cProfile.Profile()
+
+    def _dump_profile(self, name, profiler):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"{name}.{os.getpid()}.prof")
+        profiler.dump_stats(path)
+        print(f"Profile of {name} saved to: {path} (view with: python -m pstats {path} or snakeviz)")
+
+    def as_dict(self):
+        self.sample()
+        return {
+            'script': self.script,
+            'argv': sys.argv,
+            'pid': os.getpid(),
+            'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(timespec='seconds'),
+            'seconds': round(time.perf_counter() - self.clock_start, 6),
+            'rss_peak_mb': round(self.rss_peak_mb, 1),
+            'counters': dict(self.counters),
+            'stages': {name: stats.as_dict() for name, stats in self.stages.items()},
+        }
+
+    def write(self, path=None):
+        """Append the metrics of this run as one JSON line to path (default: $GSI_METRICS). Returns the path or None."""
+        path = path or self.path
+        if not path:
+            return None
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.as_dict()) + "\n")
+        return path
+
+    def close(self):
+        self._stop.set()
+        return self.write()
+
+
+# Start collecting with a profiler; False when there is none or another one (an enclosing profiled stage) is active
+def _enable(profiler):
+    if profiler is None:
+        return False
+    try:
+        profiler.enable()
+    except ValueError:
+        return False
+    return True
+
+
+# One Metrics per process, shared by every module of a script and written at exit
+_metrics = None
+
+
+def get_metrics(script=None):
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics(script)
+        atexit.register(_metrics.close)
+    return _metrics
+
+
+def read_metrics(path):
+    """Load every run recorded in a metrics file."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summary(runs):
+    """One row per (run, stage): script, stage, calls, seconds, own seconds, rows/sec, peak RSS and counters."""
+    import pandas as pd
+    rows = []
+    for i, run in enumerate(runs):
+        for name, stats in run['stages'].items():
+            rows.append({'run': i, 'script': run['script'], 'stage': name, 'calls': stats['calls'], 'seconds': stats['seconds'],
+                         'own_seconds': stats['own_seconds'], 'rows_per_sec': stats.get('rows_per_sec'),
+                         'rss_peak_mb': stats['rss_peak_mb'], **stats['counters']})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise a metrics file written with GSI_METRICS=<file>.")
+    parser.add_argument("metrics", help="Metrics file (one JSON object per run)")
+    parser.add_argument("--sort", default="own_seconds", help="Column to sort the stages by")
+    args = parser.parse_args()
+
+    table = summary(read_metrics(args.metrics))
+    if not table.empty:
+        table = table.sort_values(args.sort, ascending=False)
+    print(table.to_string(index=False))
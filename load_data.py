@@ -1,65 +1,47 @@
 #this code is designed to fetch and store data from the Newscatcher API for multiple search terms related to disinformation. 
-#It saves the data as JSON files, adds a unique ID to each entry, and then loads and stores the data in an SQLite database. 
+#It stores the articles in an SQLite database keyed on the article _id, and can also load saved Newscatcher JSON files into it. 
 #The code is organized into functions to facilitate the loading and storing of data for different search terms.
 
 #Import common  
-import json
-import pandas as pd
-import sqlite3
+import os
+import sys
+from newscatcher import fetch_and_store
+from storage import Store, load_files, read_articles, store_articles
 
 #Load data from newscatcher
+# The pages of every search term are fetched concurrently and written straight into db_name (see newscatcher.py)
 
 search_terms = ["United Nations", "United Nations universal periodic review", "united nations committee against torture", "refugees", "migrants"]
-filenames = []
 from_date="2023/08/15"
 page_size=50
-safe_from_date = from_date.replace('/', '_')
-
-for q in search_terms:
-    filenames.append(f"{q}_{safe_from_date}_page_size_{page_size}.json")
-    api.fetch_and_save_to_excel(q=q, from_date="2023/08/15", page_size=20)
+db_name = "newscatcher.db"
+table_name = "articles"
 
 
 # Deserialize and dump
-# This function adds a unique ID column to a DataFrame. It's used to give each row a unique identifier.
-def add_unique_id(df):
-    """
-    Add a unique ID column to the DataFrame.
-    """
-    df['unique_id'] = range(1, len(df) + 1)
-    return df
+# Articles are upserted into one indexed table on their Newscatcher _id (see storage.py), so loading more files adds to
+# the table instead of replacing it, and loading a file twice does not duplicate its articles.
 
-# This function loads a DataFrame into an SQLite database. It creates a database connection, creates a table (or replaces it if it already exists), and inserts the data from the DataFrame into the table.
+# This function stores a DataFrame of articles in an SQLite database, adding new articles and updating known ones.
 def load_data_df(df,db_name,table_name):
-    # Step 3: Create SQLite DB
-    conn = sqlite3.connect(db_name)
-    
-    # Step 4: Create Table and Insert Data
-    df.to_sql(table_name, conn, if_exists='replace', index=False)
-    print(f"Successfully loaded data into {db_name}, table name: {table_name}")
-    conn.close()
+    with Store(db_name) as store:
+        rows = store_articles(store, df, table_name)
+    print(f"Successfully loaded {rows} rows into {db_name}, table name: {table_name}")
     return 
 
-#  This function loads data from a JSON file into a DataFrame, adds a unique ID, and then stores it in an SQLite database using the load_data_df function.
+#  This function loads the articles of a JSON file into a DataFrame and stores them in an SQLite database using the load_data_df function.
 def load_data(filename,db_name,table_name):
-    with open(filename, 'r') as f:
-        json_data = json.load(f)
-    df = pd.DataFrame(json_data['articles'])
-    
-    # Step 2: Add Unique ID
-    df = add_unique_id(df)
-    
-    # Step 3: Create SQLite DB
-    conn = sqlite3.connect(db_name)
-    
-    # Step 4: Create Table and Insert Data
-    df.to_sql(table_name, conn, if_exists='replace', index=False)
-    print(f"Successfully loaded data into {db_name}, table name: {table_name}")
-    conn.close()
+    load_data_df(read_articles(filename), db_name, table_name)
     return 
 
-# This function iterates through a list of filenames, loads each JSON file into a DataFrame, and stores it in the SQLite database using the load_data function.
+# This function loads a list of JSON files into the same table in one go, over a single database connection.
 def mass_load(filenames,db_name,table_name):
-    for name in filenames:
-        load_data(name,db_name,table_name) 
+    load_files(db_name, table_name, filenames, kind='articles')
     return
+
+
+if __name__ == "__main__":
+    api_key = os.environ.get("NEWSCATCHER_API_KEY")
+    if not api_key:
+        sys.exit("load_data.py: error: set NEWSCATCHER_API_KEY to your Newscatcher API key")
+    fetch_and_store(db_name, search_terms, api_key, from_date=from_date, page_size=page_size, table=table_name)
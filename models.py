@@ -0,0 +1,136 @@
+# Process-wide, once-only registry of the models and language resources the analysis scripts use.
+# Every section of text_analysis.py used to build its own SentimentIntensityAnalyzer and call nltk.download('stopwords'),
+# and importing a script pulled in spaCy and NLTK at module level even when the run needed neither. Here:
+#  - get(name) loads a model the first time it is asked for and returns the same object afterwards (thread-safe);
+#    names are 'vader', 'stopwords:<language>' and 'spacy:<model name>', and more can be added with register(),
+#  - the heavy libraries (spaCy, NLTK) are imported inside the loaders, so importing this module costs nothing,
+#  - ensure_nltk(...) downloads an NLTK resource only when it is not installed yet,
+#  - preload(...) loads models before a process pool is started: with the fork start method (the default on Linux)
+#    the workers inherit the loaded models copy-on-write instead of loading them again. Pools started with spawn
+#    (Windows, macOS) cannot share them; pass pool_initializer(...) as the pool initializer to load them once per worker.
+
+# call this like:
+#   from models import get, stopwords
+#   sia = get('vader')
+#   nlp = get('spacy:en_core_web_sm')
+#   stop_words = stopwords('english')
+# or, to check and download what a run needs before starting it:
+# python models.py vader stopwords:english spacy:en_core_web_sm
+
+import argparse
+import threading
+import time
+
+# NLTK resources: name for nltk.download and path for nltk.data.find
+NLTK_RESOURCES = {
+    'stopwords': 'corpora/stopwords',
+    'vader_lexicon': 'sentiment/vader_lexicon.zip',
+    'punkt': 'tokenizers/punkt',
+}
+
+_loaders = {}
+_prefix_loaders = {}
+_models = {}
+_lock = threading.RLock()
+
+
+def register(name, loader):
+    """Register loader() as the way to build model `name`; a name ending in ':' registers loader(suffix) for a prefix."""
+    if name.endswith(':'):
+        _prefix_loaders[name[:-1]] = loader
+    else:
+        _loaders[name] = loader
+
+
+def _loader(name):
+    if name in _loaders:
+        return _loaders[name]
+    prefix, _, argument = name.partition(':')
+    if prefix in _prefix_loaders and argument:
+        return lambda: _prefix_loaders[prefix](argument)
+    raise KeyError(f"no model registered as {name!r}")
+
+
+def get(name):
+    """
+    Return model `name`, loading it on first use. Every caller in the process shares the same object.
+    """
+    model = _models.get(name)
+    if model is None:
+        with _lock:
+            model = _models.get(name)
+            if model is None:
+                model = _models[name] = _loader(name)()
+    return model
+
+
+def loaded():
+    return list(_models)
+
+
+def preload(*names):
+    """Load the given models now, e.g. before a process pool forks its workers."""
+    for name in names:
+        get(name)
+
+
+# Pool initializer (for ProcessPoolExecutor(initializer=...)) loading the given models once per worker
+def _preload_worker(names):
+    preload(*names)
+
+
+def pool_initializer(*names):
+    """(initializer, initargs) for a process pool whose workers need the given models."""
+    return _preload_worker, (names,)
+
+
+def ensure_nltk(resource):
+    """Download an NLTK resource (e.g. 'stopwords', 'vader_lexicon') unless it is already installed."""
+    import nltk
+    try:
+        nltk.data.find(NLTK_RESOURCES.get(resource, resource))
+    except LookupError:
+        nltk.download(resource, quiet=True)
+
+
+def nltk_version():
+    import nltk
+    return nltk.__version__
+
+
+def stopwords(language='english'):
+    """NLTK stopwords of a language, as a frozenset (downloaded on first use if missing)."""
+    return get(f'stopwords:{language}')
+
+
+def _load_vader():
+    ensure_nltk('vader_lexicon')
+    from nltk.sentiment import SentimentIntensityAnalyzer
+    return SentimentIntensityAnalyzer()
+
+
+def _load_stopwords(language):
+    ensure_nltk('stopwords')
+    from nltk.corpus import stopwords as nltk_stopwords
+    return frozenset(nltk_stopwords.words(language))
+
+
+def _load_spacy(model):
+    import spacy
+    return spacy.load(model)
+
+
+register('vader', _load_vader)
+register('stopwords:', _load_stopwords)
+register('spacy:', _load_spacy)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load models once (downloading missing NLTK resources) and report the load times.")
+    parser.add_argument("names", nargs="+", help="Models to load: vader, stopwords:<language>, spacy:<model name>")
+    args = parser.parse_args()
+
+    for name in args.names:
+        start = time.perf_counter()
+        get(name)
+        print(f"{name}: loaded in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,215 @@
+# Concurrent Newscatcher (v2 /search) fetcher that writes articles straight into the SQLite store (storage.py).
+# For every search term the first page is fetched to learn total_pages, then the remaining pages are requested
+# concurrently. All requests share one pooled aiohttp session and go through:
+#  - a semaphore bounding the requests in flight (concurrency),
+#  - a rate limiter spacing request starts to at most `rate` per second (the API plans are limited in calls per second),
+#  - retries with exponential backoff and jitter on connection errors, timeouts, 429 and 5xx responses
+#    (a Retry-After header, when sent, sets the wait).
+# Each page is upserted into the articles table as soon as it arrives, so memory does not grow with the number of pages
+# and an interrupted run keeps what it has fetched. An article found by several search terms is stored once, with every
+# term that found it in search_term (a JSON list, like the other list fields). fake_newscatcher.py serves the same API locally for offline runs.
+
+# call this like:
+# NEWSCATCHER_API_KEY=... python newscatcher.py news.db "refugees" "migrants" --from-date 2023/08/15 --page-size 100
+# python fake_newscatcher.py --port 8765 & python newscatcher.py news.db refugees --url http://127.0.0.1:8765/v2/search --api-key test
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+import aiohttp
+import pandas as pd
+
+from storage import ARTICLE_KEYS, Store, natural_key, quote, store_articles
+
+API_URL = "https://api.newscatcherapi.com/v2/search"
+MAX_PAGE_SIZE = 100
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """
+    Spaces calls to acquire() at least 1 / rate seconds apart, across all tasks of an event loop.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class FetchError(Exception):
+    pass
+
+
+class NewscatcherClient:
+    """
+    Pooled, rate-limited and retrying client for the Newscatcher search endpoint. Use as an async context manager.
+    """
+
+    def __init__(self, api_key, url=API_URL, concurrency=4, rate=1.0, retries=5, backoff=1.0, timeout=30):
+        self.api_key = api_key
+        self.url = url
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.limiter = RateLimiter(rate)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.session = None
+        self.requests = 0
+        self.retried = 0
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        self.session = aiohttp.ClientSession(headers={'x-api-key': self.api_key}, connector=connector, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    # Seconds to wait before retry number `attempt` (0-based), unless the server said otherwise
+    def _delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff * 2 ** attempt * (0.5 + random.random())
+
+    async def fetch_page(self, params):
+        """
+        Fetch one page of results and return the decoded JSON response.
+        """
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            async with self.semaphore:
+                await self.limiter.acquire()
+                self.requests += 1
+                try:
+                    async with self.session.get(self.url, params=params) as response:
+                        if response.status == 200:
+                            return await response.json(content_type=None)
+                        if response.status not in RETRY_STATUSES:
+                            raise FetchError(f"HTTP {response.status} for {params}: {await response.text()}")
+                        retry_after = response.headers.get('Retry-After')
+                        error = f"HTTP {response.status}"
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = repr(e)
+            if attempt == self.retries:
+                raise FetchError(f"giving up on {params} after {self.retries + 1} attempts: {error}")
+            self.retried += 1
+            await asyncio.sleep(self._delay(attempt, retry_after))
+
+    async def search(self, q, from_date=None, page_size=MAX_PAGE_SIZE, max_pages=None, **params):
+        """
+        Yield the response of every page of a search, the first page first and the others as they arrive.
+        """
+        params = {'q': q, 'page_size': min(page_size, MAX_PAGE_SIZE), **params}
+        if from_date:
+            params['from'] = from_date
+        first = await self.fetch_page({**params, 'page': 1})
+        yield first
+        total_pages = int(first.get('total_pages') or 1)
+        if max_pages:
+            total_pages = min(total_pages, max_pages)
+        pages = [asyncio.ensure_future(self.fetch_page({**params, 'page': page})) for page in range(2, total_pages + 1)]
+        try:
+            for page in asyncio.as_completed(pages):
+                yield await page
+        finally:
+            for page in pages:
+                page.cancel()
+
+
+# Search terms stored in a search_term value: a JSON list, or one term in tables written before terms were merged
+def parse_terms(value):
+    if value is None:
+        return []
+    if value.startswith('['):
+        return json.loads(value)
+    return [value]
+
+
+def known_terms(store, table, articles, key):
+    """
+    {key: search terms already stored} for the articles of a page that are in the table.
+    """
+    columns = store.columns(table)
+    if 'search_term' not in columns or key not in columns:
+        return {}
+    keys = articles[key].dropna().tolist()
+    rows = []
+    for start in range(0, len(keys), 500):
+        batch = keys[start:start + 500]
+        rows += store.conn.execute(f"SELECT {quote(key)}, search_term FROM {quote(table)} "
+                                   f"WHERE {quote(key)} IN ({', '.join('?' * len(batch))})", batch).fetchall()
+    return {article_key: parse_terms(terms) for article_key, terms in rows}
+
+
+async def fetch_terms(db_name, terms, api_key, from_date=None, page_size=MAX_PAGE_SIZE, table='articles', max_pages=None,
+                      url=API_URL, concurrency=4, rate=1.0, retries=5, **params):
+    """
+    Fetch every page of every search term concurrently and upsert the articles into db_name.
+    Returns a {term: articles fetched} dict.
+    """
+    counts = {}
+    with Store(db_name) as store:
+        async with NewscatcherClient(api_key, url, concurrency, rate, retries) as client:
+            async def fetch_term(q):
+                counts[q] = 0
+                async for response in client.search(q, from_date, page_size, max_pages, **params):
+                    articles = pd.DataFrame(response.get('articles') or [])
+                    if not articles.empty:
+                        # Keep track of every search term that found the article. Nothing is awaited between reading
+                        # the stored terms and the upsert, so concurrent terms cannot lose each other's updates.
+                        key = natural_key(articles.columns, ARTICLE_KEYS)
+                        known = known_terms(store, table, articles, key)
+                        terms = (known.get(article_key, []) for article_key in articles[key])
+                        articles['search_term'] = [previous if q in previous else previous + [q] for previous in terms]
+                    counts[q] += store_articles(store, articles, table)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(fetch_term(q) for q in terms))
+            elapsed = time.perf_counter() - start
+            print(f"Fetched {sum(counts.values()):,} articles for {len(terms)} terms with {client.requests} requests "
+                  f"({client.retried} retried) in {elapsed:.1f}s; {db_name}, table name: {table} now holds {store.count(table):,} rows")
+    return counts
+
+
+def fetch_and_store(db_name, terms, api_key, from_date=None, page_size=MAX_PAGE_SIZE, table='articles', **kwargs):
+    return asyncio.run(fetch_terms(db_name, terms, api_key, from_date, page_size, table, **kwargs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch Newscatcher search results concurrently into an SQLite table.")
+    parser.add_argument("db", help="SQLite database file")
+    parser.add_argument("terms", nargs="+", help="Search terms")
+    parser.add_argument("--from-date", default=None, help="Earliest publication date, e.g. 2023/08/15")
+    parser.add_argument("--page-size", type=int, default=MAX_PAGE_SIZE, help="Articles per page (at most 100)")
+    parser.add_argument("--max-pages", type=int, default=None, help="Maximum pages per term")
+    parser.add_argument("--table", default="articles", help="Table name")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight")
+    parser.add_argument("--rate", type=float, default=1.0, help="Maximum requests per second (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=5, help="Retries per request")
+    parser.add_argument("--url", default=API_URL, help="Search endpoint")
+    parser.add_argument("--api-key", default=os.environ.get('NEWSCATCHER_API_KEY'), help="API key (default: $NEWSCATCHER_API_KEY)")
+    args = parser.parse_args()
+
+    if not args.api_key:
+        parser.error("an API key is required (--api-key or NEWSCATCHER_API_KEY)")
+    fetch_and_store(args.db, args.terms, args.api_key, args.from_date, args.page_size, args.table, max_pages=args.max_pages,
+                    url=args.url, concurrency=args.concurrency, rate=args.rate, retries=args.retries)
@@ -0,0 +1,364 @@
+# Sparse n-gram extraction behind SECTION 4 of text_analysis.py.
+# generate_filtered_ngrams tokenized every row with nltk.word_tokenize, dropped stopwords in a list comprehension and
+# joined the bigrams into one ', '-separated string per row, which the word cloud notebooks then split apart again.
+# Here texts are tokenized a batch at a time with a regex, every word gets an integer id (stopwords are masked by id),
+# and every n-gram becomes one int64: the ids of its words (+1) packed 21 bits apiece, so n=1..3 share one exact,
+# collision-free id space (up to 2,097,151 distinct words). The n-gram ids of a batch are mapped to matrix columns and
+# the result is a scipy.sparse document x n-gram count matrix plus a table of the n-grams with their global counts.
+# No per-row strings are built; the text of an n-gram is only decoded for the frequency table.
+# The regex tokens are not those of nltk.word_tokenize: texts are lowercased (word_tokenize kept the case and only the
+# stopword test was lowercased), punctuation is never a token (word_tokenize made "hoax ," and "real !" pairs), contractions
+# stay whole ("isn't" instead of "is" + "n't") and URLs split at every symbol, so the n-grams differ from those of
+# generate_filtered_ngrams around case, punctuation and contractions.
+# distinct=True keeps only n-grams whose words are all different ("climate climate" is dropped), as in wordclouds.ipynb.
+# ngram_sentiment replaces the iterrows loop of wordclouds.ipynb that collected the vader.comment of every n-gram of the
+# top 10 authors in Python lists: count, mean and variance per n-gram (and per author) come from grouped numpy reductions
+# over the stored entries of the matrix, for all rows at once.
+
+# call this like:
+# python ngrams.py co_occurrence_table.csv ngrams.comment --column comment -n 1,2,3
+# python ngrams.py processed_test.csv ngrams.comment --stopwords --sentiment vader.comment --by author
+
+import argparse
+import os
+import re
+import shutil
+import zipfile
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9]*(?:['\-][a-z0-9]+)*")
+TOKEN_BITS = 21
+MAX_TOKENS = (1 << TOKEN_BITS) - 1
+MAX_N = 3
+
+
+# Lowercase and tokenize a batch of texts; returns the flat list of tokens and the token count of every text
+def tokenize_batch(texts):
+    token_lists = [TOKEN_PATTERN.findall(text.lower()) if isinstance(text, str) else [] for text in texts]
+    lengths = np.fromiter(map(len, token_lists), dtype=np.int64, count=len(token_lists))
+    return [token for tokens in token_lists for token in tokens], lengths
+
+
+class NgramExtractor:
+    """
+    Turns batches of texts into sparse document x n-gram count matrices over a growing, shared set of columns.
+    """
+
+    def __init__(self, n=(2,), stop_words=(), distinct=True):
+        self.n = tuple(sorted(set(n)))
+        if not self.n or self.n[0] < 1 or self.n[-1] > MAX_N:
+            raise ValueError(f"n must be between 1 and {MAX_N}")
+        self.stop_words = {word.lower() for word in stop_words}
+        self.distinct = distinct
+        self.tokens = pd.Index([], dtype=object)
+        self.is_stop = np.zeros(0, dtype=bool)
+        self.columns = pd.Index([], dtype=np.int64)
+
+    @property
+    def n_features(self):
+        return len(self.columns)
+
+    # Ids of the given tokens, adding tokens seen for the first time
+    def _token_ids(self, tokens):
+        tokens = np.asarray(tokens, dtype=object)
+        ids = self.tokens.get_indexer(tokens)
+        new = ids < 0
+        if new.any():
+            added = pd.unique(tokens[new])
+            if len(self.tokens) + len(added) > MAX_TOKENS:
+                raise ValueError(f"more than {MAX_TOKENS} distinct words; n-gram ids would no longer be exact")
+            self.tokens = self.tokens.append(pd.Index(added, dtype=object))
+            self.is_stop = np.concatenate([self.is_stop, np.fromiter((token in self.stop_words for token in added), dtype=bool, count=len(added))])
+            ids[new] = self.tokens.get_indexer(tokens[new])
+        return ids.astype(np.int64)
+
+    # Column of every n-gram id, adding new columns at the end
+    def _column_ids(self, gram_ids):
+        columns = self.columns.get_indexer(gram_ids)
+        new = columns < 0
+        if new.any():
+            self.columns = self.columns.append(pd.Index(pd.unique(gram_ids[new]), dtype=np.int64))
+            columns[new] = self.columns.get_indexer(gram_ids[new])
+        return columns
+
+    def transform(self, texts):
+        """
+        Count the n-grams of a batch of texts. Returns a CSR matrix of shape (len(texts), n_features).
+        """
+        tokens, lengths = tokenize_batch(texts)
+        n_docs = len(lengths)
+        ids = self._token_ids(tokens)
+        docs = np.repeat(np.arange(n_docs), lengths)
+        # Stopwords are removed before the n-grams are formed, as in generate_filtered_ngrams
+        keep = ~self.is_stop[ids]
+        ids, docs = ids[keep] + 1, docs[keep]
+
+        gram_ids, gram_docs = [], []
+        for n in self.n:
+            if len(ids) < n:
+                continue
+            end = len(ids) - n + 1
+            valid = docs[:end] == docs[n - 1:]
+            packed = ids[:end].copy()
+            for offset in range(1, n):
+                following = ids[offset:end + offset]
+                packed = (packed << TOKEN_BITS) | following
+                if self.distinct:
+                    for previous in range(offset):
+                        valid &= ids[previous:end + previous] != following
+            gram_ids.append(packed[valid])
+            gram_docs.append(docs[:end][valid])
+        gram_ids = np.concatenate(gram_ids) if gram_ids else np.empty(0, dtype=np.int64)
+        gram_docs = np.concatenate(gram_docs) if gram_docs else np.empty(0, dtype=np.int64)
+
+        # Map each distinct n-gram of the batch once, then expand back to the occurrences
+        unique_ids, inverse = np.unique(gram_ids, return_inverse=True)
+        columns = self._column_ids(unique_ids)[inverse]
+        matrix = sp.csr_matrix((np.ones(len(columns), dtype=np.int32), (gram_docs, columns)), shape=(n_docs, self.n_features))
+        matrix.sum_duplicates()
+        return matrix
+
+    def transform_all(self, texts, batch_size=10000):
+        """
+        Count the n-grams of any number of texts, a batch at a time, into one CSR matrix.
+        """
+        texts = list(texts)
+        parts = [self.transform(texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)]
+        return stack_rows(parts, self.n_features)
+
+    def decode(self, columns=None):
+        """
+        Return the n-grams of the given columns (all when None) as a DataFrame with 'ngram' text and 'n'.
+        """
+        gram_ids = self.columns.to_numpy() if columns is None else self.columns.to_numpy()[columns]
+        words = []
+        n = np.zeros(len(gram_ids), dtype=np.int8)
+        remaining = gram_ids.copy()
+        for _ in range(MAX_N):
+            part = remaining & MAX_TOKENS
+            words.append(part)
+            n += part > 0
+            remaining >>= TOKEN_BITS
+        # words holds the last word first; missing words are 0 and decode to ''
+        labels = np.concatenate([np.array([''], dtype=object), self.tokens.to_numpy(dtype=object)])
+        text = pd.Series(labels[words[-1]], dtype=object)
+        for part in reversed(words[:-1]):
+            text = text.str.cat(pd.Series(labels[part], dtype=object), sep=' ')
+        return pd.DataFrame({'ngram': text.str.strip().to_numpy(), 'n': n})
+
+    def column_order(self):
+        """
+        Return the current column numbers in (n, n-gram text) order.
+        """
+        return self.decode().sort_values(['n', 'ngram'], kind='stable').index.to_numpy()
+
+    def sort_columns(self, *matrices):
+        """
+        Renumber the columns in (n, n-gram text) order and return the given matrices with their columns permuted to match.
+        Column numbers then no longer depend on the order the texts were seen in (e.g. chunk by chunk or all at once).
+        """
+        order = self.column_order()
+        self.columns = self.columns[order]
+        sorted_matrices = []
+        for matrix in matrices:
+            matrix.resize((matrix.shape[0], len(order)))
+            matrix = matrix[:, order].tocsr()
+            matrix.sort_indices()
+            sorted_matrices.append(matrix)
+        return sorted_matrices
+
+    def frequency_table(self, matrix):
+        """
+        Return the n-grams of the matrix columns with their total count and document frequency, in column order.
+        """
+        table = self.decode(np.arange(matrix.shape[1]))
+        table['count'] = np.asarray(matrix.sum(axis=0)).ravel().astype(np.int64)
+        table['documents'] = np.diff(matrix.tocsc().indptr).astype(np.int64)
+        return table
+
+
+# Stack CSR row blocks whose column count grew batch by batch
+def stack_rows(parts, n_features):
+    if not parts:
+        return sp.csr_matrix((0, n_features), dtype=np.int32)
+    for part in parts:
+        part.resize((part.shape[0], n_features))
+    return sp.vstack(parts, format='csr')
+
+
+def ngram_sentiment(matrix, scores, groups=None, terms=None, per_document=False, ddof=1):
+    """
+    Count, mean and variance of a per-row score (e.g. vader.comment) over the occurrences of every n-gram, overall or per
+    group of rows (e.g. author). Rows with a missing score or group are left out; per_document=True counts an n-gram once
+    per row however often it occurs there. Returns a DataFrame with [group,] column, [ngram,] count, mean and var,
+    sorted by group and column, with one row for every (group, n-gram) pair that occurs.
+    """
+    matrix = sp.csr_matrix(matrix)
+    scores = np.asarray(scores, dtype=np.float64)
+    if groups is None:
+        codes, labels = np.zeros(matrix.shape[0], dtype=np.int64), None
+    else:
+        codes, labels = pd.factorize(pd.Series(groups).reset_index(drop=True), sort=True)
+    # Explode the matrix into one (row, column, weight) triple per stored entry
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    keep = ~np.isnan(scores[rows]) & (codes[rows] >= 0)
+    rows, columns = rows[keep], matrix.indices[keep].astype(np.int64)
+    weights = np.ones(len(rows)) if per_document else matrix.data[keep].astype(np.float64)
+    values = scores[rows]
+
+    keys, inverse = np.unique(codes[rows] * matrix.shape[1] + columns, return_inverse=True)
+    count = np.bincount(inverse, weights, minlength=len(keys))
+    mean = np.bincount(inverse, weights * values, minlength=len(keys)) / np.maximum(count, 1)
+    # Two passes (squared deviations from the mean), which stays accurate where sum(x^2) - n*mean^2 would not
+    squares = np.bincount(inverse, weights * (values - mean[inverse]) ** 2, minlength=len(keys))
+    var = np.divide(squares, count - ddof, out=np.full(len(keys), np.nan), where=count > ddof)
+
+    result = pd.DataFrame({'column': keys % matrix.shape[1]})
+    if labels is not None:
+        result.insert(0, 'group', np.asarray(labels, dtype=object)[keys // matrix.shape[1]])
+    if terms is not None:
+        result['ngram'] = np.asarray(terms, dtype=object)[result['column'].to_numpy()]
+    result['count'] = count.astype(np.int64)
+    result['mean'] = mean
+    result['var'] = var
+    return result
+
+
+def drop_empty_columns(matrix, table):
+    """
+    Keep only the columns of a matrix that occur in it, with their rows of its frequency table. Matrices renumbered
+    together by sort_columns hold every column of the shared vocabulary, most of them empty in any one matrix.
+    """
+    keep = np.flatnonzero(table['count'].to_numpy() > 0)
+    return matrix[:, keep].tocsr(), table.iloc[keep].reset_index(drop=True)
+
+
+def save_ngrams(prefix, matrix, table):
+    """
+    Save an n-gram matrix as <prefix>.npz and its frequency table as <prefix>.csv (row i describes column i).
+    """
+    sp.save_npz(f"{prefix}.npz", matrix)
+    table.to_csv(f"{prefix}.csv", index=False)
+
+
+class NgramParts:
+    """
+    Row blocks of one n-gram matrix kept on disk as they are produced, with the count and document frequency of every
+    column, and merged into the file save_ngrams writes once the last block is in. Only one block is in memory at a time.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.paths = []
+        self.rows = 0
+        self.nnz = 0
+        self.count = np.zeros(0, dtype=np.int64)
+        self.documents = np.zeros(0, dtype=np.int64)
+
+    def add(self, matrix):
+        """Save a CSR block (duplicates summed, as returned by NgramExtractor.transform_all) and update the column totals."""
+        n_features = max(matrix.shape[1], len(self.count))
+        self.count = np.pad(self.count, (0, n_features - len(self.count)))
+        self.documents = np.pad(self.documents, (0, n_features - len(self.documents)))
+        self.count += np.bincount(matrix.indices, matrix.data, minlength=n_features).astype(np.int64)
+        self.documents += np.bincount(matrix.indices, minlength=n_features)
+        path = os.path.join(self.directory, f"part{len(self.paths):06d}.npz")
+        sp.save_npz(path, matrix, compressed=False)
+        self.paths.append(path)
+        self.rows += matrix.shape[0]
+        self.nnz += matrix.nnz
+
+    def save(self, prefix, extractor, order=None):
+        """
+        Write the blocks as one matrix to <prefix>.npz and its frequency table to <prefix>.csv, like
+        save_ngrams(prefix, *drop_empty_columns(...)) on the stacked blocks with columns sorted by order
+        (NgramExtractor.column_order; the order they were seen in when None): empty columns are left out.
+        """
+        n_features = extractor.n_features
+        count = np.pad(self.count, (0, n_features - len(self.count)))
+        documents = np.pad(self.documents, (0, n_features - len(self.documents)))
+        order = np.arange(n_features) if order is None else np.asarray(order)
+        kept = order[count[order] > 0]
+        # New column number of every kept old column
+        renumber = np.full(n_features, -1, dtype=np.int64)
+        renumber[kept] = np.arange(len(kept))
+        index_dtype = np.int32 if max(len(kept), self.nnz) <= np.iinfo(np.int32).max else np.int64
+        arrays = {name: os.path.join(self.directory, f"{name}.bin") for name in ('data', 'indices', 'indptr')}
+        data_dtype = np.int32
+        with open(arrays['data'], 'wb') as data, open(arrays['indices'], 'wb') as indices, open(arrays['indptr'], 'wb') as indptr:
+            indptr.write(np.zeros(1, dtype=index_dtype).tobytes())
+            offset = 0
+            for path in self.paths:
+                part = sp.load_npz(path).tocsr()
+                data_dtype = part.dtype
+                block = sp.csr_matrix((part.data, renumber[part.indices], part.indptr), shape=(part.shape[0], len(kept)))
+                block.sort_indices()
+                data.write(block.data.astype(data_dtype).tobytes())
+                indices.write(block.indices.astype(index_dtype).tobytes())
+                indptr.write((block.indptr[1:].astype(np.int64) + offset).astype(index_dtype).tobytes())
+                offset += block.nnz
+        # The layout of sp.save_npz: one .npy per array in a deflated zip
+        shapes = {'data': (self.nnz,), 'indices': (self.nnz,), 'indptr': (self.rows + 1,)}
+        dtypes = {'data': np.dtype(data_dtype), 'indices': np.dtype(index_dtype), 'indptr': np.dtype(index_dtype)}
+        with zipfile.ZipFile(f"{prefix}.npz", 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            for name in ('indices', 'indptr', 'format', 'shape', 'data'):
+                with archive.open(f"{name}.npy", 'w', force_zip64=True) as f:
+                    if name == 'format':
+                        np.lib.format.write_array(f, np.array(b'csr'), allow_pickle=False)
+                    elif name == 'shape':
+                        np.lib.format.write_array(f, np.array((self.rows, len(kept))), allow_pickle=False)
+                    else:
+                        header = {'descr': np.lib.format.dtype_to_descr(dtypes[name]), 'fortran_order': False, 'shape': shapes[name]}
+                        np.lib.format.write_array_header_1_0(f, header)
+                        with open(arrays[name], 'rb') as source:
+                            shutil.copyfileobj(source, f, 1 << 20)
+        table = extractor.decode(kept)
+        table['count'] = count[kept]
+        table['documents'] = documents[kept]
+        table.to_csv(f"{prefix}.csv", index=False)
+        return table
+
+
+def load_ngrams(prefix):
+    """
+    Load the (matrix, frequency table) saved by save_ngrams.
+    """
+    return sp.load_npz(f"{prefix}.npz").tocsr(), pd.read_csv(f"{prefix}.csv", keep_default_na=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sparse document x n-gram counts and a global n-gram frequency table.")
+    parser.add_argument("input", help="Input CSV file")
+    parser.add_argument("output", help="Output prefix: writes <output>.npz and <output>.csv")
+    parser.add_argument("--column", default="comment", help="Text column")
+    parser.add_argument("-n", default="2", help="Comma separated n-gram sizes, from 1 to 3")
+    parser.add_argument("--stopwords", action="store_true", help="Remove NLTK English stopwords")
+    parser.add_argument("--keep-repeats", action="store_true", help="Keep n-grams that repeat a word")
+    parser.add_argument("--chunksize", type=int, default=100000, help="Rows read per chunk")
+    parser.add_argument("--sentiment", default=None, help="Also write <output>.sentiment.csv: count/mean/var of this score column per n-gram")
+    parser.add_argument("--by", default=None, help="Group the sentiment table by this column too, e.g. author")
+    args = parser.parse_args()
+
+    stop_words = ()
+    if args.stopwords:
+        from models import stopwords
+        stop_words = stopwords('english')
+    extractor = NgramExtractor([int(n) for n in args.n.split(",")], stop_words, distinct=not args.keep_repeats)
+    columns = [column for column in (args.column, args.sentiment, args.by) if column]
+    parts, extra = [], []
+    for chunk in pd.read_csv(args.input, usecols=columns, chunksize=args.chunksize):
+        parts.append(extractor.transform_all(chunk[args.column], batch_size=len(chunk) or 1))
+        extra.append(chunk[columns[1:]])
+    matrix = stack_rows(parts, extractor.n_features)
+    table = extractor.frequency_table(matrix)
+    save_ngrams(args.output, matrix, table)
+    print(f"{matrix.shape[0]:,} documents, {matrix.shape[1]:,} n-grams. Saved to: {args.output}.npz and {args.output}.csv")
+    if args.sentiment:
+        extra = pd.concat(extra, ignore_index=True)
+        sentiment = ngram_sentiment(matrix, pd.to_numeric(extra[args.sentiment], errors='coerce'),
+                                    extra[args.by] if args.by else None, table['ngram'])
+        sentiment.to_csv(f"{args.output}.sentiment.csv", index=False)
+        print(f"{len(sentiment):,} n-gram sentiment rows. Saved to: {args.output}.sentiment.csv")
@@ -0,0 +1,158 @@
+# Persistent, content-addressed cache for NLP and sentiment results.
+# Every section of text_analysis.py recomputes VADER scores and spaCy parses for the same texts, and post titles repeat once per comment.
+# Results are stored in a SQLite file keyed by a hash of (feature, model name/version, text), so reruns and repeated texts
+# cost a lookup instead of an inference. The file is kept under a size budget by evicting the least recently used entries.
+
+# Typical use:
+#   cache = ResultCache('nlp_cache.sqlite')
+#   scores = cached_map(cache, 'vader.compound', 'vader', texts, lambda misses: [score(t) for t in misses])
+
+import hashlib
+import json
+import sqlite3
+import time
+
+from instrument import get_metrics
+
+# Cache file shared by the sections of text_analysis.py and pipeline.py
+DEFAULT_PATH = "nlp_cache.sqlite"
+
+# SQLite limits the number of bound parameters per statement
+_MAX_PARAMS = 500
+
+
+# Hash a (feature, model, text) triple into a fixed-size key. Changing the model version therefore never returns stale results.
+def cache_key(feature, model, text):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (feature, model, text):
+        encoded = str(part).encode("utf-8", errors="replace")
+        digest.update(len(encoded).to_bytes(8, "little"))
+        digest.update(encoded)
+    return digest.digest()
+
+
+# Identify a loaded spaCy model by name and version, e.g. "en_core_web_trf-3.7.3"
+def spacy_model_id(nlp):
+    return f"{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}"
+
+
+class ResultCache:
+    """
+    SQLite-backed cache of JSON-serialisable results, bounded to max_bytes of stored values.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=2 * 2**30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key BLOB PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.conn.commit()
+        self._size = self.size()
+
+    def get_many(self, keys):
+        """
+        Return a {key: value} dict for the keys found in the cache and mark them as recently used.
+        """
+        found = {}
+        keys = list(keys)
+        now = time.time()
+        for start in range(0, len(keys), _MAX_PARAMS):
+            batch = keys[start:start + _MAX_PARAMS]
+            marks = ",".join("?" * len(batch))
+            rows = self.conn.execute(f"SELECT key, value FROM results WHERE key IN ({marks})", batch).fetchall()
+            for key, value in rows:
+                found[key] = json.loads(value)
+            if rows:
+                self.conn.execute(f"UPDATE results SET last_used = ? WHERE key IN ({marks})", [now] + batch)
+        self.conn.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """
+        Store (key, value) pairs, then evict old entries if the cache has grown past max_bytes.
+        """
+        now = time.time()
+        rows = []
+        for key, value in items:
+            encoded = json.dumps(value)
+            rows.append((key, encoded, len(encoded), now))
+        self.conn.executemany("INSERT OR REPLACE INTO results (key, value, size, last_used) VALUES (?, ?, ?, ?)", rows)
+        self.conn.commit()
+        # Replaced entries are counted twice here; evict() re-measures before deleting anything
+        self._size += sum(row[2] for row in rows)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def size(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def evict(self):
+        """
+        Delete least recently used entries until the stored values fit in 90% of max_bytes.
+        """
+        self._size = self.size()
+        excess = self._size - self.max_bytes
+        if excess <= 0:
+            return 0
+        excess += self.max_bytes // 10
+        freed = 0
+        evicted = []
+        cursor = self.conn.execute("SELECT key, size FROM results ORDER BY last_used")
+        for key, size in cursor:
+            evicted.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        cursor.close()
+        self.conn.executemany("DELETE FROM results WHERE key = ?", evicted)
+        self.conn.commit()
+        self._size -= freed
+        return len(evicted)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def cached_map(cache, feature, model, texts, compute):
+    """
+    Return compute's result for every text, in input order, computing only texts that are not cached yet.
+    compute takes a list of texts and returns a list of results. Repeated texts are computed once.
+    With cache=None this still computes each distinct text only once.
+    """
+    texts = list(texts)
+    unique = list(dict.fromkeys(texts))
+    metrics = get_metrics()
+    metrics.count(f'{feature}.texts', len(texts))
+    metrics.count(f'{feature}.repeated_texts', len(texts) - len(unique))
+    if cache is None:
+        metrics.count(f'{feature}.computed', len(unique))
+        results = dict(zip(unique, compute(unique)))
+        return [results[text] for text in texts]
+
+    keys = {text: cache_key(feature, model, text) for text in unique}
+    found = cache.get_many(keys.values())
+    missing = [text for text in unique if keys[text] not in found]
+    metrics.count(f'{feature}.cache_hits', len(unique) - len(missing))
+    metrics.count(f'{feature}.computed', len(missing))
+    if missing:
+        computed = compute(missing)
+        cache.put_many((keys[text], value) for text, value in zip(missing, computed))
+        found.update((keys[text], value) for text, value in zip(missing, computed))
+    return [found[keys[text]] for text in texts]
@@ -0,0 +1,79 @@
+# Batched spaCy pipeline used by text_analysis.py for noun-phrase extraction.
+# Calling nlp(text) once per row through Series.apply pays the full per-call overhead of the model for every row.
+# nlp.pipe instead streams the texts through the model in batches (optionally across several worker processes),
+# with the pipes that noun chunks do not need (NER, lemmatizer, text classifiers) switched off.
+
+# Choosing a model:
+#  - "en_core_web_trf" (DEFAULT_MODEL) is the transformer model used for the published analysis. It is the most accurate,
+#    but on CPU it processes only a handful of documents per second. Keep n_process=1 with it and raise batch_size on a GPU.
+#  - "en_core_web_sm" (FAST_MODEL) is the small CNN model. It is one to two orders of magnitude faster and is the
+#    documented fallback for throughput runs, e.g. a first pass over a full subreddit dump. It also scales with n_process.
+# Install either with: python -m spacy download <model name>
+# spaCy itself is only imported when a model is loaded (see models.py), so importing this module is cheap.
+
+import time
+
+import models
+from nlp_cache import cached_map, spacy_model_id
+
+DEFAULT_MODEL = "en_core_web_trf"
+FAST_MODEL = "en_core_web_sm"
+
+# Pipes that noun_chunks does not use. noun_chunks needs the tagger, the attribute ruler (which sets the coarse POS tags)
+# and the dependency parser, plus the transformer for trf.
+UNUSED_PIPES = ("ner", "lemmatizer", "entity_ruler", "textcat", "textcat_multilabel")
+
+def load_nlp(model=DEFAULT_MODEL, fast=False):
+    """
+    Load a spaCy model once per process (shared through the model registry, see models.py).
+    fast=True swaps in the small CNN model for throughput runs.
+    """
+    return models.get(f"spacy:{FAST_MODEL if fast else model}")
+
+
+# Stream texts through nlp.pipe with the given pipes disabled. Pipes the model does not have are ignored.
+def pipe_docs(nlp, texts, batch_size=64, n_process=1, disable=UNUSED_PIPES, as_tuples=False):
+    disable = [name for name in disable if name in nlp.pipe_names]
+    return nlp.pipe(texts, batch_size=batch_size, n_process=n_process, disable=disable, as_tuples=as_tuples)
+
+
+# Join the noun chunks of a parsed document, in the same format as the original extract_noun_phrases
+def noun_phrases(doc):
+    return ", ".join(chunk.text for chunk in doc.noun_chunks)
+
+
+# Print how many documents a stage processed and its throughput in docs/sec
+def report_throughput(label, n_docs, start):
+    elapsed = time.perf_counter() - start
+    rate = n_docs / elapsed if elapsed > 0 else float("inf")
+    print(f"{label}: {n_docs:,} docs in {elapsed:.1f}s ({rate:,.1f} docs/sec)")
+    return rate
+
+
+def extract_noun_phrases(texts, nlp=None, batch_size=64, n_process=1, cache=None, report=True):
+    """
+    Return the noun phrases of every text (", "-joined, one string per text), in input order.
+    With a ResultCache (see nlp_cache.py) only texts not seen before with this model are parsed.
+    """
+    nlp = nlp or load_nlp()
+
+    def parse(misses):
+        start = time.perf_counter()
+        results = [noun_phrases(doc) for doc in pipe_docs(nlp, misses, batch_size=batch_size, n_process=n_process)]
+        if report:
+            report_throughput("noun phrases", len(results), start)
+        return results
+
+    return cached_map(cache, "noun_phrases", spacy_model_id(nlp), texts, parse)
+
+
+def add_noun_phrase_columns(df, columns=("title", "comment"), nlp=None, batch_size=64, n_process=1, cache=None, report=True):
+    """
+    Add a 'noun_phrase.<column>' column for each text column in df.
+    All columns go through nlp.pipe in a single streaming pass, so the model and worker processes are set up only once.
+    """
+    texts = [text for column in columns for text in df[column].astype(str)]
+    results = extract_noun_phrases(texts, nlp=nlp, batch_size=batch_size, n_process=n_process, cache=cache, report=report)
+    for position, column in enumerate(columns):
+        df[f"noun_phrase.{column}"] = results[position * len(df):(position + 1) * len(df)]
+    return df
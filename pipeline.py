@@ -0,0 +1,179 @@
+# Streaming (out-of-core) runner for the sections of text_analysis.py.
+# The sections load the whole input, copy it into a new DataFrame, add the derived columns and write everything at once,
+# so peak memory is several times the input size. Here the input is read in chunks of rows (CSV) or record batches
+# (Parquet, Arrow; see table_io.iter_table), every stage is a generator that takes chunks and yields chunks, and each
+# finished chunk is appended to the output, so memory depends on the chunk size and not on the input size.
+# Stages compute every row from that row alone (titles are deduplicated by the cached_map calls instead of PostIndex),
+# and CSV column dtypes are settled before the first chunk, so the output is identical to the in-memory sections:
+#   processed  SECTION 1  all input columns + noun_phrase.title/.comment + vader.title/.comment
+#   enhanced   SECTION 3  co-occurrence columns + subreddit + noun phrases + sentiment, missing values as ''
+#   ngrams     SECTION 4  co-occurrence columns + subreddit + sentiment, missing values as ''; plus the n-gram matrices
+#                         ngrams.title/.comment (.npz and .csv), written chunk by chunk to disk and merged at the end, so
+#                         only the n-gram vocabulary and its counts are kept in memory across chunks
+# Every stage is timed (without the stages upstream of it) and its output rows counted; set GSI_METRICS=metrics.json
+# to save the timings, counters and peak memory of a run (see instrument.py).
+
+# call this like:
+# python pipeline.py climatenews_subreddit.csv processed_climatenews_subreddit.csv --preset processed --chunksize 50000
+# python pipeline.py climatenews_subreddit.parquet enhanced_co_occurrence_table_with_ngrams.csv --preset ngrams
+# python pipeline.py climatenews_subreddit.csv enhanced_co_occurrence_table.csv --preset enhanced --rollup sentiment_rollup.sqlite
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+import models
+from instrument import get_metrics
+from nlp_cache import DEFAULT_PATH, ResultCache
+from sentiment import vader_compound
+from table_io import iter_table
+
+NLP_MODEL = "en_core_web_trf"
+CO_OCCURRENCE_COLUMNS = ['user', 'author', 'comment', 'title', 'post_text', 'comm_date']
+SECTION_COLUMNS = CO_OCCURRENCE_COLUMNS + ['url', 'thread_id']
+
+
+# Subreddit name from a post URL, as in text_analysis.py
+def subreddit_from_url(url):
+    return url.split('/')[4] if len(url.split('/')) > 4 else 'Unknown'
+
+
+def co_occurrence_stage(chunks):
+    """Keep the co-occurrence columns and add the subreddit of every row."""
+    for chunk in chunks:
+        co_occurrence = pd.DataFrame()
+        for column in CO_OCCURRENCE_COLUMNS:
+            co_occurrence[column] = chunk[column]
+        co_occurrence['subreddit'] = chunk['url'].apply(subreddit_from_url)
+        yield co_occurrence
+
+
+def noun_phrase_stage(chunks, columns=('title', 'comment'), nlp=None, model=NLP_MODEL, batch_size=64, n_process=1, cache=None):
+    """Add noun_phrase.<column> for every text column (see nlp_pipeline.py)."""
+    from nlp_pipeline import load_nlp, add_noun_phrase_columns
+    nlp = nlp or load_nlp(model)
+    for chunk in chunks:
+        yield add_noun_phrase_columns(chunk, list(columns), nlp=nlp, batch_size=batch_size, n_process=n_process, cache=cache, report=False)
+
+
+def sentiment_stage(chunks, columns=('title', 'comment'), cache=None):
+    """Add the VADER compound score vader.<column> for every text column."""
+    for chunk in chunks:
+        for column in columns:
+            chunk[f'vader.{column}'] = vader_compound(chunk[column], cache)
+        yield chunk
+
+
+def ngram_stage(chunks, extractor, columns=('title', 'comment'), prefix='ngrams'):
+    """
+    Count the n-grams of every text column and pass the chunks on unchanged.
+    The rows of every chunk are written to a temporary directory next to the output as they come; once the input is
+    exhausted they are merged into <prefix>.<column>.npz/.csv (see ngrams.py) and the directory is removed.
+    """
+    from ngrams import NgramParts
+    directory = tempfile.mkdtemp(prefix=f"{os.path.basename(prefix)}.parts.", dir=os.path.dirname(prefix) or '.')
+    try:
+        parts = {column: NgramParts(os.path.join(directory, column)) for column in columns}
+        for column in columns:
+            os.mkdir(parts[column].directory)
+        for chunk in chunks:
+            for column in columns:
+                parts[column].add(extractor.transform_all(chunk[column]))
+            yield chunk
+        order = extractor.column_order()
+        for column in columns:
+            parts[column].save(f"{prefix}.{column}", extractor, order)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def fill_missing_stage(chunks, value=''):
+    for chunk in chunks:
+        yield chunk.fillna(value)
+
+
+def write_csv(chunks, path):
+    """
+    Append every chunk to a CSV file (header from the first chunk) and return the number of rows written.
+    """
+    rows = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(f, header=(i == 0), index=False)
+            rows += len(chunk)
+    return rows
+
+
+# Give a stage function the name it is reported under in the metrics (see instrument.py)
+def named(name, stage):
+    stage.__name__ = name
+    return stage
+
+
+# Input columns and stages of the text_analysis.py sections
+def section_stages(preset, cache=None, nlp=None, model=NLP_MODEL, batch_size=64, n_process=1, ngram_sizes=(2,)):
+    noun_phrases = named('noun_phrase_stage', lambda chunks: noun_phrase_stage(chunks, nlp=nlp, model=model, batch_size=batch_size, n_process=n_process, cache=cache))
+    sentiment = named('sentiment_stage', lambda chunks: sentiment_stage(chunks, cache=cache))
+    if preset == 'processed':
+        return None, [noun_phrases, sentiment]
+    if preset == 'enhanced':
+        return SECTION_COLUMNS, [co_occurrence_stage, noun_phrases, sentiment, fill_missing_stage]
+    if preset == 'ngrams':
+        from ngrams import NgramExtractor
+        extractor = NgramExtractor(ngram_sizes, models.stopwords('english'), distinct=False)
+        return SECTION_COLUMNS, [co_occurrence_stage, named('ngram_stage', lambda chunks: ngram_stage(chunks, extractor)), sentiment, fill_missing_stage]
+    raise ValueError(f"unknown preset {preset!r}")
+
+
+def run(input_path, output_path, stages, columns=None, chunksize=100000):
+    """
+    Stream input_path through the stages (functions from an iterator of chunks to an iterator of chunks) into output_path.
+    Every stage is timed and its output rows counted under its function name without the '_stage' suffix (see instrument.py).
+    """
+    start = time.perf_counter()
+    metrics = get_metrics('pipeline.py')
+    metrics.count('bytes_read', os.path.getsize(input_path), stage='read')
+    chunks = metrics.chunks('read', iter_table(input_path, columns=columns, chunksize=chunksize))
+    for stage in stages:
+        chunks = metrics.chunks(getattr(stage, '__name__', 'stage').replace('_stage', ''), stage(chunks))
+    with metrics.stage('write'):
+        rows = write_csv(chunks, output_path)
+    elapsed = time.perf_counter() - start
+    print(f"Pipeline complete: {rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/sec). The output is saved to: {output_path}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a text_analysis.py section over an input of any size, chunk by chunk.")
+    parser.add_argument("input", help="Input CSV, Parquet or Arrow file")
+    parser.add_argument("output", help="Output CSV file")
+    parser.add_argument("--preset", choices=["processed", "enhanced", "ngrams"], default="processed", help="Section to run")
+    parser.add_argument("--chunksize", type=int, default=100000, help="Rows per chunk (CSV and Parquet)")
+    parser.add_argument("--cache", default=DEFAULT_PATH, help="Result cache file ('' to disable)")
+    parser.add_argument("--model", default=NLP_MODEL, help="spaCy model for noun phrases")
+    parser.add_argument("--batch-size", type=int, default=64, help="spaCy batch size")
+    parser.add_argument("--n-process", type=int, default=1, help="spaCy worker processes")
+    parser.add_argument("--rollup", default=None, help="Also add the sentiment scores to this rollup database (see rollup.py)")
+    parser.add_argument("--replace-rollup", action="store_true", help="Clear the rollup before adding the scores")
+    args = parser.parse_args()
+
+    cache = ResultCache(args.cache) if args.cache else None
+    columns, stages = section_stages(args.preset, cache, model=args.model, batch_size=args.batch_size, n_process=args.n_process)
+    rollup = None
+    if args.rollup:
+        from rollup import SentimentRollup, rollup_stage
+        rollup = SentimentRollup(args.rollup)
+        if not args.replace_rollup and rollup.has_source(args.input):
+            parser.error(f"{args.input} was already added to {args.rollup} (use --replace-rollup to rebuild it)")
+        stages.append(named('rollup_stage', lambda chunks: rollup_stage(chunks, rollup, args.input, args.replace_rollup)))
+    try:
+        run(args.input, args.output, stages, columns, args.chunksize)
+    finally:
+        if cache is not None:
+            cache.close()
+        if rollup is not None:
+            rollup.close()
@@ -0,0 +1,191 @@
+# Pre-aggregated sentiment store for viz.py.
+# viz.py used to read the whole table, parse every comm_date and average vader.title/vader.comment per subreddit and day,
+# once per plot. Here the scores are rolled up as they are produced: for every (subreddit, day, hour, metric) an SQLite
+# table keeps sum, count, min and max. Each chunk is grouped in pandas and merged with one upsert that adds the sums and
+# counts and widens min/max, so the rollup grows with the number of hours and subreddits, not with the number of rows.
+# Means at any granularity (hour, day, week, month, ...) come from summing the stored sums and counts.
+# Every row must be added once: the input files already added are recorded and adding one again is refused (start over
+# with replace=True / --replace, which empties the rollup in the same transaction). The rows of a file and its record are
+# committed in one transaction once the whole file has gone through, so a run that fails partway leaves the rollup as it
+# was and can simply be rerun.
+
+# call this like:
+# python rollup.py processed_climatenews_subreddit.csv sentiment_rollup.sqlite
+# or while running a section: python pipeline.py climatenews_subreddit.csv processed.csv --rollup sentiment_rollup.sqlite
+
+import argparse
+import sqlite3
+import time
+
+import pandas as pd
+
+from table_io import iter_table
+
+METRICS = ('vader.title', 'vader.comment')
+
+
+class SentimentRollup:
+    """
+    Sum/count/min/max of sentiment metrics per (subreddit, day, hour), stored in SQLite and updated chunk by chunk.
+    """
+
+    def __init__(self, path='sentiment_rollup.sqlite', metrics=METRICS, time_column='comm_date', group_column='subreddit'):
+        self.path = path
+        self.metrics = list(metrics)
+        self.time_column = time_column
+        self.group_column = group_column
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rollup ("
+            "subreddit TEXT NOT NULL, day TEXT NOT NULL, hour INTEGER NOT NULL, metric TEXT NOT NULL, "
+            "sum REAL NOT NULL, count INTEGER NOT NULL, min REAL NOT NULL, max REAL NOT NULL, "
+            "PRIMARY KEY (subreddit, day, hour, metric)) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, rows INTEGER, added REAL)")
+        self.conn.commit()
+
+    def clear(self, commit=True):
+        self.conn.execute("DELETE FROM rollup")
+        self.conn.execute("DELETE FROM sources")
+        if commit:
+            self.conn.commit()
+
+    def has_source(self, name):
+        return self.conn.execute("SELECT 1 FROM sources WHERE name = ?", (str(name),)).fetchone() is not None
+
+    def add_source(self, name, rows):
+        """Record that the rows of source `name` were added, in the open transaction (see add_chunks)."""
+        self.conn.execute("INSERT INTO sources (name, rows, added) VALUES (?, ?, ?)", (str(name), rows, time.time()))
+
+    def add_chunks(self, chunks, source, replace=False):
+        """
+        Add every chunk to the rollup and yield it on unchanged. Nothing is committed until the last chunk is through;
+        the source is then recorded and committed with the rows. If the chunks stop early (an error in this or a later
+        stage), the rows added so far are rolled back. replace=True empties the rollup first, in the same transaction.
+        """
+        if not replace and self.has_source(source):
+            raise ValueError(f"{source} was already added to {self.path}; use replace=True / --replace to rebuild the rollup")
+        rows = 0
+        try:
+            if replace:
+                self.clear(commit=False)
+            for chunk in chunks:
+                rows += self.update(chunk, commit=False)
+                yield chunk
+            self.add_source(source, rows)
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+
+    def update(self, df, commit=True):
+        """
+        Add the rows of a chunk to the rollup and return their number. Rows without a date are skipped, as are missing
+        metric values. commit=False leaves the transaction open (see add_chunks).
+        """
+        metrics = [metric for metric in self.metrics if metric in df.columns]
+        hours = pd.to_datetime(df[self.time_column], errors='coerce').dt.floor('h')
+        frame = df[metrics].apply(pd.to_numeric, errors='coerce')
+        frame['subreddit'] = df[self.group_column].fillna('Unknown').astype(str).to_numpy()
+        frame['hour'] = hours.to_numpy()
+        frame = frame[hours.notna().to_numpy()]
+        if frame.empty or not metrics:
+            return 0
+        long = frame.melt(id_vars=['subreddit', 'hour'], value_vars=metrics, var_name='metric').dropna(subset=['value'])
+        grouped = long.groupby(['subreddit', 'hour', 'metric'], sort=False)['value'].agg(['sum', 'count', 'min', 'max']).reset_index()
+        rows = list(zip(grouped['subreddit'], grouped['hour'].dt.strftime('%Y-%m-%d'), grouped['hour'].dt.hour.astype(int),
+                        grouped['metric'], grouped['sum'].astype(float), grouped['count'].astype(int),
+                        grouped['min'].astype(float), grouped['max'].astype(float)))
+        self.conn.executemany(
+            "INSERT INTO rollup (subreddit, day, hour, metric, sum, count, min, max) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (subreddit, day, hour, metric) DO UPDATE SET "
+            "sum = sum + excluded.sum, count = count + excluded.count, "
+            "min = min(min, excluded.min), max = max(max, excluded.max)", rows)
+        if commit:
+            self.conn.commit()
+        return len(frame)
+
+    def query(self, freq='D', metrics=None, subreddits=None, start=None, end=None):
+        """
+        Return sentiment per subreddit and period as a long DataFrame: subreddit, date, metric, mean, count, min, max.
+        freq is 'h' (hours), 'D' (days) or any coarser pandas period alias ('W', 'M', 'Q', 'Y'); start and end ('YYYY-MM-DD',
+        end exclusive) limit the days read.
+        """
+        hourly = freq.lower() == 'h'
+        where, params = [], []
+        if metrics:
+            where.append(f"metric IN ({', '.join('?' * len(metrics))})")
+            params.extend(metrics)
+        if subreddits:
+            where.append(f"subreddit IN ({', '.join('?' * len(subreddits))})")
+            params.extend(subreddits)
+        if start is not None:
+            where.append("day >= ?")
+            params.append(str(start))
+        if end is not None:
+            where.append("day < ?")
+            params.append(str(end))
+        keys = "subreddit, day, hour, metric" if hourly else "subreddit, day, metric"
+        sql = (f"SELECT {keys}, SUM(sum) AS sum, SUM(count) AS count, MIN(min) AS min, MAX(max) AS max FROM rollup"
+               + (f" WHERE {' AND '.join(where)}" if where else "") + f" GROUP BY {keys}")
+        result = pd.read_sql_query(sql, self.conn, params=params)
+        if hourly:
+            result['date'] = pd.to_datetime(result['day']) + pd.to_timedelta(result['hour'], unit='h')
+        else:
+            result['date'] = pd.to_datetime(result['day'])
+            if freq.upper() != 'D':
+                result['date'] = result['date'].dt.to_period(freq).dt.start_time
+                result = result.groupby(['subreddit', 'date', 'metric'], as_index=False).agg(
+                    sum=('sum', 'sum'), count=('count', 'sum'), min=('min', 'min'), max=('max', 'max'))
+        result['mean'] = result['sum'] / result['count']
+        return result[['subreddit', 'date', 'metric', 'mean', 'count', 'min', 'max']].sort_values(['subreddit', 'date', 'metric'], ignore_index=True)
+
+    def means(self, freq='D', metrics=None, **kwargs):
+        """
+        Mean of every metric per subreddit and period, one column per metric (the shape of a groupby(...).mean()).
+        """
+        long = self.query(freq, metrics, **kwargs)
+        wide = long.pivot_table(index=['subreddit', 'date'], columns='metric', values='mean', aggfunc='first').reset_index()
+        wide.columns.name = None
+        return wide
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def rollup_stage(chunks, rollup, source, replace=False):
+    """Pipeline stage (see pipeline.py): add every chunk to the rollup and pass it on unchanged (committed at the end)."""
+    return rollup.add_chunks(chunks, source, replace)
+
+
+def rollup_file(input_path, path='sentiment_rollup.sqlite', chunksize=100000, replace=False):
+    """
+    Add the rows of a scored table (CSV, Parquet or Arrow) to the rollup at path.
+    """
+    start = time.perf_counter()
+    rows = 0
+    with SentimentRollup(path) as rollup:
+        columns = [rollup.group_column, rollup.time_column] + rollup.metrics
+        for chunk in rollup.add_chunks(iter_table(input_path, columns=columns, chunksize=chunksize), input_path, replace):
+            rows += len(chunk)
+    print(f"Rolled up {rows:,} rows in {time.perf_counter() - start:.1f}s. The rollup is saved to: {path}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add scored rows to the per-hour sentiment rollup used by viz.py.")
+    parser.add_argument("input", help="Scored CSV, Parquet or Arrow file (subreddit, comm_date and vader.* columns)")
+    parser.add_argument("rollup", nargs="?", default="sentiment_rollup.sqlite", help="Rollup database")
+    parser.add_argument("--chunksize", type=int, default=100000, help="Rows read per chunk")
+    parser.add_argument("--replace", action="store_true", help="Clear the rollup before adding the file")
+    args = parser.parse_args()
+
+    rollup_file(args.input, args.rollup, args.chunksize, args.replace)
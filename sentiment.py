@@ -0,0 +1,163 @@
+# Parallel, chunked VADER sentiment scoring.
+# text_analysis.py scores 'title' and 'comment' row by row with Series.apply on a single core and keeps only the compound score.
+# This stage streams a CSV in chunks, scores the distinct texts of each chunk in batches across a process pool, and keeps
+# the full polarity vector as float32 columns:
+#   vader.<column>          compound score (same values as get_vader_sentiment in text_analysis.py)
+#   vader.<column>.neg/.neu/.pos
+# VADER is deterministic and every text is scored by the same SentimentIntensityAnalyzer.polarity_scores call as the
+# serial path, so the output does not depend on the number of workers or the chunk size.
+
+# call this like:
+# python sentiment.py climatenews_subreddit.csv vader_climatenews_subreddit.csv --columns title,comment --workers 8
+
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import models
+from nlp_cache import cached_map
+
+POLARITY_FIELDS = ('neg', 'neu', 'pos', 'compound')
+
+# One analyzer per process (see models.py). The parent loads it before starting the pool, so forked workers inherit it;
+# spawned workers build theirs once in the pool initializer.
+def get_analyzer():
+    return models.get('vader')
+
+
+def polarity_scores(texts):
+    """
+    Score a list of texts and return a float32 array of shape (len(texts), 4) in POLARITY_FIELDS order.
+    """
+    sia = get_analyzer()
+    scores = np.empty((len(texts), len(POLARITY_FIELDS)), dtype=np.float32)
+    for i, text in enumerate(texts):
+        polarity = sia.polarity_scores(text)
+        scores[i] = [polarity[field] for field in POLARITY_FIELDS]
+    return scores
+
+
+# Cache model id of the VADER scores (imports NLTK, so it is only built when scoring)
+def vader_model_id():
+    return f"vader-nltk-{models.nltk_version()}"
+
+
+# VADER compound score of every text of a column, through the result cache when one is given
+# (the scores of text_analysis.py and pipeline.py; texts already scored in this run or an earlier one cost a lookup)
+def vader_compound(series, cache=None):
+    sia = get_analyzer()
+    return cached_map(cache, 'vader.compound', vader_model_id(), series.astype(str), lambda texts: [sia.polarity_scores(text)['compound'] for text in texts])
+
+
+# Name the output columns of a text column: the compound score keeps the existing 'vader.<column>' name
+def polarity_columns(column):
+    return {field: f"vader.{column}" if field == 'compound' else f"vader.{column}.{field}" for field in POLARITY_FIELDS}
+
+
+# Split a list into batches of at most batch_size items
+def batches(items, batch_size):
+    return [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+
+
+class SentimentScorer:
+    """
+    Scores text columns of DataFrame chunks, serially or across a process pool (workers > 1).
+    """
+
+    def __init__(self, columns=('title', 'comment'), workers=None, batch_size=5000):
+        self.columns = list(columns)
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.executor = None
+        if self.workers > 1:
+            get_analyzer()
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=get_analyzer)
+
+    def submit(self, chunk):
+        """
+        Start scoring a chunk. Returns a handle for collect(); with a pool the work runs in the background.
+        Each distinct text in a column is scored once, so repeated titles cost nothing extra.
+        """
+        pending = []
+        for column in self.columns:
+            codes, uniques = pd.factorize(chunk[column].astype(str))
+            work = batches(list(uniques), self.batch_size)
+            if self.executor is None:
+                results = [polarity_scores(batch) for batch in work]
+            else:
+                results = [self.executor.submit(polarity_scores, batch) for batch in work]
+            pending.append((column, codes, results))
+        return chunk, pending
+
+    def collect(self, handle):
+        """
+        Wait for a submitted chunk and return it with the polarity columns added.
+        """
+        chunk, pending = handle
+        chunk = chunk.copy()
+        for column, codes, results in pending:
+            parts = [result if self.executor is None else result.result() for result in results]
+            scores = np.concatenate(parts) if parts else np.empty((0, len(POLARITY_FIELDS)), dtype=np.float32)
+            scores = scores[codes]
+            for i, (field, name) in enumerate(polarity_columns(column).items()):
+                chunk[name] = scores[:, i]
+        return chunk
+
+    def score(self, chunk):
+        return self.collect(self.submit(chunk))
+
+    def score_chunks(self, chunks, depth=2):
+        """
+        Score an iterable of DataFrame chunks and yield them in input order.
+        Up to depth chunks are in flight, so the pool keeps working while the next chunk is read and the previous one written.
+        """
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(self.submit(chunk))
+            if len(in_flight) >= depth:
+                yield self.collect(in_flight.popleft())
+        while in_flight:
+            yield self.collect(in_flight.popleft())
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def score_csv(input_path, output_path, columns=('title', 'comment'), chunksize=100000, workers=None, batch_size=5000):
+    """
+    Stream input_path in chunks, add the polarity columns for each text column and append the result to output_path.
+    """
+    start = time.perf_counter()
+    rows = 0
+    with SentimentScorer(columns, workers=workers, batch_size=batch_size) as scorer:
+        chunks = pd.read_csv(input_path, chunksize=chunksize)
+        for i, chunk in enumerate(scorer.score_chunks(chunks)):
+            chunk.to_csv(output_path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+            rows += len(chunk)
+    elapsed = time.perf_counter() - start
+    print(f"Sentiment complete: {rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/sec). The output is saved to: {output_path}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score text columns of a CSV with VADER across a process pool.")
+    parser.add_argument("input", help="Input CSV file")
+    parser.add_argument("output", help="Output CSV file (input columns plus the vader.* columns)")
+    parser.add_argument("--columns", default="title,comment", help="Comma separated text columns to score")
+    parser.add_argument("--chunksize", type=int, default=100000, help="Rows read per chunk")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores, 1 = serial)")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Texts per task sent to a worker")
+    args = parser.parse_args()
+
+    score_csv(args.input, args.output, args.columns.split(","), args.chunksize, args.workers, args.batch_size)
@@ -0,0 +1,316 @@
+# SQLite storage for Newscatcher articles and Reddit comments.
+# load_data.py used to write every file with DataFrame.to_sql(if_exists='replace'), so mass_load kept only the last file
+# and rows were identified by a positional unique_id. Here all files go into the same tables:
+#  - rows are upserted on a natural key (_id, or link, for Newscatcher articles; comm_id for Reddit comments), so loading a
+#    file twice, or two files that overlap, leaves one row per article or comment,
+#  - rows are written with executemany in batches, one transaction per batch, on a WAL database with relaxed syncing,
+#  - columns seen for the first time are added with ALTER TABLE, and author/user/date/subreddit columns are indexed,
+#  - the text columns (comment, title, post_text; title, excerpt, summary for articles) are kept in an FTS5 full-text index
+#    (<table>_fts, an external-content table that stores no copy of the text) maintained by triggers, and Store.search
+#    returns the keys, bm25 ranks and snippets of matching rows, optionally restricted to subreddits and a date range.
+#    The index is keyed on the row_id INTEGER PRIMARY KEY of the table, which VACUUM never renumbers (tables written before
+#    it existed are copied into a table that has it), and it is rebuilt when a text column is added to the table.
+
+# call this like:
+# python storage.py climate.db load comments test.csv climatenews_subreddit.csv
+# python storage.py news.db load articles "refugees_2023_08_15_page_size_50.json" "migrants_2023_08_15_page_size_50.json"
+# python storage.py climate.db search comments "NEAR(hoax climate, 10)" --subreddits climateskeptics --after 2023-11-01
+
+import argparse
+import json
+import sqlite3
+import time
+
+import pandas as pd
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-262144",  # 256 MiB
+    "PRAGMA mmap_size=1073741824",
+)
+
+# Natural key candidates (first one present wins) and indexed columns of every kind of table
+ARTICLE_KEYS = ('_id', 'link')
+COMMENT_KEYS = ('comm_id',)
+# Stable row id of every table, the key of its full-text index (an INTEGER PRIMARY KEY, unlike the implicit rowid, is kept by VACUUM)
+ROW_ID = 'row_id'
+INDEXED_COLUMNS = ('author', 'user', 'published_date', 'comm_date', 'post_date', 'subreddit', 'thread_id')
+# Full-text indexed columns (those present in the table) and the date column used by search filters
+TEXT_COLUMNS = ('comment', 'title', 'post_text', 'excerpt', 'summary')
+DATE_COLUMNS = ('comm_date', 'published_date', 'post_date')
+
+
+# Quote an identifier: column names such as _id or vader.title are not plain SQL names
+def quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+# SQLite column type for a pandas dtype
+def sql_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+
+# Column values SQLite can store: missing values become NULL, lists and dicts (authors, media, ...) JSON text
+def sql_values(series):
+    values = series.astype(object).to_numpy(copy=True)
+    values[series.isna().to_numpy()] = None
+    if series.dtype == object:
+        values = [json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict, tuple)) else value for value in values]
+    return values
+
+
+# Rows of a DataFrame as tuples of SQLite values, converted column by column
+def sql_rows(df):
+    return list(zip(*(sql_values(df[column]) for column in df.columns)))
+
+
+def connect(db_name):
+    conn = sqlite3.connect(db_name)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class Store:
+    """
+    Additive, indexed SQLite storage: tables grow by upserts and gain columns as new fields appear.
+    """
+
+    def __init__(self, db_name, batch_size=10000):
+        self.db_name = db_name
+        self.batch_size = batch_size
+        self.conn = connect(db_name)
+
+    def columns(self, table):
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({quote(table)})")]
+
+    def ensure_table(self, table, df, key):
+        """
+        Create the table for df if needed, add any missing columns and the unique index on the key.
+        """
+        existing = self.columns(table)
+        if not existing:
+            definitions = ", ".join([f"{quote(ROW_ID)} INTEGER PRIMARY KEY"]
+                                    + [f"{quote(column)} {sql_type(df[column].dtype)}" for column in df.columns])
+            self.conn.execute(f"CREATE TABLE {quote(table)} ({definitions})")
+        else:
+            if ROW_ID not in existing:
+                self.add_row_id(table)
+            for column in df.columns:
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(column)} {sql_type(df[column].dtype)}")
+        self.conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {quote(f'{table}_key')} ON {quote(table)} ({', '.join(map(quote, key))})")
+        self.create_indexes(table)
+        self.ensure_fts(table)
+        self.conn.commit()
+
+    def create_indexes(self, table, columns=INDEXED_COLUMNS):
+        existing = set(self.columns(table))
+        for column in columns:
+            if column in existing:
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS {quote(f'{table}_{column}')} ON {quote(table)} ({quote(column)})")
+
+    def add_row_id(self, table):
+        """
+        Copy a table created without the row_id column into one that has it, keeping the current rowids. The table's
+        indexes and full-text index are dropped with it and recreated by ensure_table.
+        """
+        info = list(self.conn.execute(f"PRAGMA table_info({quote(table)})"))
+        temp = f"{table}_with_{ROW_ID}"
+        definitions = ", ".join([f"{quote(ROW_ID)} INTEGER PRIMARY KEY"] + [f"{quote(row[1])} {row[2]}" for row in info])
+        names = ", ".join(quote(row[1]) for row in info)
+        with self.conn:
+            self.drop_fts(table)
+            self.conn.execute(f"CREATE TABLE {quote(temp)} ({definitions})")
+            self.conn.execute(f"INSERT INTO {quote(temp)} ({quote(ROW_ID)}, {names}) SELECT rowid, {names} FROM {quote(table)}")
+            self.conn.execute(f"DROP TABLE {quote(table)}")
+            self.conn.execute(f"ALTER TABLE {quote(temp)} RENAME TO {quote(table)}")
+
+    def ensure_fts(self, table):
+        """
+        Create the full-text index of the table's text columns and the triggers that keep it in sync, if needed.
+        An index over other columns (a text column was added to the table since) is dropped and built again.
+        """
+        fts = f"{table}_fts"
+        columns = [column for column in TEXT_COLUMNS if column in self.columns(table)]
+        if self.columns(fts) == columns:
+            return
+        self.drop_fts(table)
+        if not columns:
+            return
+        names = ", ".join(map(quote, columns))
+        new = ", ".join(f"new.{quote(column)}" for column in columns)
+        old = ", ".join(f"old.{quote(column)}" for column in columns)
+        row_id = quote(ROW_ID)
+        self.conn.execute(f"CREATE VIRTUAL TABLE {quote(fts)} USING fts5({names}, content={quote(table)}, "
+                          f"content_rowid={quote(ROW_ID)}, tokenize='porter unicode61')")
+        self.conn.execute(f"CREATE TRIGGER {quote(f'{fts}_insert')} AFTER INSERT ON {quote(table)} BEGIN "
+                          f"INSERT INTO {quote(fts)} (rowid, {names}) VALUES (new.{row_id}, {new}); END")
+        self.conn.execute(f"CREATE TRIGGER {quote(f'{fts}_delete')} AFTER DELETE ON {quote(table)} BEGIN "
+                          f"INSERT INTO {quote(fts)} ({quote(fts)}, rowid, {names}) VALUES ('delete', old.{row_id}, {old}); END")
+        self.conn.execute(f"CREATE TRIGGER {quote(f'{fts}_update')} AFTER UPDATE OF {names} ON {quote(table)} BEGIN "
+                          f"INSERT INTO {quote(fts)} ({quote(fts)}, rowid, {names}) VALUES ('delete', old.{row_id}, {old}); "
+                          f"INSERT INTO {quote(fts)} (rowid, {names}) VALUES (new.{row_id}, {new}); END")
+        # Index the rows stored before the index existed
+        self.rebuild_fts(table)
+
+    def drop_fts(self, table):
+        fts = f"{table}_fts"
+        for trigger in ('insert', 'delete', 'update'):
+            self.conn.execute(f"DROP TRIGGER IF EXISTS {quote(f'{fts}_{trigger}')}")
+        self.conn.execute(f"DROP TABLE IF EXISTS {quote(fts)}")
+
+    def rebuild_fts(self, table):
+        fts = f"{table}_fts"
+        self.conn.execute(f"INSERT INTO {quote(fts)} ({quote(fts)}) VALUES ('rebuild')")
+        self.conn.commit()
+
+    # Key columns of a table, read back from its unique index
+    def key_columns(self, table):
+        return [row[2] for row in self.conn.execute(f"PRAGMA index_info({quote(f'{table}_key')})")]
+
+    def search(self, table, query, subreddits=None, after=None, before=None, limit=20, snippet_tokens=12):
+        """
+        Full-text search with an FTS5 query such as 'hoax', '"climate change"' or 'NEAR(hoax climate, 10)'.
+        Returns a DataFrame of the matching rows' keys, bm25 rank (lower is better) and a snippet, best first.
+        subreddits, after and before (dates as 'YYYY-MM-DD...' text, after inclusive, before exclusive) filter the rows.
+        """
+        fts = f"{table}_fts"
+        columns = self.columns(table)
+        key = self.key_columns(table)
+        selected = ", ".join(f"t.{quote(column)}" for column in key)
+        sql = (f"SELECT {selected}, bm25({quote(fts)}) AS rank, "
+               f"snippet({quote(fts)}, -1, '[', ']', '...', {int(snippet_tokens)}) AS snippet "
+               f"FROM {quote(fts)} JOIN {quote(table)} AS t ON t.{quote(ROW_ID)} = {quote(fts)}.rowid WHERE {quote(fts)} MATCH ?")
+        params = [query]
+        if subreddits:
+            sql += f" AND t.subreddit IN ({', '.join('?' * len(subreddits))})"
+            params.extend(subreddits)
+        if after is not None or before is not None:
+            date = natural_key(columns, DATE_COLUMNS)
+            if after is not None:
+                sql += f" AND t.{quote(date)} >= ?"
+                params.append(str(after))
+            if before is not None:
+                sql += f" AND t.{quote(date)} < ?"
+                params.append(str(before))
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(int(limit))
+        return pd.DataFrame(self.conn.execute(sql, params).fetchall(), columns=key + ['rank', 'snippet'])
+
+    def upsert(self, table, df, key):
+        """
+        Insert the rows of df, replacing the stored values of rows whose key already exists. Returns the number of rows.
+        Rows with a missing key are skipped.
+        """
+        key = [key] if isinstance(key, str) else list(key)
+        df = df.dropna(subset=key)
+        if df.empty:
+            return 0
+        self.ensure_table(table, df, key)
+        columns = list(df.columns)
+        updates = [column for column in columns if column not in key]
+        statement = (f"INSERT INTO {quote(table)} ({', '.join(map(quote, columns))}) VALUES ({', '.join('?' * len(columns))}) "
+                     f"ON CONFLICT ({', '.join(map(quote, key))}) DO "
+                     + (f"UPDATE SET {', '.join(f'{quote(c)} = excluded.{quote(c)}' for c in updates)}" if updates else "NOTHING"))
+        for start in range(0, len(df), self.batch_size):
+            batch = df.iloc[start:start + self.batch_size]
+            with self.conn:
+                self.conn.executemany(statement, sql_rows(batch))
+        return len(df)
+
+    def count(self, table):
+        return self.conn.execute(f"SELECT COUNT(*) FROM {quote(table)}").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# First natural key candidate present in the columns
+def natural_key(columns, candidates):
+    for key in candidates:
+        if key in columns:
+            return key
+    raise KeyError(f"none of the key columns {candidates} is present")
+
+
+def read_articles(filename):
+    """
+    Load the articles of a Newscatcher JSON response file into a DataFrame.
+    """
+    with open(filename, 'r') as f:
+        json_data = json.load(f)
+    return pd.DataFrame(json_data.get('articles') or [])
+
+
+def store_articles(store, df, table='articles'):
+    if df.empty:
+        return 0
+    return store.upsert(table, df, natural_key(df.columns, ARTICLE_KEYS))
+
+
+def store_comments(store, df, table='comments'):
+    if df.empty:
+        return 0
+    return store.upsert(table, df, natural_key(df.columns, COMMENT_KEYS))
+
+
+def load_files(db_name, table, filenames, kind='articles', chunksize=100000):
+    """
+    Upsert Newscatcher JSON files (kind='articles') or Reddit CSV files (kind='comments') into one table.
+    """
+    start = time.perf_counter()
+    rows = 0
+    with Store(db_name) as store:
+        for name in filenames:
+            if kind == 'articles':
+                rows += store_articles(store, read_articles(name), table)
+            else:
+                for chunk in pd.read_csv(name, chunksize=chunksize):
+                    rows += store_comments(store, chunk, table)
+        total = store.count(table)
+    print(f"Loaded {rows:,} rows from {len(filenames)} files in {time.perf_counter() - start:.1f}s; "
+          f"{db_name}, table name: {table} now holds {total:,} rows")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load Newscatcher JSON or Reddit CSV files into an indexed SQLite table, or search it.")
+    parser.add_argument("db", help="SQLite database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("load", help="Upsert files into a table")
+    load.add_argument("kind", choices=["articles", "comments"], help="articles: Newscatcher JSON files, comments: Reddit CSV files")
+    load.add_argument("files", nargs="+", help="Input files")
+    load.add_argument("--table", default=None, help="Table name (default: the kind)")
+    load.add_argument("--chunksize", type=int, default=100000, help="CSV rows read per chunk")
+    search = commands.add_parser("search", help="Full-text search of a table")
+    search.add_argument("table", help="Table to search, e.g. comments or articles")
+    search.add_argument("query", help="FTS5 query, e.g. 'NEAR(hoax climate, 10)'")
+    search.add_argument("--subreddits", default=None, help="Comma separated subreddits to keep")
+    search.add_argument("--after", default=None, help="Keep rows dated on or after this date (YYYY-MM-DD)")
+    search.add_argument("--before", default=None, help="Keep rows dated before this date (YYYY-MM-DD)")
+    search.add_argument("--limit", type=int, default=20, help="Maximum number of results")
+    args = parser.parse_args()
+
+    if args.command == "load":
+        load_files(args.db, args.table or args.kind, args.files, args.kind, args.chunksize)
+    else:
+        with Store(args.db) as store:
+            start = time.perf_counter()
+            results = store.search(args.table, args.query, args.subreddits.split(",") if args.subreddits else None,
+                                   args.after, args.before, args.limit)
+            with pd.option_context('display.max_colwidth', 120, 'display.width', 200):
+                print(results.to_string(index=False))
+            print(f"{len(results)} results in {(time.perf_counter() - start) * 1000:.1f} ms")
@@ -0,0 +1,96 @@
+# Reads the tables produced by tocsv.py (CSV, Parquet or Arrow IPC stream) into pandas, loading only the requested columns.
+# Parquet is columnar, so unread columns are never decoded; CSV falls back to pd.read_csv with usecols.
+# iter_table reads the same tables in chunks, for the streaming runner in pipeline.py.
+
+import numpy as np
+import pandas as pd
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.arrows', '.ipc')
+
+
+def read_table(path, columns=None, categorical=False):
+    """
+    Load a table with only the given columns (all columns when None).
+    Dictionary-encoded columns (subreddit, author, ...) come back as pandas categoricals when categorical=True,
+    and as plain object columns otherwise, so the result behaves like the one of pd.read_csv.
+    """
+    lower = str(path).lower()
+    if lower.endswith(PARQUET_EXTENSIONS):
+        df = pd.read_parquet(path, columns=columns)
+    elif lower.endswith(ARROW_EXTENSIONS):
+        import pyarrow as pa
+        with pa.memory_map(str(path)) as source:
+            table = pa.ipc.open_stream(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+        df = table.to_pandas()
+    else:
+        return pd.read_csv(path, usecols=columns)
+
+    if not categorical:
+        for column in df.columns:
+            if isinstance(df[column].dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype(object)
+    return df
+
+
+# Column dtypes of a whole CSV file, found chunk by chunk: the dtypes pd.read_csv would give the file read in one go,
+# so a chunked read with them converts (and writes back) every value the same way. A column that is integer in some
+# chunks and float (missing values) in others is float; any other mix is read as text.
+def csv_dtypes(path, columns=None, chunksize=100000):
+    seen = {}
+    for chunk in pd.read_csv(path, usecols=columns, chunksize=chunksize):
+        for column, dtype in chunk.dtypes.items():
+            seen.setdefault(column, set()).add(dtype)
+    dtypes = {}
+    for column, kinds in seen.items():
+        if len(kinds) == 1:
+            dtypes[column] = kinds.pop()
+        elif all(pd.api.types.is_integer_dtype(kind) or pd.api.types.is_float_dtype(kind) for kind in kinds):
+            dtypes[column] = 'float64'
+        else:
+            dtypes[column] = str
+    return dtypes
+
+
+# Record batches of a Parquet or Arrow IPC stream file
+def _arrow_batches(path, columns, chunksize):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if str(path).lower().endswith(PARQUET_EXTENSIONS):
+        yield from pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns)
+    else:
+        with pa.memory_map(str(path)) as source:
+            for batch in pa.ipc.open_stream(source):
+                yield batch if columns is None else batch.select(columns)
+
+
+def iter_table(path, columns=None, chunksize=100000, categorical=False):
+    """
+    Yield a table in DataFrame chunks of at most chunksize rows (CSV) or one record batch at a time (Parquet, Arrow),
+    with the dtypes read_table would give the whole table, so the chunks concatenate to the same data.
+    CSV files are scanned once beforehand to settle the column dtypes (see csv_dtypes).
+    """
+    lower = str(path).lower()
+    if not lower.endswith(PARQUET_EXTENSIONS + ARROW_EXTENSIONS):
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize, dtype=csv_dtypes(path, columns, chunksize))
+        return
+
+    import pyarrow as pa
+    # Integer columns with missing values anywhere in the file come out of read_table as float (unless the file's pandas
+    # metadata asks for a nullable integer dtype)
+    integer_columns = None
+    nullable = set()
+    for batch in _arrow_batches(path, columns, chunksize):
+        if integer_columns is None:
+            integer_columns = [field.name for field in batch.schema if pa.types.is_integer(field.type)]
+        nullable.update(name for name in integer_columns if batch.column(name).null_count)
+    for batch in _arrow_batches(path, columns, chunksize):
+        df = batch.to_pandas()
+        for column in df.columns:
+            if column in nullable and isinstance(df[column].dtype, np.dtype) and df[column].dtype.kind in 'iu':
+                df[column] = df[column].astype('float64')
+            elif not categorical and isinstance(df[column].dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype(object)
+        yield df
@@ -19,42 +19,71 @@
 
 #%% 
 import pandas as pd
-import spacy
-from nltk.sentiment import SentimentIntensityAnalyzer
-import sqlite3
+from nlp_pipeline import load_nlp, add_noun_phrase_columns
+from nlp_cache import ResultCache
+from sentiment import vader_compound
+from dedup import PostIndex, NearDuplicateIndex
+from table_io import read_table
+from instrument import get_metrics
 # from bertopic import BERTopic
 
+# Stage timings, counters and memory of every section; set GSI_METRICS=metrics.json to save them (see instrument.py)
+metrics = get_metrics('text_analysis.py')
+
+# spaCy settings for noun-phrase extraction (see nlp_pipeline.py)
+# Set NLP_MODEL = "en_core_web_sm" for fast throughput runs; n_process > 1 only pays off with the small CNN models.
+NLP_MODEL = "en_core_web_trf"
+NLP_BATCH_SIZE = 64
+NLP_N_PROCESS = 1
+
+# Near-duplicate comments (copypasta, bot reposts): with a threshold (e.g. 0.8, the Jaccard similarity of word shingles)
+# section 1 extracts noun phrases once per cluster of near-duplicate comments and adds the cluster id of every comment
+# as 'cluster.comment' (see dedup.py); None parses every comment
+NEAR_DUPLICATE_THRESHOLD = None
+
 #%% 
-# Load the CSV file
+# Load the CSV file (a .parquet or .arrow file written by tocsv.py works too, see table_io.py)
 file_path = 'climatenews_subreddit.csv'  # Replace with your actual file path
-data = pd.read_csv(file_path)
-
-# Load the English tokenizer, tagger, parser, NER, and word vectors from spacy
-nlp = spacy.load("en_core_web_trf")
+with metrics.stage('section1.load'):
+    data = read_table(file_path)
+    metrics.count('rows_in', len(data))
 
-# Function to extract noun phrases from text using spaCy
-def extract_noun_phrases(text):
-    doc = nlp(text)
-    noun_phrases = [chunk.text for chunk in doc.noun_chunks]
-    return ", ".join(noun_phrases)
+# Load the English tokenizer, tagger, parser, NER, and word vectors from spacy (once per session, see models.py)
+nlp = load_nlp(NLP_MODEL)
 
-# Initialize VADER sentiment analyzer
-# and defines a function (get_vader_sentiment) to calculate sentiment scores using VADER.
-sia = SentimentIntensityAnalyzer()
+# Persistent cache of NLP and sentiment results (nlp_cache.sqlite), shared by every section and every rerun (see nlp_cache.py).
+# VADER scores go through it with sentiment.vader_compound.
+cache = ResultCache()
 
-# Function to calculate VADER sentiment score
-def get_vader_sentiment(text):
-    return sia.polarity_scores(text)['compound']
+# Titles are repeated on every comment row of their post: analyse each post once and broadcast the results to its rows
+posts = PostIndex(data)
+posts.report()
+post_data = posts.posts(['title'])
 
 # Apply the functionsto extract noun phrases and calculate sentiment scores for the 'title' and 'comment' columns in the DataFrame.
-data['noun_phrase.title'] = data['title'].astype(str).apply(extract_noun_phrases)
-data['noun_phrase.comment'] = data['comment'].astype(str).apply(extract_noun_phrases)
-data['vader.title'] = data['title'].astype(str).apply(get_vader_sentiment)
-data['vader.comment'] = data['comment'].astype(str).apply(get_vader_sentiment)
+with metrics.stage('section1.noun_phrases'):
+    add_noun_phrase_columns(post_data, ['title'], nlp=nlp, batch_size=NLP_BATCH_SIZE, n_process=NLP_N_PROCESS, cache=cache)
+    data['noun_phrase.title'] = posts.broadcast(post_data['noun_phrase.title'])
+    if NEAR_DUPLICATE_THRESHOLD:
+        with metrics.stage('section1.near_duplicates'):
+            comments = NearDuplicateIndex(data, 'comment', threshold=NEAR_DUPLICATE_THRESHOLD)
+            comments.report()
+            metrics.count('clusters', comments.n_clusters)
+        comment_data = comments.posts(['comment'])
+        add_noun_phrase_columns(comment_data, ['comment'], nlp=nlp, batch_size=NLP_BATCH_SIZE, n_process=NLP_N_PROCESS, cache=cache)
+        data['noun_phrase.comment'] = comments.broadcast(comment_data['noun_phrase.comment'])
+        data['cluster.comment'] = comments.codes
+    else:
+        add_noun_phrase_columns(data, ['comment'], nlp=nlp, batch_size=NLP_BATCH_SIZE, n_process=NLP_N_PROCESS, cache=cache)
+with metrics.stage('section1.vader'):
+    data['vader.title'] = posts.broadcast(vader_compound(post_data['title'], cache))
+    data['vader.comment'] = vader_compound(data['comment'], cache)
 
 # Save the modified dataframe to CSV file
 output_file_path = 'processed_climatenews_subreddit.csv'  # Replace with your desired output file path
-data.to_csv(output_file_path, index=False)
+with metrics.stage('section1.write'):
+    data.to_csv(output_file_path, index=False)
+    metrics.count('rows_out', len(data))
 
 print("Processing complete. The output is saved to:", output_file_path)
 
@@ -62,13 +91,21 @@ print("Processing complete. The output is saved to:", output_file_path)
 # SECTION 2: Co-occurrence Analysis
 #%% 
 import pandas as pd
+from models import stopwords
+from table_io import read_table
+from cooccurrence import Vocabulary, CooccurrenceCounter
+from instrument import get_metrics
 
-# Load the CSV file - reloads the original data from the CSV file.
+metrics = get_metrics('text_analysis.py')
+
+# Load the CSV file - reloads the original data from the CSV file, reading only the columns this section uses.
 file_path = 'climatenews_subreddit.csv'  # Replace with your actual file path
-data = pd.read_csv(file_path)
+required_columns = ['user', 'author', 'comment', 'title', 'post_text', 'comm_date']
+with metrics.stage('section2.load'):
+    data = read_table(file_path, columns=required_columns)
+    metrics.count('rows_in', len(data))
 
 # Ensure the necessary columns are present in the dataset
-required_columns = ['user', 'author', 'comment', 'title', 'post_text', 'comm_date']
 if not all(column in data.columns for column in required_columns):
     raise ValueError("One or more required columns are missing from the dataset.")
 
@@ -88,36 +125,55 @@ co_occurrence.fillna('', inplace=True)
 
 # Save the co-occurrence table to a new CSV file
 output_file_path = 'co_occurrence_table.csv'  # Replace with your desired output file path
-co_occurrence.to_csv(output_file_path, index=False)
+with metrics.stage('section2.write'):
+    co_occurrence.to_csv(output_file_path, index=False)
+    metrics.count('rows_out', len(co_occurrence))
 
 print("Co-occurrence table created and saved to:", output_file_path)
 
+# Word co-occurrence: count word pairs within a window of 5 tokens in the comments, scored with PMI/NPMI (see cooccurrence.py)
+# NLTK stopwords are downloaded only if they are not installed yet (see models.py)
+with metrics.stage('section2.word_pairs'):
+    word_vocabulary = Vocabulary.fit(co_occurrence['comment'], max_features=50000, min_df=2, stop_words=stopwords('english'))
+    word_pairs = CooccurrenceCounter(word_vocabulary, window=5)
+    for start in range(0, len(co_occurrence), 100000):
+        word_pairs.update(co_occurrence['comment'].iloc[start:start + 100000])
+
+# Save the top 10 neighbours of every word to a new CSV file
+neighbours_file_path = 'word_cooccurrence_neighbours.csv'  # Replace with your desired output file path
+word_pairs.top_neighbours(k=10, min_count=5).to_csv(neighbours_file_path, index=False)
+
+print("Word co-occurrence neighbours created and saved to:", neighbours_file_path)
+
 
 #%% 
 # SECTION 3 - COMBINE ANALYSIS AND NETWORKING
 import pandas as pd
-import spacy
-from nltk.sentiment import SentimentIntensityAnalyzer
+from nlp_pipeline import load_nlp, add_noun_phrase_columns
+from nlp_cache import ResultCache
+from sentiment import vader_compound
+from dedup import PostIndex
+from table_io import read_table
+from instrument import get_metrics
 
-# Load the CSV file
-file_path = 'climatenews_subreddit.csv'  # Replace with your actual file path
-data = pd.read_csv(file_path)
+metrics = get_metrics('text_analysis.py')
 
-# Load the English tokenizer, tagger, parser, NER, and word vectors from spacy
-nlp = spacy.load("en_core_web_trf")  # Using the transformer-based model
+# spaCy settings for noun-phrase extraction (see SECTION 1 and nlp_pipeline.py)
+NLP_MODEL = "en_core_web_trf"
+NLP_BATCH_SIZE = 64
+NLP_N_PROCESS = 1
 
-# Function to extract noun phrases
-def extract_noun_phrases(text):
-    doc = nlp(text)
-    noun_phrases = [chunk.text for chunk in doc.noun_chunks]
-    return ", ".join(noun_phrases)
+# Persistent cache of NLP and sentiment results (see SECTION 1 and nlp_cache.py)
+cache = ResultCache()
 
-# Initialize VADER sentiment analyzer
-sia = SentimentIntensityAnalyzer()
+# Load the CSV file, reading only the columns this section uses
+file_path = 'climatenews_subreddit.csv'  # Replace with your actual file path
+with metrics.stage('section3.load'):
+    data = read_table(file_path, columns=['user', 'author', 'comment', 'title', 'post_text', 'comm_date', 'url', 'thread_id'])
+    metrics.count('rows_in', len(data))
 
-# Function to calculate VADER sentiment score
-def get_vader_sentiment(text):
-    return sia.polarity_scores(text)['compound']
+# Load the English tokenizer, tagger, parser, NER, and word vectors from spacy
+nlp = load_nlp(NLP_MODEL)  # Reuses the model loaded in SECTION 1 when run in the same session
 
 # Create a new DataFrame for the co-occurrence table
 co_occurrence = pd.DataFrame()
@@ -131,18 +187,28 @@ co_occurrence['post_text'] = data['post_text']
 co_occurrence['comm_date'] = data['comm_date']
 co_occurrence['subreddit'] = data['url'].apply(lambda url: url.split('/')[4] if len(url.split('/')) > 4 else 'Unknown')
 
+# Title features are computed once per post (thread_id) and broadcast to the post's comment rows
+posts = PostIndex(data)
+posts.report()
+post_data = posts.posts(['title'])
+
 # Adding noun phrases and sentiment analysis results
-co_occurrence['noun_phrase.title'] = co_occurrence['title'].astype(str).apply(extract_noun_phrases)
-co_occurrence['noun_phrase.comment'] = co_occurrence['comment'].astype(str).apply(extract_noun_phrases)
-co_occurrence['vader.title'] = co_occurrence['title'].astype(str).apply(get_vader_sentiment)
-co_occurrence['vader.comment'] = co_occurrence['comment'].astype(str).apply(get_vader_sentiment)
+with metrics.stage('section3.noun_phrases'):
+    add_noun_phrase_columns(post_data, ['title'], nlp=nlp, batch_size=NLP_BATCH_SIZE, n_process=NLP_N_PROCESS, cache=cache)
+    co_occurrence['noun_phrase.title'] = posts.broadcast(post_data['noun_phrase.title'])
+    add_noun_phrase_columns(co_occurrence, ['comment'], nlp=nlp, batch_size=NLP_BATCH_SIZE, n_process=NLP_N_PROCESS, cache=cache)
+with metrics.stage('section3.vader'):
+    co_occurrence['vader.title'] = posts.broadcast(vader_compound(post_data['title'], cache))
+    co_occurrence['vader.comment'] = vader_compound(co_occurrence['comment'], cache)
 
 # Handle missing values if necessary (e.g., with empty strings)
 co_occurrence.fillna('', inplace=True)
 
 # Save the co-occurrence table with additional data to a new CSV file
 output_file_path = 'enhanced_co_occurrence_table.csv'  # Replace with your desired output file path
-co_occurrence.to_csv(output_file_path, index=False)
+with metrics.stage('section3.write'):
+    co_occurrence.to_csv(output_file_path, index=False)
+    metrics.count('rows_out', len(co_occurrence))
 
 #enhanced co-occurrence table now includes noun phrases and sentiment analysis results
 print("Enhanced co-occurrence table created and saved to:", output_file_path)
@@ -151,33 +217,32 @@ print("Enhanced co-occurrence table created and saved to:", output_file_path)
 #SECTION 4 - N-GRAMS and further analysis
 #%% 
 import pandas as pd
-import spacy
-from nltk.sentiment import SentimentIntensityAnalyzer
-from nltk.util import ngrams # NLTK is used to generate and filter n-grams (word pairs) from the text.
-from nltk.corpus import stopwords
-import nltk
+import models
+from nlp_cache import ResultCache
+from sentiment import vader_compound
+from dedup import PostIndex
+from table_io import read_table
+from ngrams import NgramExtractor, drop_empty_columns, save_ngrams
+from instrument import get_metrics
 
-# Download stopwords from nltk
-nltk.download('stopwords')
-stop_words = set(stopwords.words('english'))
+metrics = get_metrics('text_analysis.py')
 
-# Load the CSV file
-file_path = 'climatenews_subreddit.csv'  # Replace with your actual file path
-data = pd.read_csv(file_path)
+# Persistent cache of NLP and sentiment results (see SECTION 1 and nlp_cache.py)
+cache = ResultCache()
 
-# Initialize VADER sentiment analyzer
-sia = SentimentIntensityAnalyzer()
+# Stopwords from nltk (downloaded only if they are not installed yet)
+stop_words = set(models.stopwords('english'))
 
-# Function to calculate VADER sentiment score
-def get_vader_sentiment(text):
-    return sia.polarity_scores(text)['compound']
+# Load the CSV file, reading only the columns this section uses
+file_path = 'climatenews_subreddit.csv'  # Replace with your actual file path
+with metrics.stage('section4.load'):
+    data = read_table(file_path, columns=['user', 'author', 'comment', 'title', 'post_text', 'comm_date', 'url', 'thread_id'])
+    metrics.count('rows_in', len(data))
 
-# Function to generate and filter n-grams
-def generate_filtered_ngrams(text, n=2):
-    words = nltk.word_tokenize(text)
-    filtered_words = [word for word in words if word.lower() not in stop_words]
-    generated_ngrams = ngrams(filtered_words, n)
-    return ', '.join([' '.join(gram) for gram in generated_ngrams])
+# N-grams (word pairs) without stopwords, counted into sparse matrices (see ngrams.py). Pairs that repeat a word are kept,
+# as generate_filtered_ngrams kept them; distinct=True drops them as wordclouds.ipynb did.
+NGRAM_SIZES = (2,)
+ngram_extractor = NgramExtractor(NGRAM_SIZES, stop_words, distinct=False)
 
 # Create a new DataFrame for the co-occurrence table
 co_occurrence = pd.DataFrame()
@@ -191,18 +256,35 @@ co_occurrence['post_text'] = data['post_text']
 co_occurrence['comm_date'] = data['comm_date']
 co_occurrence['subreddit'] = data['url'].apply(lambda url: url.split('/')[4] if len(url.split('/')) > 4 else 'Unknown')
 
-# Adding N-grams and sentiment analysis results
-co_occurrence['ngrams.title'] = co_occurrence['title'].astype(str).apply(lambda x: generate_filtered_ngrams(x, 2))
-co_occurrence['ngrams.comment'] = co_occurrence['comment'].astype(str).apply(lambda x: generate_filtered_ngrams(x, 2))
-co_occurrence['vader.title'] = co_occurrence['title'].astype(str).apply(get_vader_sentiment)
-co_occurrence['vader.comment'] = co_occurrence['comment'].astype(str).apply(get_vader_sentiment)
+# Title features are computed once per post (thread_id) and broadcast to the post's comment rows
+posts = PostIndex(data)
+posts.report()
+post_titles = posts.posts(['title'])['title'].astype(str)
+
+# N-grams: row i of each matrix belongs to row i of the table. Titles are counted once per post and the post rows are
+# repeated for its comments; columns are sorted by n-gram and each file keeps the n-grams it holds (missing texts count nothing).
+with metrics.stage('section4.ngrams'):
+    title_ngrams = ngram_extractor.transform_all(posts.posts(['title'])['title'])[posts.codes]
+    comment_ngrams = ngram_extractor.transform_all(co_occurrence['comment'])
+    title_ngrams, comment_ngrams = ngram_extractor.sort_columns(title_ngrams, comment_ngrams)
+    for name, matrix in (('ngrams.title', title_ngrams), ('ngrams.comment', comment_ngrams)):
+        matrix, table = drop_empty_columns(matrix, ngram_extractor.frequency_table(matrix))
+        save_ngrams(name, matrix, table)
+        print(f"{name}: {matrix.shape[1]:,} distinct n-grams saved to {name}.npz and {name}.csv")
+
+# Adding sentiment analysis results
+with metrics.stage('section4.vader'):
+    co_occurrence['vader.title'] = posts.broadcast(vader_compound(post_titles, cache))
+    co_occurrence['vader.comment'] = vader_compound(co_occurrence['comment'], cache)
 
 # Handle missing values if necessary (e.g., with empty strings)
 co_occurrence.fillna('', inplace=True)
 
 # Save the co-occurrence table with additional data to a new CSV file
 output_file_path = 'enhanced_co_occurrence_table_with_ngrams.csv'  # Replace with your desired output file path
-co_occurrence.to_csv(output_file_path, index=False)
+with metrics.stage('section4.write'):
+    co_occurrence.to_csv(output_file_path, index=False)
+    metrics.count('rows_out', len(co_occurrence))
 
 print("Enhanced co-occurrence table with N-grams created and saved to:", output_file_path)
 
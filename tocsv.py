@@ -5,92 +5,662 @@
 # Errors like JSON decoding issues or missing keys in the JSON objects are logged, and processing continues.
 # This script is particularly useful in data analysis scenarios where large datasets are compressed for storage efficiency and need to be converted into a more accessible format like CSV for analysis.
 
+# The conversion is pipelined so that a full dump is limited by the disk rather than by one Python core:
+#  - a reader thread decompresses the file (zstandard releases the GIL while decompressing) and cuts the output into
+#    blocks of whole lines, handed over through a bounded queue,
+#  - a pool of worker processes splits each block into lines, parses the JSON (with orjson when it is installed)
+#    and formats the CSV rows,
+#  - the main thread writes the formatted blocks in their original order.
+# At most --workers * 2 blocks are in flight, so memory stays bounded whatever the size of the dump.
+
+# Besides CSV, --format parquet and --format arrow write typed columns (requires pyarrow):
+#  - integer fields such as created_utc and score as int64, flags such as over_18 as bool, upvote_ratio as float64,
+#  - low-cardinality fields such as subreddit and author dictionary-encoded,
+#  - everything else as large_string (nested objects as JSON).
+# Parquet output is written in row groups of --row-group-size rows; Arrow output uses the IPC stream format
+# (each block carries its own dictionaries). Downstream scripts read only the columns they need (see table_io.py).
+
+# Records can be filtered while streaming, so output size and conversion time follow the slice that is needed:
+# --subreddits, --after/--before (on created_utc), --authors/--exclude-authors and --min-score.
+# Lines that cannot match the subreddit or author lists are skipped with a byte-substring check before any JSON decoding.
+
+# Long conversions can be checkpointed and resumed (CSV output):
+#  - with --checkpoint-every N, every N lines the output is flushed and <output>.checkpoint.json records the position in the input
+#    (offset of the zstd frame and decompressed bytes into it), the line counts and the last created_utc,
+#  - --resume truncates the output to the last checkpoint and continues from the recorded position (and keeps checkpointing).
+# With --build-index or --use-index, a sidecar index <input>.idx.json keeps the frame offsets of the file and, for every day, the position of the first block
+# holding that day's records. With --use-index a run with --after starts at the indexed position of the day before,
+# and a run with --before stops a day after it. Plain runs write nothing next to the input, and a failure to save the index
+# (e.g. a read-only archive directory) is only logged (this assumes the dump is ordered by created_utc, as Pushshift dumps are).
+# Positions are frame-granular: a dump compressed as one zstd frame is decompressed from the start, but the lines before the
+# position are skipped without being parsed. Dumps recompressed into many frames (e.g. zstd with --block-size, or pzstd)
+# are seeked directly.
+
+# With GSI_METRICS=<file> the run also records its rows in/out, bad and skipped rows, compressed bytes read, bytes
+# decompressed and peak memory in a machine-readable metrics file (see instrument.py).
+
 # call this like:
 # python to_csv.py wallstreetbets_submissions.zst wallstreetbets_submissions.csv author,selftext,title
+# python to_csv.py wallstreetbets_submissions.zst wallstreetbets_submissions.csv author,selftext,title --workers 8
+# python to_csv.py wallstreetbets_submissions.zst wallstreetbets_submissions.parquet author,selftext,title,created_utc --format parquet
+# python to_csv.py RC_2023-11.zst climate_comments.csv author,body,created_utc --subreddits climatechange,climateskeptics --after 2023-11-15
+# python to_csv.py RC_2023-11.zst climate_comments.csv author,body,created_utc --resume
 
 import zstandard # zstandard library to decompress the .zst file. It reads the compressed data, decompresses it, and processes it in chunks.
 import os
+import io
 import json # Each line in the decompressed data is expected to be a JSON object. The script extracts specified fields from these JSON objects.
 import sys
 import csv
-from datetime import datetime
+import re
+import queue
+import argparse
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
 import logging.handlers
+from instrument import get_metrics
+
+# orjson parses several times faster than the standard library; fall back to json when it is not installed
+try:
+	import orjson
+	json_loads = orjson.loads
+except ImportError:
+	json_loads = json.loads
+
+
+# Column types for the typed output formats. Fields not listed here are written as strings.
+INT_FIELDS = {'created_utc', 'retrieved_on', 'retrieved_utc', 'score', 'ups', 'downs', 'num_comments', 'num_crossposts',
+	'controversiality', 'gilded', 'total_awards_received', 'depth'}
+FLOAT_FIELDS = {'upvote_ratio'}
+BOOL_FIELDS = {'over_18', 'is_self', 'stickied', 'locked', 'archived', 'spoiler', 'is_submitter', 'no_follow', 'send_replies'}
+DICTIONARY_FIELDS = {'subreddit', 'subreddit_id', 'author', 'domain', 'distinguished', 'link_flair_text', 'author_flair_text'}
 
 
 log = logging.getLogger("bot")
 log.setLevel(logging.DEBUG)
 log.addHandler(logging.StreamHandler())
 
-# This function reads chunks of the compressed file, attempting to decode them into a string.
-def read_and_decode(reader, chunk_size, max_window_size, previous_chunk=None, bytes_read=0):
-	chunk = reader.read(chunk_size)
-	bytes_read += chunk_size
-	if previous_chunk is not None:
-		chunk = previous_chunk + chunk
-	try:
-		return chunk.decode()
-	except UnicodeDecodeError:
-		if bytes_read > max_window_size:
-			raise UnicodeError(f"Unable to decode frame after reading {bytes_read:,} bytes")
-		return read_and_decode(reader, chunk_size, max_window_size, chunk, bytes_read)
+ZSTD_MAGIC = 0xFD2FB528
+CREATED_UTC = re.compile(rb'"created_utc":\s*"?(\d+)')
 
-# Opens the .zst file and processes it in chunks. Each chunk is split into lines, and each line (presumably a JSON object) is yielded for processing.
-def read_lines_zst(file_name):
+# What parse_block returns for one block
+BlockResult = namedtuple('BlockResult', ['output', 'lines', 'bad_lines', 'skipped', 'created', 'last_created', 'first_error'])
+
+# Returns the [start, end) offsets of the zstd frames in the file, walking the frame and block headers without decompressing anything.
+# Skippable frames are stepped over.
+def zstd_frames(file_name):
+	frames = []
+	with open(file_name, 'rb') as file_handle:
+		offset = 0
+		while True:
+			file_handle.seek(offset)
+			magic = file_handle.read(4)
+			if len(magic) < 4:
+				break
+			magic = int.from_bytes(magic, 'little')
+			if magic & 0xFFFFFFF0 == 0x184D2A50:
+				offset += 8 + int.from_bytes(file_handle.read(4), 'little')
+				continue
+			if magic != ZSTD_MAGIC:
+				raise ValueError(f"No zstd frame at offset {offset:,}")
+			descriptor = file_handle.read(1)[0]
+			single_segment = (descriptor >> 5) & 1
+			header_size = 1 + (1 - single_segment) + (0, 1, 2, 4)[descriptor & 3] + (single_segment, 2, 4, 8)[descriptor >> 6]
+			position = offset + 4 + header_size
+			while True:
+				file_handle.seek(position)
+				block_header = int.from_bytes(file_handle.read(3), 'little')
+				block_type = (block_header >> 1) & 3
+				position += 3 + (1 if block_type == 1 else block_header >> 3)
+				if block_header & 1:
+					break
+			end = position + (4 if (descriptor >> 2) & 1 else 0)
+			frames.append([offset, end])
+			offset = end
+	return frames
+
+# File-like view of one frame of the input, so the decompressor stops exactly at the end of the frame.
+class FrameSource:
+	def __init__(self, file_handle, start, end):
+		self.file_handle = file_handle
+		self.remaining = end - start
+		file_handle.seek(start)
+
+	def read(self, size=-1):
+		if size < 0 or size > self.remaining:
+			size = self.remaining
+		data = self.file_handle.read(size)
+		self.remaining -= len(data)
+		return data
+
+# Opens the .zst file and decompresses it in chunks, frame by frame, starting at position (frame offset, decompressed bytes into that frame).
+# Each chunk is cut at its last newline, so every yielded block holds whole lines (as bytes, so a multi-byte character split across chunks
+# is never a problem). Only the partial last line is carried over to the next block.
+# Yields (block, (compressed bytes read, position just after the block)), so a later run can start exactly after any block.
+def read_blocks_zst(file_name, chunk_size=2**24, frames=None, position=None):
+	frames = frames if frames is not None else zstd_frames(file_name)
+	frame_offset, skip = position if position is not None else (frames[0][0] if frames else 0, 0)
+	decompressor = zstandard.ZstdDecompressor(max_window_size=2**31)
 	with open(file_name, 'rb') as file_handle:
-		buffer = ''
-		reader = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle)
+		carry = b''
+		for offset, end_offset in frames:
+			if offset < frame_offset:
+				continue
+			reader = decompressor.stream_reader(FrameSource(file_handle, offset, end_offset))
+			frame_bytes = 0
+			while skip > 0:
+				skipped = len(reader.read(min(skip, chunk_size)))
+				if not skipped:
+					break
+				frame_bytes += skipped
+				skip -= skipped
+			while True:
+				chunk = reader.read(chunk_size)
+				if not chunk:
+					break
+				frame_bytes += len(chunk)
+				end = chunk.rfind(b"\n")
+				if end < 0:
+					carry += chunk
+					continue
+				yield carry + chunk[:end + 1], (file_handle.tell(), (offset, frame_bytes - len(chunk) + end + 1))
+				carry = chunk[end + 1:]
+			reader.close()
+		if carry:
+			yield carry, (file_handle.tell(), (offset, frame_bytes))
+
+# Yields every line of the .zst file (decoded) with the current position in the compressed file.
+def read_lines_zst(file_name):
+	for block, (file_bytes_processed, _) in read_blocks_zst(file_name):
+		for line in block.split(b"\n"):
+			if line:
+				yield line.decode(errors='replace'), file_bytes_processed
+
+# Runs read_blocks_zst on a background thread, handing blocks over through a bounded queue.
+class BlockReader(threading.Thread):
+	def __init__(self, file_name, chunk_size, max_pending, frames=None, position=None):
+		super().__init__(daemon=True)
+		self.file_name = file_name
+		self.chunk_size = chunk_size
+		self.frames = frames
+		self.position = position
+		self.blocks = queue.Queue(maxsize=max_pending)
+		self.error = None
+		self.bytes_decompressed = 0
+
+	def run(self):
+		try:
+			for item in read_blocks_zst(self.file_name, self.chunk_size, self.frames, self.position):
+				self.bytes_decompressed += len(item[0])
+				self.blocks.put(item)
+		except Exception as err:
+			self.error = err
+		finally:
+			self.blocks.put(None)
+
+	def __iter__(self):
 		while True:
-			chunk = read_and_decode(reader, 2**27, (2**29) * 2)
-			if not chunk:
+			item = self.blocks.get()
+			if item is None:
 				break
-			lines = (buffer + chunk).split("\n")
+			yield item
+		if self.error is not None:
+			raise self.error
+
+# Selects the records to convert. Name comparisons are case-insensitive.
+# precheck() runs on the raw line and only rejects lines that cannot match; matches() decides on the parsed object.
+class RecordFilter:
+	def __init__(self, subreddits=None, after=None, before=None, authors=None, exclude_authors=None, min_score=None):
+		self.subreddits = {name.lower() for name in subreddits} if subreddits else None
+		self.after = after
+		self.before = before
+		self.authors = {name.lower() for name in authors} if authors else None
+		self.exclude_authors = {name.lower() for name in exclude_authors} if exclude_authors else None
+		self.min_score = min_score
+		# Pushshift dumps are compact JSON, so a value appears in the line as "name" (quotes included)
+		self.subreddit_needles = [f'"{name}"'.encode() for name in self.subreddits] if self.subreddits else None
+		self.author_needles = [f'"{name}"'.encode() for name in self.authors] if self.authors else None
+
+	def precheck(self, line):
+		if self.subreddit_needles is None and self.author_needles is None:
+			return True
+		lowered = line.lower()
+		if self.subreddit_needles is not None and not any(needle in lowered for needle in self.subreddit_needles):
+			return False
+		if self.author_needles is not None and not any(needle in lowered for needle in self.author_needles):
+			return False
+		return True
+
+	def matches(self, obj):
+		if self.subreddits is not None and str(obj.get('subreddit', '')).lower() not in self.subreddits:
+			return False
+		if self.after is not None or self.before is not None:
+			created = int(obj['created_utc'])
+			if self.after is not None and created < self.after:
+				return False
+			if self.before is not None and created >= self.before:
+				return False
+		author = str(obj.get('author', '')).lower()
+		if self.authors is not None and author not in self.authors:
+			return False
+		if self.exclude_authors is not None and author in self.exclude_authors:
+			return False
+		if self.min_score is not None and int(obj.get('score') or 0) < self.min_score:
+			return False
+		return True
+
+# Parses a --after/--before value: a date (YYYY-MM-DD), a date and time (YYYY-MM-DD HH:MM:SS) in UTC, or a unix timestamp.
+def parse_timestamp(value):
+	if value is None:
+		return None
+	if value.isdigit():
+		return int(value)
+	for date_format in ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S'):
+		try:
+			return int(datetime.strptime(value, date_format).replace(tzinfo=timezone.utc).timestamp())
+		except ValueError:
+			pass
+	raise ValueError(f"Unrecognised date: {value}")
+
+# Parses a list option: comma separated names, or @path to a file with one name per line.
+def parse_names(value):
+	if value is None:
+		return None
+	if value.startswith('@'):
+		with open(value[1:], encoding='utf-8') as names_file:
+			return [name.strip() for name in names_file if name.strip()]
+	return [name.strip() for name in value.split(',') if name.strip()]
+
+# Builds the Arrow schema of the typed output formats for the requested fields.
+def arrow_schema(fields):
+	import pyarrow as pa
+	columns = []
+	for field in fields:
+		if field in INT_FIELDS:
+			columns.append(pa.field(field, pa.int64()))
+		elif field in FLOAT_FIELDS:
+			columns.append(pa.field(field, pa.float64()))
+		elif field in BOOL_FIELDS:
+			columns.append(pa.field(field, pa.bool_()))
+		elif field in DICTIONARY_FIELDS:
+			columns.append(pa.field(field, pa.dictionary(pa.int32(), pa.large_string())))
+		else:
+			columns.append(pa.field(field, pa.large_string()))
+	return pa.schema(columns)
+
+# Converts a JSON value to the Python type of its output column. Values that do not convert become nulls.
+def typed_value(field, value):
+	if value is None:
+		return None
+	try:
+		if field in INT_FIELDS:
+			return int(float(value)) if isinstance(value, str) else int(value)
+		if field in FLOAT_FIELDS:
+			return float(value)
+		if field in BOOL_FIELDS:
+			return bool(value)
+	except (ValueError, TypeError):
+		return None
+	if isinstance(value, str):
+		return value
+	if isinstance(value, (dict, list)):
+		return json.dumps(value)
+	return str(value)
+
+# Builds an Arrow record batch from the parsed column values.
+def arrow_batch(columns, schema):
+	import pyarrow as pa
+	arrays = []
+	for field in schema:
+		if pa.types.is_dictionary(field.type):
+			arrays.append(pa.array(columns[field.name], type=pa.large_string()).dictionary_encode())
+		else:
+			arrays.append(pa.array(columns[field.name], type=field.type))
+	return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+# Returns the created_utc of the last line of a block without parsing it, or None. Used for the day index, whatever the filters.
+def block_last_created(block):
+	start = block.rfind(b"\n", 0, len(block) - 1) + 1
+	match = CREATED_UTC.search(block, start)
+	return int(match.group(1)) if match else None
+
+# Parses one block of lines and formats the requested fields as CSV, or as an Arrow record batch for the typed formats.
+# Runs in the worker processes. Lines rejected by record_filter are counted as skipped.
+# Returns a BlockResult: the output, the number of lines, bad lines and skipped lines, the created_utc of the last written object
+# and of the last line of the block, and the first error seen.
+def parse_block(block, fields, output_format='csv', record_filter=None):
+	typed = output_format != 'csv'
+	if typed:
+		columns = {field: [] for field in fields}
+	else:
+		output = io.StringIO()
+		writer = csv.writer(output)
+	lines = 0
+	bad_lines = 0
+	skipped = 0
+	created = None
+	first_error = None
+	for line in block.split(b"\n"):
+		if not line:
+			continue
+		lines += 1
+		if record_filter is not None and not record_filter.precheck(line):
+			skipped += 1
+			continue
+		try:
+			obj = json_loads(line)
+			if record_filter is not None and not record_filter.matches(obj):
+				skipped += 1
+				continue
+			# Parsed before the row is added, so a record without a valid created_utc is only counted as bad
+			obj_created = int(obj['created_utc'])
+			if typed:
+				output_obj = [typed_value(field, obj[field]) for field in fields]
+				for field, value in zip(fields, output_obj):
+					columns[field].append(value)
+			else:
+				output_obj = []
+				for field in fields:
+					output_obj.append(str(obj[field]).encode("utf-8", errors='replace').decode())
+				writer.writerow(output_obj)
+			created = obj_created
+		except (ValueError, KeyError, TypeError) as err:
+			bad_lines += 1
+			if first_error is None:
+				first_error = (repr(err), line[:1000].decode(errors='replace'))
+	output = arrow_batch(columns, arrow_schema(fields)) if typed else output.getvalue()
+	return BlockResult(output, lines, bad_lines, skipped, created, block_last_created(block), first_error)
+
+# Runs parse_block over the blocks, in a process pool when workers > 1, and yields the results in input order,
+# each with the position information the reader attached to its block.
+# At most max_pending blocks are submitted ahead of the one being written.
+def parse_blocks(blocks, fields, workers, max_pending, output_format='csv', record_filter=None):
+	if workers <= 1:
+		for block, position in blocks:
+			yield parse_block(block, fields, output_format, record_filter), position
+		return
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		pending = deque()
+		for block, position in blocks:
+			pending.append((executor.submit(parse_block, block, fields, output_format, record_filter), position))
+			if len(pending) >= max_pending:
+				future, position = pending.popleft()
+				yield future.result(), position
+		while pending:
+			future, position = pending.popleft()
+			yield future.result(), position
+
+# Writes a JSON sidecar file atomically, so a crash never leaves a half-written checkpoint or index behind.
+def write_json(path, obj):
+	temp_path = path + '.tmp'
+	with open(temp_path, 'w', encoding='utf-8') as json_file:
+		json.dump(obj, json_file)
+	os.replace(temp_path, path)
+
+def read_json(path):
+	if not os.path.exists(path):
+		return None
+	with open(path, encoding='utf-8') as json_file:
+		return json.load(json_file)
+
+# Day index of an input file: for every day, the position of the first block whose last line is from that day or later.
+# Stored in <input>.idx.json together with the frame offsets, and only extended (never overwritten) by later runs.
+class DayIndex:
+	def __init__(self, input_file_path):
+		self.path = input_file_path + '.idx.json'
+		self.input_size = os.stat(input_file_path).st_size
+		saved = read_json(self.path)
+		if saved is not None and saved.get('input_size') == self.input_size:
+			self.frames = saved['frames']
+			self.days = saved['days']
+		else:
+			self.frames = zstd_frames(input_file_path)
+			self.days = {}
+		self.last_day = None
+		self.from_start = True
+
+	# Position of the first line of the file
+	def start(self):
+		return (self.frames[0][0] if self.frames else 0, 0)
+
+	# Position to start reading from to see every record created at or after the timestamp (with a day of slack), or None
+	def seek(self, timestamp):
+		target = datetime.fromtimestamp(timestamp - 86400, timezone.utc).date().isoformat()
+		earlier = [day for day in self.days if day <= target]
+		return tuple(self.days[max(earlier)]) if earlier else None
+
+	# Records a block that starts at block_start and whose last line was created at last_created.
+	# A run that does not start at the beginning of the file cannot tell where the day of its first block began, so it skips that day.
+	def add_block(self, block_start, last_created):
+		if last_created is None:
+			return
+		day = datetime.fromtimestamp(last_created, timezone.utc).date()
+		if self.last_day is None:
+			self.last_day = day
+			if self.from_start:
+				self.days.setdefault(day.isoformat(), list(block_start))
+			return
+		while self.last_day < day:
+			self.last_day += timedelta(days=1)
+			self.days.setdefault(self.last_day.isoformat(), list(block_start))
+
+	def save(self):
+		write_json(self.path, {'input_size': self.input_size, 'frames': self.frames, 'days': self.days})
+
+	# Saves the index, logging instead of raising when it cannot be written: the conversion itself does not depend on it
+	def try_save(self):
+		try:
+			self.save()
+		except OSError as err:
+			log.info(f"Could not save the day index to {self.path}: {err}")
+
+# Output writers. Each takes the blocks returned by parse_block, in order.
+# The CSV file is written as bytes so that its size is known exactly at every checkpoint.
+class CsvSink:
+	def __init__(self, path, fields, resume_bytes=None):
+		if resume_bytes is None:
+			self.file = open(path, "wb")
+			header = io.StringIO()
+			csv.writer(header).writerow(fields)
+			self.file.write(header.getvalue().encode('utf-8'))
+		else:
+			self.file = open(path, "r+b")
+			self.file.truncate(resume_bytes)
+			self.file.seek(resume_bytes)
+
+	def write(self, rows):
+		self.file.write(rows.encode('utf-8'))
+
+	# Flushes everything written so far to disk and returns the size of the file
+	def sync(self):
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		return self.file.tell()
 
-			for line in lines[:-1]:
-				yield line, file_handle.tell()
+	def close(self):
+		self.file.close()
 
-			buffer = lines[-1]
-		reader.close()
+# Collects record batches into row groups of at least row_group_size rows.
+class ParquetSink:
+	def __init__(self, path, fields, row_group_size=1000000):
+		import pyarrow.parquet as pq
+		self.schema = arrow_schema(fields)
+		self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+		self.row_group_size = row_group_size
+		self.batches = []
+		self.rows = 0
+
+	def write(self, batch):
+		self.batches.append(batch)
+		self.rows += batch.num_rows
+		if self.rows >= self.row_group_size:
+			self.flush()
+
+	def flush(self):
+		import pyarrow as pa
+		if self.batches:
+			self.writer.write_table(pa.Table.from_batches(self.batches, schema=self.schema), row_group_size=self.rows)
+		self.batches = []
+		self.rows = 0
+
+	def close(self):
+		self.flush()
+		self.writer.close()
+
+class ArrowSink:
+	def __init__(self, path, fields):
+		import pyarrow as pa
+		self.file = pa.OSFile(path, 'wb')
+		self.writer = pa.ipc.new_stream(self.file, arrow_schema(fields))
+
+	def write(self, batch):
+		self.writer.write_batch(batch)
+
+	def close(self):
+		self.writer.close()
+		self.file.close()
+
+def open_sink(path, fields, output_format, row_group_size, resume_bytes=None):
+	if output_format == 'parquet':
+		return ParquetSink(path, fields, row_group_size)
+	if output_format == 'arrow':
+		return ArrowSink(path, fields)
+	return CsvSink(path, fields, resume_bytes)
+
+# Records the state of a conversion after the last written block, so it can be resumed from there.
+def save_checkpoint(path, input_file_path, fields, output_format, position, lines, bad_lines, skipped_lines, last_created, output_bytes, complete=False):
+	write_json(path, {
+		'input': os.path.abspath(input_file_path), 'input_size': os.stat(input_file_path).st_size, 'fields': fields, 'format': output_format,
+		'frame_offset': position[0], 'frame_bytes': position[1], 'lines': lines, 'bad_lines': bad_lines, 'skipped_lines': skipped_lines,
+		'last_created_utc': last_created, 'output_bytes': output_bytes, 'complete': complete,
+	})
 
 # main block: 
-# Handles command-line arguments, sets up the CSV writer, and iterates over lines from read_lines_zst. 
-# For each line, it attempts to parse it as JSON, extract the desired fields, and write them to the CSV file. 
-# It logs progress and handles errors like JSON decode errors or missing keys.
+# Handles command-line arguments, sets up the output writer, and iterates over the parsed blocks in order.
+# It writes the formatted rows to the output file, logs progress every 100,000 lines and reports lines that could not be parsed
+# (JSON decode errors or missing keys) without stopping the conversion. It checkpoints the CSV output and maintains the day index.
 
 if __name__ == "__main__":
-	input_file_path = sys.argv[1]
-	output_file_path = sys.argv[2]
-	fields = sys.argv[3].split(",")
+	parser = argparse.ArgumentParser(description="Convert a Pushshift .zst NDJSON dump to CSV, Parquet or Arrow.")
+	parser.add_argument("input", help="Input .zst file")
+	parser.add_argument("output", help="Output file")
+	parser.add_argument("fields", help="Comma separated list of fields to extract")
+	parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes parsing JSON (1 = parse on the main thread)")
+	parser.add_argument("--block-size", type=int, default=2**24, help="Decompressed bytes per block handed to a worker")
+	parser.add_argument("--format", choices=["csv", "parquet", "arrow"], default="csv", help="Output format")
+	parser.add_argument("--row-group-size", type=int, default=1000000, help="Rows per Parquet row group")
+	parser.add_argument("--subreddits", help="Only keep these subreddits (comma separated or @file)")
+	parser.add_argument("--after", help="Only keep records created at or after this date (YYYY-MM-DD, UTC) or unix timestamp")
+	parser.add_argument("--before", help="Only keep records created before this date (YYYY-MM-DD, UTC) or unix timestamp")
+	parser.add_argument("--authors", help="Only keep records by these authors (comma separated or @file)")
+	parser.add_argument("--exclude-authors", help="Drop records by these authors, e.g. [deleted],AutoModerator (comma separated or @file)")
+	parser.add_argument("--min-score", type=int, help="Only keep records with at least this score")
+	parser.add_argument("--checkpoint-every", type=int, default=0, help="Lines between checkpoints of the CSV output (0 = never, 1,000,000 with --resume)")
+	parser.add_argument("--resume", action="store_true", help="Continue the conversion from the last checkpoint")
+	parser.add_argument("--build-index", action="store_true", help="Build or extend the day index <input>.idx.json while converting")
+	parser.add_argument("--use-index", action="store_true", help="Seek to --after and stop after --before using the day index (and extend it)")
+	args = parser.parse_args()
+
+	input_file_path = args.input
+	output_file_path = args.output
+	checkpoint_path = output_file_path + '.checkpoint.json'
+	fields = args.fields.split(",")
+	max_pending = max(2, args.workers * 2)
+	record_filter = RecordFilter(
+		subreddits=parse_names(args.subreddits), after=parse_timestamp(args.after), before=parse_timestamp(args.before),
+		authors=parse_names(args.authors), exclude_authors=parse_names(args.exclude_authors), min_score=args.min_score)
+	checkpoint_every = args.checkpoint_every or (1000000 if args.resume else 0)
+	checkpointing = args.format == 'csv' and checkpoint_every > 0
+	if args.resume and args.format != 'csv':
+		parser.error("--resume is only supported for CSV output")
 
 	file_size = os.stat(input_file_path).st_size
 	file_lines = 0
 	file_bytes_processed = 0
-	line = None
 	created = None
 	bad_lines = 0
-	output_file = open(output_file_path, "w", encoding='utf-8', newline="")
-	writer = csv.writer(output_file)
-	writer.writerow(fields)
-	try:
-		for line, file_bytes_processed in read_lines_zst(input_file_path):
-			try:
-				obj = json.loads(line)
-				output_obj = []
-				for field in fields:
-					output_obj.append(str(obj[field]).encode("utf-8", errors='replace').decode())
-				writer.writerow(output_obj)
+	skipped_lines = 0
+	next_log = 100000
+	resume_bytes = None
+	day_index = DayIndex(input_file_path) if args.build_index or args.use_index else None
+	frames = day_index.frames if day_index is not None else zstd_frames(input_file_path)
+	position = start_position = (frames[0][0] if frames else 0, 0)
+
+	if args.resume:
+		checkpoint = read_json(checkpoint_path)
+		if checkpoint is None:
+			log.info(f"No checkpoint found at {checkpoint_path}, starting from the beginning")
+		elif checkpoint['input_size'] != file_size or checkpoint['fields'] != fields:
+			parser.error(f"{checkpoint_path} was written for a different input file or field list")
+		elif checkpoint['complete']:
+			log.info(f"Conversion already complete : {checkpoint['lines']:,} : {checkpoint['bad_lines']:,}")
+			sys.exit(0)
+		else:
+			position = (checkpoint['frame_offset'], checkpoint['frame_bytes'])
+			file_lines, bad_lines, skipped_lines = checkpoint['lines'], checkpoint['bad_lines'], checkpoint['skipped_lines']
+			resume_bytes = checkpoint['output_bytes']
+			next_log = (file_lines // 100000 + 1) * 100000
+			log.info(f"Resuming after {file_lines:,} lines at frame offset {position[0]:,} + {position[1]:,} bytes")
+	elif args.use_index and record_filter.after is not None:
+		position = day_index.seek(record_filter.after) or position
+		log.info(f"Starting at frame offset {position[0]:,} + {position[1]:,} bytes from the day index")
+	if day_index is not None:
+		day_index.from_start = position == start_position
+	stop_after = record_filter.before + 86400 if args.use_index and record_filter.before is not None else None
 
-				created = datetime.utcfromtimestamp(int(obj['created_utc']))
-			except json.JSONDecodeError as err:
-				bad_lines += 1
-			file_lines += 1
-			if file_lines % 100000 == 0:
-				log.info(f"{created.strftime('%Y-%m-%d %H:%M:%S')} : {file_lines:,} : {bad_lines:,} : {(file_bytes_processed / file_size) * 100:.0f}%")
-	except KeyError as err:
-		log.info(f"Object has no key: {err}")
-		log.info(line)
+	output_file = open_sink(output_file_path, fields, args.format, args.row_group_size, resume_bytes)
+	reader = BlockReader(input_file_path, args.block_size, max_pending, frames, position)
+	reader.start()
+	last_checkpoint = file_lines
+	metrics = get_metrics('tocsv.py')
+	metrics.start('convert')
+	start_offset = file_bytes_processed = position[0]
+	try:
+		for result, (file_bytes_processed, block_end) in parse_blocks(reader, fields, args.workers, max_pending, args.format, record_filter):
+			output_file.write(result.output)
+			file_lines += result.lines
+			skipped_lines += result.skipped
+			metrics.count('rows_in', result.lines)
+			metrics.count('rows_out', result.lines - result.bad_lines - result.skipped)
+			metrics.count('bad_rows', result.bad_lines)
+			metrics.count('skipped_rows', result.skipped)
+			if result.bad_lines:
+				if bad_lines == 0:
+					log.info(f"Could not parse line: {result.first_error[0]}")
+					log.info(result.first_error[1])
+				bad_lines += result.bad_lines
+			if result.created is not None:
+				created = datetime.utcfromtimestamp(result.created)
+			if day_index is not None:
+				day_index.add_block(position, result.last_created)
+			position = block_end
+			if checkpointing and file_lines - last_checkpoint >= checkpoint_every:
+				save_checkpoint(checkpoint_path, input_file_path, fields, args.format, position, file_lines, bad_lines, skipped_lines,
+					result.last_created, output_file.sync())
+				if day_index is not None:
+					day_index.try_save()
+				last_checkpoint = file_lines
+			if file_lines >= next_log:
+				created_str = created.strftime('%Y-%m-%d %H:%M:%S') if created is not None else '-'
+				log.info(f"{created_str} : {file_lines:,} : {bad_lines:,} : {(file_bytes_processed / file_size) * 100:.0f}%")
+				next_log = (file_lines // 100000 + 1) * 100000
+			if stop_after is not None and result.last_created is not None and result.last_created >= stop_after:
+				log.info("Reached the end of the --before window")
+				break
+		else:
+			if checkpointing:
+				save_checkpoint(checkpoint_path, input_file_path, fields, args.format, position, file_lines, bad_lines, skipped_lines,
+					None, output_file.sync(), complete=True)
 	except Exception as err:
 		log.info(err)
-		log.info(line)
+	finally:
+		output_file.close()
+	metrics.count('bytes_read', max(0, file_bytes_processed - start_offset))
+	metrics.count('bytes_decompressed', reader.bytes_decompressed)
+	metrics.stop('convert')
 
-	output_file.close()
-	log.info(f"Complete : {file_lines:,} : {bad_lines:,}")
+	if day_index is not None:
+		day_index.try_save()
+	log.info(f"Complete : {file_lines:,} : {bad_lines:,} : {file_lines - bad_lines - skipped_lines:,} kept")
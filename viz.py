@@ -3,20 +3,25 @@
 # to understand public opinion, track sentiment trends over time, and identify influential authors or contributors in online discussions. 
 # It's particularly relevant for analyzing discussions around polarizing topics, as shown by the focus on climate change-related subreddits in this case.
 
-import pandas as pd
+import os
 import matplotlib.pyplot as plt
 import seaborn as sns
-from pandas.plotting import register_matplotlib_converters
-
-# Load the dataset
-df = pd.read_csv('path_to_your_file.csv')
-
-# Convert 'comm_date' to datetime and extract date for daily aggregation
-df['comm_date'] = pd.to_datetime(df['comm_date'])
-df['date'] = df['comm_date'].dt.date
-
-# Aggregate the VADER scores by day and subreddit
-daily_agg = df.groupby(['subreddit', 'date'])[['vader.title', 'vader.comment']].mean().reset_index()
+from rollup import SentimentRollup
+from instrument import get_metrics
+
+# Stage timings and memory of the plots; set GSI_METRICS=metrics.json to save them (see instrument.py)
+metrics = get_metrics('viz.py')
+
+# Daily VADER scores per subreddit come from the sentiment rollup (see rollup.py), not from re-reading the dataset.
+# Build it once with: python rollup.py path_to_your_file.csv sentiment_rollup.sqlite
+# Use freq='h', 'W' or 'M' for hourly, weekly or monthly averages.
+ROLLUP_PATH = 'sentiment_rollup.sqlite'
+# SQLite would create an empty database for a missing file and the plots would come out blank
+if not os.path.exists(ROLLUP_PATH):
+    raise FileNotFoundError(f"{ROLLUP_PATH} not found; build it first with: python rollup.py path_to_your_file.csv {ROLLUP_PATH}")
+with metrics.stage('rollup_query'), SentimentRollup(ROLLUP_PATH) as rollup:
+    daily_agg = rollup.means(freq='D')
+daily_agg['date'] = daily_agg['date'].dt.date
 
 # Setting a minimalist style for the plot
 sns.set(style="whitegrid", palette="pastel")
@@ -35,21 +40,31 @@ plt.tight_layout()
 plt.show()
 
 #%%
-import pandas as pd
+import os
 import matplotlib.pyplot as plt
 import seaborn as sns
-from wordcloud import WordCloud, STOPWORDS
-from pandas.plotting import register_matplotlib_converters
-
-# Load the dataset
-df = pd.read_csv('path_to_your_file.csv')
-
-# Convert 'comm_date' to datetime and extract date for daily aggregation
-df['comm_date'] = pd.to_datetime(df['comm_date'])
-df['date'] = df['comm_date'].dt.date
-
-# Aggregate the VADER scores by day and subreddit
-daily_agg = df.groupby(['subreddit', 'date'])[['vader.title', 'vader.comment']].mean().reset_index()
+from wordcloud import STOPWORDS
+import numpy as np
+from table_io import read_table
+from rollup import SentimentRollup
+from ngrams import NgramExtractor
+from clouds import render, slice_counts, top_frequencies
+from instrument import get_metrics
+
+metrics = get_metrics('viz.py')
+
+# Load the dataset (CSV, Parquet or Arrow), reading only the columns the word clouds and author tables use
+with metrics.stage('load'):
+    df = read_table('path_to_your_file.csv', columns=['author', 'comment', 'vader.comment'])
+    metrics.count('rows_in', len(df))
+
+# Daily VADER scores per subreddit, from the sentiment rollup (see the first cell)
+ROLLUP_PATH = 'sentiment_rollup.sqlite'
+if not os.path.exists(ROLLUP_PATH):
+    raise FileNotFoundError(f"{ROLLUP_PATH} not found; build it first with: python rollup.py path_to_your_file.csv {ROLLUP_PATH}")
+with metrics.stage('rollup_query'), SentimentRollup(ROLLUP_PATH) as rollup:
+    daily_agg = rollup.means(freq='D', subreddits=['climatechange', 'climateskeptics'])
+daily_agg['date'] = daily_agg['date'].dt.date
 
 # Bar Plots for Specific Subreddits
 # Filters data for specific subreddits ('climatechange' and 'climateskeptics').
@@ -74,14 +89,17 @@ def save_plot(data, title, color, file_path):
     plt.savefig(file_path)
     plt.show()
 
-save_plot(climatechange_data, 'Daily Aggregated VADER Scores in r/climatechange', 'skyblue', 'climatechange_bar_plot.png')
-save_plot(climateskeptics_data, 'Daily Aggregated VADER Scores in r/climateskeptics - Adjusted Date Range', 'coral', 'climateskeptics_bar_plot.png')
+with metrics.stage('bar_plots'):
+    save_plot(climatechange_data, 'Daily Aggregated VADER Scores in r/climatechange', 'skyblue', 'climatechange_bar_plot.png')
+    save_plot(climateskeptics_data, 'Daily Aggregated VADER Scores in r/climateskeptics - Adjusted Date Range', 'coral', 'climateskeptics_bar_plot.png')
 
 
 # Word Cloud Generation
 # Generates word clouds for positive and negative comments from the top 30 authors by comment count.
 # Custom stopwords are used to filter out common but uninformative words.
 # Two word clouds are generated, one for positive and one for negative sentiment, and are saved as image files.
+# The words of the comments are counted once into a sparse matrix and each cloud is drawn from its slice's counts
+# (see clouds.py), instead of joining all comments into one string for WordCloud to split again.
 
 # Filtering the top 30 authors by number of comments
 # Aggregates and saves data about these authors, including the count of comments and average VADER score.
@@ -89,20 +107,29 @@ top_authors = df['author'].value_counts().head(30).index
 top_authors_data = df[df['author'].isin(top_authors)]
 
 # Word Cloud Generation
-custom_stopwords = set(STOPWORDS).update({"people", "will", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten"})
-def generate_wordcloud(text, file_path, color):
-    wordcloud = WordCloud(stopwords=custom_stopwords, background_color="white", contour_width=3, contour_color=color, width=800, height=800, colormap="spring").generate(text)
+custom_stopwords = set(STOPWORDS) | {"people", "will", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten"}
+word_counter = NgramExtractor(n=(1,), stop_words=custom_stopwords, distinct=False)
+with metrics.stage('word_counts'):
+    word_counts = word_counter.transform_all(top_authors_data['comment'])
+    words = word_counter.decode()['ngram'].to_numpy(dtype=object)
+
+    # One pass over the rows sums the word counts of both sentiment slices
+    sentiment_slice = np.where(top_authors_data['vader.comment'] > 0, 'positive', np.where(top_authors_data['vader.comment'] < 0, 'negative', None))
+    slices, slice_word_counts = slice_counts(word_counts, sentiment_slice)
+    metrics.count('rows_in', len(top_authors_data))
+
+def generate_wordcloud(counts, file_path, color):
+    wordcloud = render(top_frequencies(counts, words, max_words=200), contour_width=3, contour_color=color, colormap="spring")
     plt.figure(figsize=(10, 10))
     plt.imshow(wordcloud, interpolation='bilinear')
     plt.axis("off")
     plt.savefig(file_path)
     plt.show()
 
-positive_text = " ".join(comment for comment in top_authors_data[top_authors_data['vader.comment'] > 0]['comment'])
-negative_text = " ".join(comment for comment in top_authors_data[top_authors_data['vader.comment'] < 0]['comment'])
-
-generate_wordcloud(positive_text, 'positive_comments_wordcloud.png', 'steelblue')
-generate_wordcloud(negative_text, 'negative_comments_wordcloud.png', 'firebrick')
+with metrics.stage('word_clouds'):
+    for name, color in (('positive', 'steelblue'), ('negative', 'firebrick')):
+        if name in slices:
+            generate_wordcloud(slice_word_counts[slices.get_loc(name)], f'{name}_comments_wordcloud.png', color)
 
 # Aggregating and saving top authors data
 def aggregate_and_save(data, sentiment, file_path):
@@ -111,5 +138,6 @@ def aggregate_and_save(data, sentiment, file_path):
         avg_vader=('vader.comment', 'mean')
     ).sort_values(by=f'avg_vader', ascending=(sentiment == 'negative')).head(30).to_csv(file_path)
 
-aggregate_and_save(top_authors_data[top_authors_data['vader.comment'] > 0], 'positive', 'top_positive_authors.csv')
-aggregate_and_save(top_authors_data[top_authors_data['vader.comment'] < 0], 'negative', 'top_negative_authors.csv')
+with metrics.stage('top_authors'):
+    aggregate_and_save(top_authors_data[top_authors_data['vader.comment'] > 0], 'positive', 'top_positive_authors.csv')
+    aggregate_and_save(top_authors_data[top_authors_data['vader.comment'] < 0], 'negative', 'top_negative_authors.csv')